@@ -43,7 +43,6 @@ from geonode.api.paginator import CrossSiteXHRPaginator
 from geonode.api.authorization import GeoNodeStyleAuthorization, ApiLockdownAuthorization, \
     GroupAuthorization, GroupProfileAuthorization
 from geonode.qgis_server.models import QGISServerStyle
-from guardian.shortcuts import get_objects_for_user
 from tastypie.bundle import Bundle
 
 from geonode.base.models import ResourceBase
@@ -64,7 +63,8 @@ from tastypie.constants import ALL, ALL_WITH_RELATIONS
 from tastypie.utils import trailing_slash
 
 from geonode.utils import check_ogc_backend
-from geonode.security.utils import get_visible_resources
+from geonode.base.facets import get_resources_counts
+from geonode.security.utils import get_visible_resources, get_viewable_resources
 
 FILTER_TYPES = {
     'layer': Layer,
@@ -78,52 +78,11 @@ class CountJSONSerializer(Serializer):
     """Custom serializer to post process the api and add counts"""
 
     def get_resources_counts(self, options):
-        if settings.SKIP_PERMS_FILTER:
-            resources = ResourceBase.objects.all()
-        else:
-            resources = get_objects_for_user(
-                options['user'],
-                'base.view_resourcebase'
-            )
-
-        resources = get_visible_resources(
-            resources,
+        return get_resources_counts(
             options['user'],
-            admin_approval_required=settings.ADMIN_MODERATE_UPLOADS,
-            unpublished_not_visible=settings.RESOURCE_PUBLISHING,
-            private_groups_not_visibile=settings.GROUP_PRIVATE_RESOURCES)
-
-        subtypes = []
-        if resources and resources.count() > 0:
-            if options['title_filter']:
-                resources = resources.filter(title__icontains=options['title_filter'])
-            if options['type_filter']:
-                _type_filter = options['type_filter']
-
-                for label, app in apps.app_configs.items():
-                    if hasattr(app, 'type') and app.type == 'GEONODE_APP':
-                        if hasattr(app, 'default_model'):
-                            _model = apps.get_model(label, app.default_model)
-                            if issubclass(_model, _type_filter):
-                                subtypes.append(
-                                    resources.filter(
-                                        polymorphic_ctype__model=_model.__name__.lower()))
-
-                if not isinstance(_type_filter, str):
-                    _type_filter = _type_filter.__name__.lower()
-                resources = resources.filter(polymorphic_ctype__model=_type_filter)
-
-        counts = list()
-        if subtypes:
-            for subtype in subtypes:
-                counts.append(
-                    subtype.values(options['count_type']).annotate(count=Count(options['count_type'])).first()
-                )
-        else:
-            counts = list(resources.values(options['count_type']).annotate(count=Count(options['count_type'])))
-
-        return dict(
-            [(c[options['count_type']], c['count']) for c in counts if c and c['count'] and options['count_type']])
+            options.get('count_type'),
+            title_filter=options.get('title_filter'),
+            type_filter=options.get('type_filter'))
 
     def to_json(self, data, options=None):
         options = options or {}
@@ -277,8 +236,7 @@ class TopicCategoryResource(TypeFilteredResource):
 
     def dehydrate_layers_count(self, bundle):
         request = bundle.request
-        obj_with_perms = get_objects_for_user(request.user,
-                                              'base.view_resourcebase').filter(polymorphic_ctype__model='layer')
+        obj_with_perms = get_viewable_resources(request.user).filter(polymorphic_ctype__model='layer')
         filter_set = bundle.obj.resourcebase_set.filter(id__in=obj_with_perms.values('id'))
 
         if not settings.SKIP_PERMS_FILTER:
@@ -501,18 +459,15 @@ class ProfileResource(TypeFilteredResource):
         return email
 
     def dehydrate_layers_count(self, bundle):
-        obj_with_perms = get_objects_for_user(bundle.request.user,
-                                              'base.view_resourcebase').filter(polymorphic_ctype__model='layer')
+        obj_with_perms = get_viewable_resources(bundle.request.user).filter(polymorphic_ctype__model='layer')
         return bundle.obj.resourcebase_set.filter(id__in=obj_with_perms.values('id')).distinct().count()
 
     def dehydrate_maps_count(self, bundle):
-        obj_with_perms = get_objects_for_user(bundle.request.user,
-                                              'base.view_resourcebase').filter(polymorphic_ctype__model='map')
+        obj_with_perms = get_viewable_resources(bundle.request.user).filter(polymorphic_ctype__model='map')
         return bundle.obj.resourcebase_set.filter(id__in=obj_with_perms.values('id')).distinct().count()
 
     def dehydrate_documents_count(self, bundle):
-        obj_with_perms = get_objects_for_user(bundle.request.user,
-                                              'base.view_resourcebase').filter(polymorphic_ctype__model='document')
+        obj_with_perms = get_viewable_resources(bundle.request.user).filter(polymorphic_ctype__model='document')
         return bundle.obj.resourcebase_set.filter(id__in=obj_with_perms.values('id')).distinct().count()
 
     def dehydrate_avatar_100(self, bundle):
@@ -17,13 +17,108 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 #########################################################################
+import json
+import base64
 
 from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 from tastypie.exceptions import BadRequest
 from tastypie.paginator import Paginator
 
+# Orderings supported by the keyset pagination, completed by an unique tie-breaker
+KEYSET_ORDERINGS = {
+    (): ('id', ),
+    ('id', ): ('id', ),
+    ('-id', ): ('-id', ),
+    ('date', ): ('date', 'id'),
+    ('-date', ): ('-date', '-id'),
+    ('date', 'id'): ('date', 'id'),
+    ('-date', '-id'): ('-date', '-id'),
+}
+
+
+def get_keyset_ordering(queryset):
+    """
+    Returns the unique ordering used to paginate the queryset by keyset.
+    """
+    try:
+        return KEYSET_ORDERINGS[tuple(queryset.query.order_by)]
+    except KeyError:
+        raise BadRequest("Cursor pagination is only available when ordering by date or id.")
+
+
+def get_keyset_filter(ordering, values):
+    """
+    Builds the filter selecting the rows which follow 'values' in the given ordering,
+    e.g. for ('-date', '-id'): date < value_0 OR (date = value_0 AND id < value_1)
+    """
+    keyset_filter = Q()
+    for idx, field in enumerate(ordering):
+        lookup = "{}__{}".format(field.lstrip('-'), 'lt' if field.startswith('-') else 'gt')
+        clause = Q(**{lookup: values[idx]})
+        for _field, _value in zip(ordering[:idx], values[:idx]):
+            clause &= Q(**{_field.lstrip('-'): _value})
+        keyset_filter |= clause
+    return keyset_filter
+
+
+def get_keyset_values(obj, ordering):
+    return [getattr(obj, field.lstrip('-')) for field in ordering]
+
+
+def encode_cursor(values):
+    _values = [_v.isoformat() if hasattr(_v, 'isoformat') else _v for _v in values]
+    return base64.urlsafe_b64encode(json.dumps(_values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, ordering):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        if len(values) != len(ordering):
+            raise ValueError(cursor)
+        decoded = []
+        for field, _v in zip(ordering, values):
+            if field.lstrip('-') == 'date':
+                _v = parse_datetime(_v)
+                if _v is None:
+                    raise ValueError(cursor)
+                decoded.append(_v)
+            else:
+                decoded.append(int(_v))
+        return decoded
+    except (ValueError, TypeError, UnicodeError):
+        raise BadRequest("Invalid cursor provided.")
+
+
+def iterate_keyset(queryset, chunk_size):
+    """
+    Iterates over the queryset by chunks of 'chunk_size' objects, each one
+    fetched by a keyset query, so that neither OFFSET scans nor the whole
+    result set are ever held.
+    """
+    ordering = get_keyset_ordering(queryset)
+    queryset = queryset.order_by(*ordering)
+    values = None
+    while True:
+        chunk = queryset.filter(get_keyset_filter(ordering, values)) if values else queryset
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        values = get_keyset_values(chunk[-1], ordering)
+
 
 class CrossSiteXHRPaginator(Paginator):
+    """
+    Besides the standard OFFSET/LIMIT pagination, supports:
+
+        * ``total_count=false``: skips the ``count()`` of the whole result set.
+        * ``cursor``: keyset pagination on ``(date, id)`` or ``id``; the first page is
+          requested with an empty cursor, the following ones with ``meta.next_cursor``.
+    """
 
     def get_limit(self):
         """
@@ -80,3 +175,59 @@ class CrossSiteXHRPaginator(Paginator):
             raise BadRequest("Invalid offset provided. Please provide a positive integer >= 0.")
 
         return offset
+
+    def count_requested(self):
+        return str(self.request_data.get('total_count', 'true')).lower() not in ('false', '0', 'no')
+
+    def get_count(self):
+        if not self.count_requested():
+            return None
+        return super(CrossSiteXHRPaginator, self).get_count()
+
+    def get_next(self, limit, offset, count):
+        if count is None:
+            if not self.objects[offset + limit:offset + limit + 1].exists():
+                return None
+            return self._generate_uri(limit, offset + limit)
+        return super(CrossSiteXHRPaginator, self).get_next(limit, offset, count)
+
+    def _generate_cursor_uri(self, limit, cursor):
+        if self.resource_uri is None:
+            return None
+
+        request_params = self.request_data.copy()
+        for key in ('limit', 'offset', 'cursor'):
+            if key in request_params:
+                del request_params[key]
+        request_params.update({'limit': str(limit), 'cursor': cursor})
+        return '%s?%s' % (self.resource_uri, request_params.urlencode())
+
+    def page(self):
+        if 'cursor' not in self.request_data:
+            return super(CrossSiteXHRPaginator, self).page()
+
+        limit = self.get_limit()
+        ordering = get_keyset_ordering(self.objects)
+        objects = self.objects.order_by(*ordering)
+        cursor = self.request_data.get('cursor')
+        if cursor:
+            objects = objects.filter(get_keyset_filter(ordering, decode_cursor(cursor, ordering)))
+
+        next_cursor = None
+        if limit:
+            remaining = objects
+            objects = objects[:limit]
+            # evaluates the page, which stays cached on the sliced queryset
+            page_objects = list(objects)
+            if len(page_objects) == limit and remaining[limit:limit + 1].exists():
+                next_cursor = encode_cursor(get_keyset_values(page_objects[-1], ordering))
+
+        return {
+            self.collection_name: objects,
+            'meta': {
+                'limit': limit,
+                'total_count': self.get_count() if 'total_count' in self.request_data else None,
+                'next_cursor': next_cursor,
+                'next': self._generate_cursor_uri(limit, next_cursor) if next_cursor else None,
+            },
+        }
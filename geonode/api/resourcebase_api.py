@@ -23,7 +23,7 @@ import logging
 
 from django.urls import resolve
 from django.db.models import Q
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.conf import settings
 from django.contrib.staticfiles.templatetags import staticfiles
 from tastypie.authentication import MultiAuthentication, SessionAuthentication
@@ -56,7 +56,7 @@ from geonode.base.models import HierarchicalKeyword
 from geonode.base.bbox_utils import filter_bbox
 from geonode.groups.models import GroupProfile
 from geonode.utils import check_ogc_backend
-from geonode.security.utils import get_visible_resources
+from geonode.security.utils import get_visible_resources, get_resources_ids_with_perm
 from .authentication import OAuthAuthentication
 from .authorization import GeoNodeAuthorization, GeonodeApiKeyAuthentication
 
@@ -68,7 +68,7 @@ from .api import (
     TopicCategoryResource,
     GroupResource,
     FILTER_TYPES)
-from .paginator import CrossSiteXHRPaginator
+from .paginator import CrossSiteXHRPaginator, get_keyset_ordering, iterate_keyset
 from django.utils.translation import gettext as _
 
 if settings.HAYSTACK_SEARCH:
@@ -84,6 +84,9 @@ LAYER_SUBTYPES = {
 }
 FILTER_TYPES.update(LAYER_SUBTYPES)
 
+# Number of objects fetched by each query of the streamed lists
+STREAM_CHUNK_SIZE = 200
+
 
 class CommonMetaApi:
     authorization = GeoNodeAuthorization()
@@ -159,6 +162,19 @@ class CommonModelApi(ModelResource):
         'dirty_state',
     ]
 
+    # Related objects eagerly loaded along with the listed resources,
+    # so that 'format_objects' does not hit the database once per object.
+    SELECT_RELATED = [
+        'owner',
+        'category',
+        'group',
+    ]
+    PREFETCH_RELATED = [
+        'keywords',
+        'regions',
+        'curatedthumbnail',
+    ]
+
     def build_filters(self, filters=None, ignore_bad_filters=False, **kwargs):
         if filters is None:
             filters = {}
@@ -567,7 +583,8 @@ class CommonModelApi(ModelResource):
         objects = self.obj_get_list(
             bundle=base_bundle,
             **self.remove_api_resource_names(kwargs))
-        sorted_objects = self.apply_sorting(objects, options=request.GET)
+        sorted_objects = self.apply_eager_loading(
+            self.apply_sorting(objects, options=request.GET))
 
         paginator = self._meta.paginator_class(
             request.GET,
@@ -585,6 +602,56 @@ class CommonModelApi(ModelResource):
         return self.create_response(
             request, to_be_serialized, response_objects=objects)
 
+    def apply_eager_loading(self, objects):
+        """
+        Loads the related objects declared by 'SELECT_RELATED' and 'PREFETCH_RELATED'
+        with a fixed number of queries, whatever the size of the page.
+        """
+        return objects.select_related(
+            *self.SELECT_RELATED).prefetch_related(
+                *self.PREFETCH_RELATED)
+
+    def get_group_profiles(self, objects):
+        """
+        Returns the GroupProfiles of the objects groups, indexed by slug.
+        """
+        slugs = set(obj.group.name for obj in objects if obj.group)
+        return {
+            group_profile.slug: group_profile for group_profile in GroupProfile.objects.filter(slug__in=slugs)
+        }
+
+    def get_stream(self, request, **kwargs):
+        """
+        Returns the whole filtered list of resources as newline delimited JSON.
+
+        The objects are fetched by keyset chunks and serialized as soon as they
+        are available, so that the complete list is never built in memory.
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        base_bundle = self.build_bundle(request=request)
+        objects = self.obj_get_list(
+            bundle=base_bundle,
+            **self.remove_api_resource_names(kwargs))
+        sorted_objects = self.apply_eager_loading(
+            self.apply_sorting(objects, options=request.GET))
+        # fail before the response is started when the ordering can't be paginated
+        get_keyset_ordering(sorted_objects)
+
+        def _stream():
+            for chunk in iterate_keyset(sorted_objects, STREAM_CHUNK_SIZE):
+                allowed_ids = get_resources_ids_with_perm(
+                    request.user,
+                    [obj.id for obj in chunk],
+                    'view_resourcebase')
+                for formatted_obj in self.format_objects([obj for obj in chunk if obj.id in allowed_ids]):
+                    yield self._meta.serializer.to_json(formatted_obj) + '\n'
+
+        self.log_throttled_access(request)
+        return StreamingHttpResponse(_stream(), content_type='application/x-ndjson')
+
     def format_objects(self, objects):
         """
         Format the objects for output in a response.
@@ -636,9 +703,10 @@ class CommonModelApi(ModelResource):
         filtered_objects_ids = None
         try:
             if data['objects']:
-                filtered_objects_ids = [
-                    item.id for item in data['objects'] if request.user.has_perm(
-                        'view_resourcebase', item.get_self_resource())]
+                filtered_objects_ids = get_resources_ids_with_perm(
+                    request.user,
+                    [item.id for item in data['objects']],
+                    'view_resourcebase')
         except Exception:
             pass
 
@@ -667,15 +735,19 @@ class CommonModelApi(ModelResource):
             **response_kwargs)
 
     def prepend_urls(self):
+        urls = [
+            url(r"^(?P<resource_name>%s)/stream%s$" % (
+                self._meta.resource_name, trailing_slash()
+            ),
+                self.wrap_view('get_stream'), name="api_get_stream"),
+        ]
         if settings.HAYSTACK_SEARCH:
-            return [
+            urls.append(
                 url(r"^(?P<resource_name>%s)/search%s$" % (
                     self._meta.resource_name, trailing_slash()
                 ),
-                    self.wrap_view('get_search'), name="api_get_search"),
-            ]
-        else:
-            return []
+                    self.wrap_view('get_search'), name="api_get_search"))
+        return urls
 
 
 class ResourceBaseResource(CommonModelApi):
@@ -740,6 +812,7 @@ class LayerResource(CommonModelApi):
         Formats the object.
         """
         formatted_objects = []
+        group_profiles = self.get_group_profiles(objects)
         for obj in objects:
             # convert the object to a dict using the standard values.
             # includes other values
@@ -756,10 +829,7 @@ class LayerResource(CommonModelApi):
                 formatted_obj['category__gn_description'] = _(obj.category.gn_description)
             if obj.group:
                 formatted_obj['group'] = obj.group
-                try:
-                    formatted_obj['group_name'] = GroupProfile.objects.get(slug=obj.group.name)
-                except GroupProfile.DoesNotExist:
-                    formatted_obj['group_name'] = obj.group
+                formatted_obj['group_name'] = group_profiles.get(obj.group.name, obj.group)
 
             formatted_obj['keywords'] = [k.name for k in obj.keywords.all()] if obj.keywords else []
             formatted_obj['regions'] = [r.name for r in obj.regions.all()] if obj.regions else []
@@ -811,9 +881,10 @@ class LayerResource(CommonModelApi):
             'url'
         ]
 
+        # filter in memory to take advantage of the prefetched links
         links = obj.link_set.all()
         if link_types:
-            links = links.filter(link_type__in=link_types)
+            links = [lnk for lnk in links if lnk.link_type in link_types]
         for lnk in links:
             formatted_link = model_to_dict(lnk, fields=link_fields)
             dehydrated.append(formatted_link)
@@ -915,6 +986,14 @@ class LayerResource(CommonModelApi):
     VALUES = CommonModelApi.VALUES[:]
     VALUES.append('typename')
 
+    SELECT_RELATED = CommonModelApi.SELECT_RELATED + ['remote_service']
+    if check_ogc_backend(geoserver.BACKEND_PACKAGE):
+        SELECT_RELATED.append('default_style')
+    PREFETCH_RELATED = CommonModelApi.PREFETCH_RELATED + [
+        'link_set',
+        'attribute_set',
+    ]
+
     class Meta(CommonMetaApi):
         paginator_class = CrossSiteXHRPaginator
         queryset = Layer.objects.distinct().order_by('-date')
@@ -947,6 +1026,7 @@ class MapResource(CommonModelApi):
         :param objects: Map objects
         """
         formatted_objects = []
+        group_profiles = self.get_group_profiles(objects)
         for obj in objects:
             # convert the object to a dict using the standard values.
             formatted_obj = model_to_dict(obj, fields=self.VALUES)
@@ -958,10 +1038,7 @@ class MapResource(CommonModelApi):
                 formatted_obj['category__gn_description'] = _(obj.category.gn_description)
             if obj.group:
                 formatted_obj['group'] = obj.group
-                try:
-                    formatted_obj['group_name'] = GroupProfile.objects.get(slug=obj.group.name)
-                except GroupProfile.DoesNotExist:
-                    formatted_obj['group_name'] = obj.group
+                formatted_obj['group_name'] = group_profiles.get(obj.group.name, obj.group)
 
             formatted_obj['keywords'] = [k.name for k in obj.keywords.all()] if obj.keywords else []
             formatted_obj['regions'] = [r.name for r in obj.regions.all()] if obj.regions else []
@@ -974,7 +1051,7 @@ class MapResource(CommonModelApi):
             formatted_obj['online'] = True
 
             # get map layers
-            map_layers = obj.layers
+            map_layers = obj.layer_set.all()
             formatted_layers = []
             map_layer_fields = [
                 'id',
@@ -1010,6 +1087,8 @@ class MapResource(CommonModelApi):
             formatted_objects.append(formatted_obj)
         return formatted_objects
 
+    PREFETCH_RELATED = CommonModelApi.PREFETCH_RELATED + ['layer_set']
+
     class Meta(CommonMetaApi):
         paginator_class = CrossSiteXHRPaginator
         queryset = Map.objects.distinct().order_by('-date')
@@ -1031,6 +1110,7 @@ class GeoAppResource(CommonModelApi):
         :param objects: GeoApp objects
         """
         formatted_objects = []
+        group_profiles = self.get_group_profiles(objects)
         for obj in objects:
             # convert the object to a dict using the standard values.
             formatted_obj = model_to_dict(obj, fields=self.VALUES)
@@ -1042,10 +1122,7 @@ class GeoAppResource(CommonModelApi):
                 formatted_obj['category__gn_description'] = obj.category.gn_description
             if obj.group:
                 formatted_obj['group'] = obj.group
-                try:
-                    formatted_obj['group_name'] = GroupProfile.objects.get(slug=obj.group.name)
-                except GroupProfile.DoesNotExist:
-                    formatted_obj['group_name'] = obj.group
+                formatted_obj['group_name'] = group_profiles.get(obj.group.name, obj.group)
 
             formatted_obj['keywords'] = [k.name for k in obj.keywords.all()] if obj.keywords else []
             formatted_obj['regions'] = [r.name for r in obj.regions.all()] if obj.regions else []
@@ -1094,6 +1171,7 @@ class DocumentResource(CommonModelApi):
         :param objects: Map objects
         """
         formatted_objects = []
+        group_profiles = self.get_group_profiles(objects)
         for obj in objects:
             # convert the object to a dict using the standard values.
             formatted_obj = model_to_dict(obj, fields=self.VALUES)
@@ -1105,10 +1183,7 @@ class DocumentResource(CommonModelApi):
                 formatted_obj['category__gn_description'] = _(obj.category.gn_description)
             if obj.group:
                 formatted_obj['group'] = obj.group
-                try:
-                    formatted_obj['group_name'] = GroupProfile.objects.get(slug=obj.group.name)
-                except GroupProfile.DoesNotExist:
-                    formatted_obj['group_name'] = obj.group
+                formatted_obj['group_name'] = group_profiles.get(obj.group.name, obj.group)
 
             formatted_obj['keywords'] = [k.name for k in obj.keywords.all()] if obj.keywords else []
             formatted_obj['regions'] = [r.name for r in obj.regions.all()] if obj.regions else []
@@ -17,15 +17,19 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 #########################################################################
+import json
+import base64
+
 from django.conf import settings
 
 from datetime import datetime, timedelta
 from tastypie.test import ResourceTestCaseMixin
 
 from django.urls import reverse
+from django.db import connection
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
-from django.test.utils import override_settings
+from django.test.utils import override_settings, CaptureQueriesContext
 
 from guardian.shortcuts import get_anonymous_user
 
@@ -526,3 +530,107 @@ class LockdownApiTests(ResourceTestCaseMixin, GeoNodeBaseTestSupport):
         resp = self.api_client.get(filter_url)
         self.assertValidJSONResponse(resp)
         self.assertEqual(len(self.deserialize(resp)['objects']), 5)
+
+
+class ListQueryCountApiTests(ResourceTestCaseMixin, GeoNodeBaseTestSupport):
+
+    """Prevent N+1 queries on the resources list endpoints"""
+
+    # Upper bound of the queries issued by a list request, whatever the page size
+    MAX_QUERIES = 40
+
+    def setUp(self):
+        super(ListQueryCountApiTests, self).setUp()
+        all_public()
+        self.api_client.client.login(username='admin', password='admin')
+
+    def _get_list(self, resource_name, limit):
+        list_url = reverse(
+            'api_dispatch_list',
+            kwargs={
+                'api_name': 'api',
+                'resource_name': resource_name})
+        with CaptureQueriesContext(connection) as context:
+            resp = self.api_client.get(list_url, data={'limit': limit})
+        self.assertValidJSONResponse(resp)
+        return len(self.deserialize(resp)['objects']), len(context.captured_queries)
+
+    def test_list_query_count(self):
+        for resource_name in ('base', 'layers', 'maps', 'documents'):
+            # warm up the content types and sessions caches
+            self._get_list(resource_name, 1)
+
+            _, single_queries = self._get_list(resource_name, 1)
+            count, page_queries = self._get_list(resource_name, 1000)
+            self.assertGreater(count, 1)
+            self.assertEqual(
+                single_queries, page_queries,
+                "'{}' list issues one or more queries per object".format(resource_name))
+            self.assertLessEqual(page_queries, self.MAX_QUERIES)
+
+
+class PaginationApiTests(ResourceTestCaseMixin, GeoNodeBaseTestSupport):
+
+    """Test the keyset pagination and the streamed lists"""
+
+    def setUp(self):
+        super(PaginationApiTests, self).setUp()
+        all_public()
+        self.api_client.client.login(username='admin', password='admin')
+        self.list_url = reverse(
+            'api_dispatch_list',
+            kwargs={
+                'api_name': 'api',
+                'resource_name': 'layers'})
+        self.stream_url = reverse(
+            'api_get_stream',
+            kwargs={
+                'api_name': 'api',
+                'resource_name': 'layers'})
+
+    def _get_all_ids(self):
+        resp = self.api_client.get(self.list_url, data={'limit': 1000})
+        self.assertValidJSONResponse(resp)
+        return [obj['id'] for obj in self.deserialize(resp)['objects']]
+
+    def test_no_total_count(self):
+        all_ids = self._get_all_ids()
+        resp = self.api_client.get(self.list_url, data={'limit': 2, 'total_count': 'false'})
+        self.assertValidJSONResponse(resp)
+        data = self.deserialize(resp)
+        self.assertIsNone(data['meta']['total_count'])
+        self.assertEqual([obj['id'] for obj in data['objects']], all_ids[:2])
+        self.assertIsNotNone(data['meta']['next'])
+
+    def test_cursor_pagination(self):
+        all_ids = self._get_all_ids()
+        ids = []
+        cursor = ''
+        while True:
+            resp = self.api_client.get(self.list_url, data={'limit': 3, 'cursor': cursor})
+            self.assertValidJSONResponse(resp)
+            data = self.deserialize(resp)
+            ids.extend(obj['id'] for obj in data['objects'])
+            cursor = data['meta']['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(ids, all_ids)
+
+        resp = self.api_client.get(self.list_url, data={'cursor': 'not-a-cursor'})
+        self.assertHttpBadRequest(resp)
+        resp = self.api_client.get(self.list_url, data={'cursor': '', 'order_by': 'title'})
+        self.assertHttpBadRequest(resp)
+        malformed_date = base64.urlsafe_b64encode(json.dumps(['not-a-date', 1]).encode('utf-8')).decode('ascii')
+        resp = self.api_client.get(self.list_url, data={'cursor': malformed_date, 'order_by': '-date'})
+        self.assertHttpBadRequest(resp)
+
+    def test_stream(self):
+        all_ids = self._get_all_ids()
+        resp = self.api_client.client.get(self.stream_url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(resp.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], all_ids)
+
+        resp = self.api_client.client.get(self.stream_url, data={'order_by': 'title'})
+        self.assertHttpBadRequest(resp)
@@ -176,6 +176,7 @@ class RegionAdmin(TabbedTranslationAdmin):
     list_display_links = ('name',)
     list_display = ('code', 'name', 'parent')
     search_fields = ('code', 'name',)
+    exclude = ('bbox_polygon',)
     group_fieldsets = True
 
 
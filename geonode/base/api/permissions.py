@@ -64,9 +64,8 @@ class ResourceBasePermissionsFilter(BaseFilterBackend):
         # We want to defer this import until runtime, rather than import-time.
         # See https://github.com/encode/django-rest-framework/issues/4608
         # (Also see #1624 for why we need to make this import explicitly)
-        from guardian.shortcuts import get_objects_for_user
         from geonode.base.models import ResourceBase
-        from geonode.security.utils import get_visible_resources
+        from geonode.security.utils import get_visible_resources, get_viewable_resources
 
         user = request.user
         # perm_format = '%(app_label)s.view_%(model_name)s'
@@ -78,11 +77,7 @@ class ResourceBasePermissionsFilter(BaseFilterBackend):
         if settings.SKIP_PERMS_FILTER:
             resources = ResourceBase.objects.all()
         else:
-            resources = get_objects_for_user(
-                user,
-                'base.view_resourcebase',
-                **self.shortcut_kwargs
-            )
+            resources = get_viewable_resources(user)
         logger.debug(f" user: {user} -- resources: {resources}")
 
         obj_with_perms = get_visible_resources(
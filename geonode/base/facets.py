@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2020 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+"""Aggregated facet counts for the search pages and the legacy API
+"""
+
+import json
+import hashlib
+import logging
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q, Count
+from django.contrib.auth import get_user_model
+
+from geonode.base.models import ResourceBase, HierarchicalKeyword
+from geonode.base.bbox_utils import filter_bbox
+from geonode.groups.models import GroupProfile
+from geonode.security.utils import get_visible_resources, get_viewable_resources
+
+logger = logging.getLogger(__name__)
+
+FACETS_CACHE_KEY = 'facets_{}_{}'
+
+LAYER_STORE_TYPES = {
+    'raster': 'coverageStore',
+    'vector': 'dataStore',
+    'remote': 'remoteStore',
+    'wms': 'wmsStore',
+}
+
+
+def _get_permission_class(user):
+    """
+    Users sharing the same permission class see exactly the same resources.
+    """
+    if not user or user.is_anonymous:
+        return 'anonymous'
+    if user.is_superuser:
+        return 'superuser'
+    return 'user_{}'.format(user.id)
+
+
+def _get_cache_key(user, *args):
+    digest = hashlib.md5(
+        json.dumps(args, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return FACETS_CACHE_KEY.format(_get_permission_class(user), digest)
+
+
+def _cached(user, compute, *args):
+    cache_key = _get_cache_key(user, *args)
+    result = cache.get(cache_key)
+    if result is None:
+        result = compute()
+        cache.set(cache_key, result, getattr(settings, 'FACETS_CACHE_TIMEOUT', 60))
+    return result
+
+
+def _get_geonode_apps_models():
+    _models = {}
+    for label, app in apps.app_configs.items():
+        if hasattr(app, 'type') and app.type == 'GEONODE_APP':
+            if hasattr(app, 'default_model'):
+                _models[app.default_model] = apps.get_model(label, app.default_model)
+    return _models
+
+
+def get_user_visible_resources(user):
+    """
+    Returns the ResourceBase objects visible to the user.
+
+    The visibility filter is applied once, as a subquery of the returned queryset,
+    which can then be further filtered and aggregated by type.
+    """
+    if settings.SKIP_PERMS_FILTER:
+        resources = ResourceBase.objects.all()
+    else:
+        resources = get_viewable_resources(user)
+    return get_visible_resources(
+        resources,
+        user,
+        admin_approval_required=settings.ADMIN_MODERATE_UPLOADS,
+        unpublished_not_visible=settings.RESOURCE_PUBLISHING,
+        private_groups_not_visibile=settings.GROUP_PRIVATE_RESOURCES)
+
+
+def get_facets_filters(query_params):
+    """
+    Extracts the facet filters from the request query parameters.
+    """
+    return {
+        'title': query_params.get('title__icontains', ''),
+        'extent': query_params.get('extent', None),
+        'keywords': query_params.getlist('keywords__slug__in', None),
+        'categories': query_params.getlist('category__identifier__in', None),
+        'regions': query_params.getlist('regions__name__in', None),
+        'owners': query_params.getlist('owner__username__in', None),
+        'date_gte': query_params.get('date__gte', None),
+        'date_lte': query_params.get('date__lte', None),
+        'date_range': query_params.get('date__range', None),
+    }
+
+
+def filter_resources(resources, filters):
+    """
+    Applies the facet filters to a ResourceBase queryset.
+    """
+    if filters.get('title'):
+        resources = resources.filter(title__icontains=filters['title'])
+    if filters.get('categories'):
+        resources = resources.filter(category__identifier__in=filters['categories'])
+    if filters.get('regions'):
+        resources = resources.filter(regions__name__in=filters['regions'])
+    if filters.get('owners'):
+        resources = resources.filter(owner__username__in=filters['owners'])
+    if filters.get('date_gte'):
+        resources = resources.filter(date__gte=filters['date_gte'])
+    if filters.get('date_lte'):
+        resources = resources.filter(date__lte=filters['date_lte'])
+    if filters.get('date_range'):
+        resources = resources.filter(date__range=filters['date_range'].split(','))
+    if filters.get('extent'):
+        resources = filter_bbox(resources, filters['extent'])
+    if filters.get('keywords'):
+        treeqs = HierarchicalKeyword.objects.none()
+        for keyword in filters['keywords']:
+            try:
+                kws = HierarchicalKeyword.objects.filter(name__iexact=keyword)
+                for kw in kws:
+                    treeqs = treeqs | HierarchicalKeyword.get_tree(kw)
+            except Exception:
+                # Ignore keywords not actually used?
+                pass
+        resources = resources.filter(Q(keywords__in=treeqs))
+    return resources
+
+
+def _count(**lookups):
+    # Resources may be duplicated by the keywords and regions joins
+    return Count('id', distinct=True, filter=Q(**lookups))
+
+
+def _compute_facets(user, filters, facet_type):
+    resources = filter_resources(get_user_visible_resources(user), filters)
+
+    if facet_type == 'geoapps':
+        geoapps_models = _get_geonode_apps_models()
+        if not geoapps_models:
+            return {}
+        return resources.aggregate(**{
+            name: _count(polymorphic_ctype__model=_model.__name__.lower())
+            for name, _model in geoapps_models.items()
+        })
+    elif facet_type == 'documents':
+        counts = resources.filter(
+            polymorphic_ctype__model='document').values(
+                'document__doc_type').annotate(count=Count('id', distinct=True))
+        return dict([(count['document__doc_type'], count['count']) for count in counts])
+
+    aggregates = {
+        name: _count(polymorphic_ctype__model='layer', layer__storeType=store_type)
+        for name, store_type in LAYER_STORE_TYPES.items()
+    }
+    aggregates['vector_time'] = _count(
+        polymorphic_ctype__model='layer', layer__storeType='dataStore', layer__has_time=True)
+    if facet_type != 'layers':
+        aggregates['map'] = _count(polymorphic_ctype__model='map')
+        aggregates['document'] = _count(polymorphic_ctype__model='document')
+    facets = resources.aggregate(**aggregates)
+
+    if facet_type == 'home':
+        facets['user'] = get_user_model().objects.exclude(
+            username='AnonymousUser').count()
+
+        facets['group'] = GroupProfile.objects.exclude(
+            access="private").count()
+
+        facets['layer'] = facets['raster'] + facets['vector'] + facets['remote'] + facets['wms']
+    return facets
+
+
+def get_facets(user, filters, facet_type='all'):
+    """
+    Returns the facet counts of the resources visible to the user.
+
+    All the counts of a facet type are computed by a single aggregation query, and
+    cached for 'FACETS_CACHE_TIMEOUT' seconds per permission class and filters.
+    """
+    return _cached(
+        user,
+        lambda: _compute_facets(user, filters, facet_type),
+        'facets', facet_type, filters)
+
+
+def _compute_resources_counts(user, count_type, title_filter, type_filter):
+    resources = get_user_visible_resources(user)
+    if title_filter:
+        resources = resources.filter(title__icontains=title_filter)
+    if type_filter:
+        _models = []
+        if isinstance(type_filter, type):
+            _models = [
+                _model.__name__.lower() for _model in _get_geonode_apps_models().values()
+                if issubclass(_model, type_filter)
+            ]
+        if not _models:
+            _models = [type_filter if isinstance(type_filter, str) else type_filter.__name__.lower()]
+        resources = resources.filter(polymorphic_ctype__model__in=_models)
+
+    counts = resources.values(count_type).annotate(count=Count(count_type))
+    return dict([(c[count_type], c['count']) for c in counts if c and c['count']])
+
+
+def get_resources_counts(user, count_type, title_filter=None, type_filter=None):
+    """
+    Returns the number of resources visible to the user for each value of 'count_type'
+    (e.g. 'keywords', 'regions', 'category', 'owner'), with a single grouped query.
+    """
+    if not count_type:
+        return {}
+    return _cached(
+        user,
+        lambda: _compute_resources_counts(user, count_type, title_filter, type_filter),
+        'counts', count_type, title_filter,
+        type_filter if isinstance(type_filter, str) or not type_filter else type_filter.__name__)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2020 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+"""Incremental updates of the Haystack search index
+"""
+
+import threading
+
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models, transaction
+from django.core.cache import cache
+
+INDEX_UPDATE_KEY = 'search_index_{}_{}'
+
+ACTION_UPDATE = 'update'
+ACTION_DELETE = 'delete'
+
+_pending = threading.local()
+
+
+def _get_delay():
+    return getattr(settings, 'HAYSTACK_INDEX_DELAY', 10)
+
+
+def queue_index_update(instance, action=ACTION_UPDATE):
+    """
+    Queues the update of an object in the search index.
+
+    The updates of a transaction are sent to the 'search' queue as a single batch
+    once committed, and updates of the same object within 'HAYSTACK_INDEX_DELAY'
+    seconds are coalesced.
+    """
+    batch = getattr(_pending, 'batch', None)
+    if batch is None:
+        batch = _pending.batch = {}
+    batch[(instance._meta.label_lower, instance.pk)] = action
+    transaction.on_commit(flush_index_updates)
+
+
+def flush_index_updates():
+    from geonode.base.tasks import update_search_index
+
+    batch = getattr(_pending, 'batch', None)
+    _pending.batch = None
+    if not batch:
+        return
+    updates = []
+    for (label, pk), action in batch.items():
+        key = INDEX_UPDATE_KEY.format(label, pk)
+        # the coalescing key is only set once committed, so that a rolled
+        # back transaction does not hold back the next updates
+        if not cache.add(key, action, _get_delay() + 60):
+            # already queued, the task will use the latest action
+            cache.set(key, action, _get_delay() + 60)
+            continue
+        updates.append((label, pk, action))
+    if updates:
+        update_search_index.apply_async(args=(updates,), countdown=_get_delay())
+
+
+def update_index(updates):
+    """
+    Writes a batch of (model label, pk, action) updates to the search index,
+    with a single backend update by model and index.
+    """
+    from haystack import connections, connection_router
+    from haystack.exceptions import NotHandled
+
+    actions = defaultdict(dict)
+    for label, pk, action in updates:
+        key = INDEX_UPDATE_KEY.format(label, pk)
+        # read the latest action and allow the next updates to be queued
+        actions[label][pk] = cache.get(key) or action
+        cache.delete(key)
+
+    for label, model_actions in actions.items():
+        model = apps.get_model(label)
+        update_pks = [pk for pk, action in model_actions.items() if action == ACTION_UPDATE]
+        for using in connection_router.for_write():
+            try:
+                index = connections[using].get_unified_index().get_index(model)
+            except NotHandled:
+                continue
+            backend = connections[using].get_backend()
+            objs = []
+            if update_pks:
+                objs = [obj for obj in index.index_queryset(using=using).filter(pk__in=update_pks)
+                        if index.should_update(obj)]
+            if objs:
+                backend.update(index, objs)
+            # deleted objects, or not indexable anymore
+            indexed_pks = set(obj.pk for obj in objs)
+            for pk in model_actions:
+                if pk not in indexed_pks:
+                    backend.remove('{}.{}'.format(label, pk))
+
+
+if settings.HAYSTACK_SEARCH:
+    from haystack.signals import BaseSignalProcessor
+
+    class SearchIndexSignalProcessor(BaseSignalProcessor):
+        """
+        Queues the updates of the indexed objects instead of indexing them
+        while saving.
+        """
+
+        def setup(self):
+            models.signals.post_save.connect(self.handle_save)
+            models.signals.post_delete.connect(self.handle_delete)
+
+        def teardown(self):
+            models.signals.post_save.disconnect(self.handle_save)
+            models.signals.post_delete.disconnect(self.handle_delete)
+
+        def is_indexed(self, sender, instance):
+            for using in self.connection_router.for_write(instance=instance):
+                if sender in self.connections[using].get_unified_index().get_indexed_models():
+                    return True
+            return False
+
+        def handle_save(self, sender, instance, **kwargs):
+            if self.is_indexed(sender, instance):
+                queue_index_update(instance, ACTION_UPDATE)
+
+        def handle_delete(self, sender, instance, **kwargs):
+            if self.is_indexed(sender, instance):
+                queue_index_update(instance, ACTION_DELETE)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2020 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+import multiprocessing
+
+from django import db
+from django.core.management.base import BaseCommand
+
+from geonode.base.thumbnails import generate_resource_thumbnail
+
+RESOURCE_TYPES = {
+    'layer': 'layers.layer',
+    'map': 'maps.map',
+}
+
+
+def _generate_thumbnail(args):
+    label, pk, overwrite = args
+    try:
+        generate_resource_thumbnail(label, pk, overwrite=overwrite, check_bbox=True)
+        return pk, None
+    except Exception as e:
+        return pk, str(e)
+    finally:
+        db.connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Regenerates the thumbnails of the Layers and Maps with a pool of processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-t',
+            '--type',
+            dest='type',
+            choices=list(RESOURCE_TYPES.keys()),
+            default=None,
+            help='Only regenerate the thumbnails of the given resource type.')
+        parser.add_argument(
+            '-f',
+            '--filter',
+            dest='filter',
+            default=None,
+            help='Only regenerate the thumbnails of the resources whose title match the given filter.')
+        parser.add_argument(
+            '-o',
+            '--overwrite',
+            action='store_true',
+            dest='overwrite',
+            default=False,
+            help='Overwrite the existing thumbnails.')
+        parser.add_argument(
+            '-p',
+            '--processes',
+            dest='processes',
+            type=int,
+            default=multiprocessing.cpu_count(),
+            help='Number of processes generating the thumbnails.')
+
+    def handle(self, *args, **options):
+        from django.apps import apps
+
+        labels = [RESOURCE_TYPES[options['type']]] if options.get('type') else RESOURCE_TYPES.values()
+        jobs = []
+        for label in labels:
+            resources = apps.get_model(label).objects.all()
+            if options.get('filter'):
+                resources = resources.filter(title__icontains=options['filter'])
+            jobs.extend(
+                (label, pk, options['overwrite'])
+                for pk in resources.order_by('pk').values_list('pk', flat=True))
+
+        # the forked processes must not share the database connections
+        db.connections.close_all()
+        with multiprocessing.Pool(max(1, options['processes'])) as pool:
+            for index, (pk, error) in enumerate(pool.imap_unordered(_generate_thumbnail, jobs)):
+                if error:
+                    print(f"[{index + 1} / {len(jobs)}] [ERROR] Thumbnail of #{pk} not generated: {error}")
+                else:
+                    print(f"[{index + 1} / {len(jobs)}] Thumbnail of #{pk} generated")
@@ -0,0 +1,37 @@
+import re
+
+import django.contrib.gis.db.models.fields
+from django.contrib.gis.geos import GEOSGeometry
+from django.db import migrations
+
+from geonode.utils import bbox_to_wkt
+
+
+def set_regions_bbox_polygon(apps, schema_editor):
+    Region = apps.get_model('base', 'Region')
+    for region in Region.objects.all():
+        try:
+            srid, wkt = bbox_to_wkt(
+                region.bbox_x0, region.bbox_x1, region.bbox_y0, region.bbox_y1, srid=region.srid).split(";")
+            poly = GEOSGeometry(wkt, srid=int(re.findall(r'\d+', srid)[0]))
+            poly.transform(4326)
+        except Exception:
+            continue
+        region.bbox_polygon = poly
+        region.save(update_fields=['bbox_polygon'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0049_resourcebase_resource_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='region',
+            name='bbox_polygon',
+            field=django.contrib.gis.db.models.fields.PolygonField(blank=True, null=True, srid=4326),
+        ),
+        migrations.RunPython(set_regions_bbox_polygon, migrations.RunPython.noop),
+    ]
@@ -225,6 +225,9 @@ class Region(MPTTModel):
         null=False,
         default='EPSG:4326')
 
+    # The bbox in EPSG:4326, spatially indexed to match the resources regions.
+    bbox_polygon = PolygonField(null=True, blank=True)
+
     def __str__(self):
         return "{0}".format(self.name)
 
@@ -254,6 +257,10 @@ class Region(MPTTModel):
             self.bbox_y1,
             srid=self.srid)
 
+    def get_bbox_polygon(self):
+        """Returns the bbox as a Polygon in EPSG:4326."""
+        return get_geographic_polygon(self.geographic_bounding_box)
+
     class Meta:
         ordering = ("name",)
         verbose_name_plural = 'Metadata Regions'
@@ -1193,6 +1200,10 @@ class ResourceBase(PolymorphicModel, PermissionLevelMixin, ItemBase):
         if not self.dirty_state:
             self.dirty_state = True
             self.save()
+        else:
+            # let a running sync with Guardian know the resource changed again
+            self.last_updated = now()
+            ResourceBase.objects.filter(id=self.id).update(last_updated=self.last_updated)
 
     def clear_dirty_state(self):
         if self.dirty_state:
@@ -1436,21 +1447,27 @@ class ResourceBase(PolymorphicModel, PermissionLevelMixin, ItemBase):
     # Note - you should probably broadcast layer#post_save() events to ensure
     # that indexing (or other listeners) are notified
     def save_thumbnail(self, filename, image):
+        from geonode.base.thumbnails import (
+            prepare_thumbnail, is_thumbnail_unchanged, set_thumbnail_hash)
+
         upload_path = thumb_path(filename)
 
         try:
-            # Check that the image is valid
-            from PIL import Image
-            from io import BytesIO
-            content_data = BytesIO(image)
-            im = Image.open(content_data)
-            im.verify()  # verify that it is, in fact an image
+            # Skip the regeneration if the source image did not change
+            if image and is_thumbnail_unchanged(self, image) and \
+                    Link.objects.filter(resource=self, name='Thumbnail').exists():
+                logger.debug('Thumbnail of resource %s unchanged' % self.id)
+                return
+
+            # Check that the image is valid, then optimize the Thumbnail size
+            # and resolution once and in memory
+            content = prepare_thumbnail(image)
 
             name, ext = os.path.splitext(filename)
             remove_thumbs(name)
 
-            if upload_path and image:
-                actual_name = storage.save(upload_path, ContentFile(image))
+            if upload_path and content:
+                actual_name = storage.save(upload_path, ContentFile(content))
                 url = storage.url(actual_name)
                 _url = urlparse(url)
                 _upload_path = thumb_path(os.path.basename(_url.path))
@@ -1464,23 +1481,7 @@ class ResourceBase(PolymorphicModel, PermissionLevelMixin, ItemBase):
                         )
                     except Exception as e:
                         logger.debug(e)
-
-                try:
-                    # Optimize the Thumbnail size and resolution
-                    from PIL import Image
-                    from resizeimage import resizeimage
-                    _default_thumb_size = getattr(
-                        settings, 'THUMBNAIL_GENERATOR_DEFAULT_SIZE', {'width': 240, 'height': 200})
-                    im = Image.open(open(storage.path(_upload_path), mode='rb'))
-                    im.thumbnail(
-                        (_default_thumb_size['width'], _default_thumb_size['height']),
-                        resample=Image.ANTIALIAS)
-                    cover = resizeimage.resize_cover(
-                        im,
-                        [_default_thumb_size['width'], _default_thumb_size['height']])
-                    cover.save(storage.path(_upload_path), format='JPEG')
-                except Exception as e:
-                    logger.debug(e)
+                set_thumbnail_hash(self, image)
 
                 # check whether it is an URI or not
                 parsed = urlsplit(url)
@@ -1514,6 +1515,7 @@ class ResourceBase(PolymorphicModel, PermissionLevelMixin, ItemBase):
                 'Error when generating the thumbnail for resource %s. (%s)' %
                 (self.id, str(e)))
             logger.warn('Check permissions for file %s.' % upload_path)
+            set_thumbnail_hash(self, None)
             Link.objects.filter(resource=self, name='Thumbnail').delete()
             _thumbnail_url = staticfiles.static(settings.MISSING_THUMBNAIL)
             obj, created = Link.objects.get_or_create(
@@ -1860,6 +1862,43 @@ class GroupGeoLimit(models.Model):
         blank=True)
 
 
+def get_geographic_polygon(geographic_bounding_box):
+    """
+    Returns the Polygon in EPSG:4326 of a 'SRID=<srid>;<wkt>' bounding box.
+    """
+    srid, wkt = geographic_bounding_box.split(";")
+    srid = re.findall(r'\d+', srid)
+
+    poly = GEOSGeometry(wkt, srid=int(srid[0]))
+    poly.transform(4326)
+    return poly
+
+
+def get_intersecting_regions(poly):
+    """
+    Returns the regions intersecting the polygon, and the global regions,
+    through the spatial index of the Region bbox_polygon.
+    """
+    regions = list(
+        Region.objects.filter(
+            Q(bbox_polygon__intersects=poly) | Q(level=0, parent__isnull=True)).order_by('name'))
+    regions_to_add = [region for region in regions if region.bbox_polygon and region.bbox_polygon.intersects(poly)]
+    global_regions = [region for region in regions if region.level == 0 and region.parent_id is None]
+    return regions_to_add, global_regions
+
+
+def region_pre_save(instance, *args, **kwargs):
+    """
+    Keeps the indexed bbox_polygon of the regions in sync with the bbox.
+    """
+    try:
+        instance.bbox_polygon = instance.get_bbox_polygon()
+    except Exception:
+        tb = traceback.format_exc()
+        if tb:
+            logger.debug(tb)
+
+
 def resourcebase_post_save(instance, *args, **kwargs):
     """
     Used to fill any additional fields after the save.
@@ -1887,32 +1926,20 @@ def resourcebase_post_save(instance, *args, **kwargs):
         instance.set_missing_info()
 
     try:
-        if not instance.regions or instance.regions.count() == 0:
-            srid1, wkt1 = instance.geographic_bounding_box.split(";")
-            srid1 = re.findall(r'\d+', srid1)
-
-            poly1 = GEOSGeometry(wkt1, srid=int(srid1[0]))
-            poly1.transform(4326)
-
-            queryset = Region.objects.all().order_by('name')
-            global_regions = []
-            regions_to_add = []
-            for region in queryset:
-                try:
-                    srid2, wkt2 = region.geographic_bounding_box.split(";")
-                    srid2 = re.findall(r'\d+', srid2)
-
-                    poly2 = GEOSGeometry(wkt2, srid=int(srid2[0]))
-                    poly2.transform(4326)
+        # align the owner permissions to the approval workflow once, when the
+        # resource is written, rather than on every detail page request
+        if instance.owner:
+            from geonode.base.utils import ManageResourceOwnerPermissions
+            ManageResourceOwnerPermissions(instance).set_owner_permissions_according_to_workflow()
+    except Exception:
+        tb = traceback.format_exc()
+        if tb:
+            logger.debug(tb)
 
-                    if poly2.intersection(poly1):
-                        regions_to_add.append(region)
-                    if region.level == 0 and region.parent is None:
-                        global_regions.append(region)
-                except Exception:
-                    tb = traceback.format_exc()
-                    if tb:
-                        logger.debug(tb)
+    try:
+        if not instance.regions or instance.regions.count() == 0:
+            regions_to_add, global_regions = get_intersecting_regions(
+                get_geographic_polygon(instance.geographic_bounding_box))
             if regions_to_add or global_regions:
                 if regions_to_add and len(
                         regions_to_add) > 0 and len(regions_to_add) <= 30:
@@ -1939,3 +1966,4 @@ def rating_post_save(instance, *args, **kwargs):
 
 
 signals.post_save.connect(rating_post_save, sender=OverallRating)
+signals.pre_save.connect(region_pre_save, sender=Region)
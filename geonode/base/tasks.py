@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2020 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+from celery.utils.log import get_task_logger
+
+from geonode.celery_app import app
+
+logger = get_task_logger(__name__)
+
+
+@app.task(
+    bind=True,
+    name='geonode.base.tasks.update_search_index',
+    queue='search',
+    acks_late=True,
+    retry=True,
+    retry_policy={
+        'max_retries': 10,
+        'interval_start': 0,
+        'interval_step': 0.2,
+        'interval_max': 0.2,
+    })
+def update_search_index(self, updates):
+    """
+    Writes a batch of updates to the search index.
+    """
+    from geonode.base.indexing import update_index
+    logger.debug(f"Updating {len(updates)} objects of the search index")
+    update_index(updates)
+
+
+@app.task(
+    bind=True,
+    name='geonode.base.tasks.generate_thumbnail',
+    queue='thumbnails',
+    acks_late=True,
+    retry=True,
+    retry_policy={
+        'max_retries': 3,
+        'interval_start': 0,
+        'interval_step': 0.2,
+        'interval_max': 0.2,
+    })
+def generate_thumbnail(self, label, pk, overwrite=False, check_bbox=False):
+    """
+    Generates the thumbnail of a resource.
+    """
+    from geonode.base.thumbnails import generate_resource_thumbnail
+    logger.debug(f"Generating the thumbnail of {label} #{pk}")
+    generate_resource_thumbnail(label, pk, overwrite=overwrite, check_bbox=check_bbox)
@@ -19,6 +19,9 @@
 #########################################################################
 
 import os
+import re
+import time
+import logging
 from unittest.mock import patch
 
 from guardian.shortcuts import assign_perm, get_perms
@@ -33,23 +36,32 @@ from geonode.maps.models import Map
 from geonode.services.models import Service
 from geonode.tests.base import GeoNodeBaseTestSupport
 from geonode.base.models import (
-    ResourceBase, MenuPlaceholder, Menu, MenuItem, Configuration, TopicCategory
+    ResourceBase, MenuPlaceholder, Menu, MenuItem, Configuration, TopicCategory, Region,
+    get_intersecting_regions
 )
 from django.template import Template, Context
 from django.contrib.auth import get_user_model
+from django.core.cache import caches
 from django.test import Client, TestCase, override_settings, SimpleTestCase
 from django.shortcuts import reverse
 
 from geonode.base.middleware import ReadOnlyMiddleware, MaintenanceMiddleware
 from geonode.base.models import CuratedThumbnail
 from geonode.base.templatetags.base_tags import get_visibile_resources
+from geonode.base.facets import get_facets
+from geonode.base.indexing import (
+    queue_index_update, flush_index_updates, INDEX_UPDATE_KEY, ACTION_UPDATE, ACTION_DELETE)
+from geonode.base.thumbnails import prepare_thumbnail, is_thumbnail_unchanged, queue_thumbnail
 from geonode import geoserver
 from geonode.decorators import on_ogc_backend
 
 from django.core.files import File
+from django.contrib.gis.geos import GEOSGeometry, Polygon
 from django.core.management import call_command
 from django.core.management.base import CommandError
 
+logger = logging.getLogger(__name__)
+
 test_image = Image.new('RGBA', size=(50, 50), color=(155, 0, 0))
 
 
@@ -806,6 +818,37 @@ class TestGetVisibleResource(TestCase):
         self.assertEqual(categories['iso_formats'].count(), 1)
 
 
+class FacetsTest(GeoNodeBaseTestSupport):
+
+    def setUp(self):
+        super(FacetsTest, self).setUp()
+        self.admin = get_user_model().objects.get(username='admin')
+
+    def test_facets_counts(self):
+        facets = get_facets(self.admin, {}, facet_type='all')
+        self.assertEqual(facets['raster'], Layer.objects.filter(storeType='coverageStore').count())
+        self.assertEqual(facets['vector'], Layer.objects.filter(storeType='dataStore').count())
+        self.assertEqual(
+            facets['vector_time'], Layer.objects.filter(storeType='dataStore', has_time=True).count())
+        self.assertEqual(facets['map'], Map.objects.count())
+        self.assertEqual(facets['document'], Document.objects.count())
+
+        title = Map.objects.first().title
+        facets = get_facets(self.admin, {'title': title}, facet_type='all')
+        self.assertEqual(facets['map'], Map.objects.filter(title__icontains=title).count())
+
+    def test_facets_single_aggregation(self):
+        # 'anonymous' Group lookup + the aggregation of all the counts
+        with self.assertNumQueries(2):
+            get_facets(self.admin, {}, facet_type='all')
+
+    def test_facets_cache(self):
+        with patch('geonode.base.facets.cache') as cache:
+            cache.get.return_value = {'map': 42}
+            self.assertEqual(get_facets(self.admin, {}, facet_type='all'), {'map': 42})
+            cache.set.assert_not_called()
+
+
 class TestHtmlTagRemoval(SimpleTestCase):
 
     def test_not_tags_in_attribute(self):
@@ -829,3 +872,139 @@ class TestHtmlTagRemoval(SimpleTestCase):
         r = ResourceBase()
         filtered_value = r._remove_html_tags(tagged_value)
         self.assertEqual(filtered_value, attribute_target_value)
+
+
+class SearchIndexingTest(GeoNodeBaseTestSupport):
+
+    @patch('geonode.base.tasks.update_search_index.apply_async')
+    def test_index_updates_batched(self, apply_async):
+        layers = list(Layer.objects.all()[:2])
+        for layer in layers:
+            queue_index_update(layer)
+            queue_index_update(layer)
+        flush_index_updates()
+        flush_index_updates()
+
+        apply_async.assert_called_once()
+        updates = apply_async.call_args[1]['args'][0]
+        self.assertEqual(
+            sorted(updates),
+            sorted(('layers.layer', layer.pk, ACTION_UPDATE) for layer in layers))
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'indexing-tests',
+        }
+    })
+    @patch('geonode.base.tasks.update_search_index.apply_async')
+    def test_index_updates_coalesced_once_committed(self, apply_async):
+        caches['default'].clear()
+        layer = Layer.objects.all().first()
+        key = INDEX_UPDATE_KEY.format('layers.layer', layer.pk)
+        # not committed yet, e.g. rolled back: the next updates are not held back
+        queue_index_update(layer)
+        self.assertIsNone(caches['default'].get(key))
+
+        flush_index_updates()
+        self.assertEqual(caches['default'].get(key), ACTION_UPDATE)
+        # updated again before the task runs: coalesced with the queued one
+        queue_index_update(layer, ACTION_DELETE)
+        flush_index_updates()
+        apply_async.assert_called_once()
+        self.assertEqual(caches['default'].get(key), ACTION_DELETE)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'thumbnails-tests',
+    }
+})
+class ThumbnailGenerationTest(GeoNodeBaseTestSupport):
+
+    def setUp(self):
+        super(ThumbnailGenerationTest, self).setUp()
+        # the image hashes and the pending requests are stored in the default cache
+        caches['default'].clear()
+
+    def _image(self, mode, color):
+        output = BytesIO()
+        Image.new(mode, size=(400, 100), color=color).save(output, format='PNG')
+        return output.getvalue()
+
+    def test_prepare_thumbnail(self):
+        thumbnail = Image.open(BytesIO(prepare_thumbnail(self._image('RGB', (155, 0, 0)), size=(240, 200))))
+        self.assertEqual(thumbnail.size, (240, 200))
+        self.assertEqual(thumbnail.format, 'JPEG')
+
+        thumbnail = Image.open(BytesIO(prepare_thumbnail(self._image('RGBA', (155, 0, 0, 0)), size=(240, 200))))
+        self.assertEqual(thumbnail.size, (240, 200))
+        self.assertEqual(thumbnail.format, 'PNG')
+
+    def test_unchanged_thumbnail_skipped(self):
+        layer = Layer.objects.all().first()
+        image = self._image('RGB', (155, 0, 0))
+        layer.save_thumbnail('layer-thumb.png', image)
+        self.assertTrue(is_thumbnail_unchanged(layer, image))
+        self.assertFalse(is_thumbnail_unchanged(layer, self._image('RGB', (0, 155, 0))))
+
+        with patch('geonode.base.thumbnails.prepare_thumbnail') as prepare:
+            layer.save_thumbnail('layer-thumb.png', image)
+            prepare.assert_not_called()
+
+    @patch('geonode.base.thumbnails.transaction.on_commit', side_effect=lambda func: func())
+    @patch('geonode.base.tasks.generate_thumbnail.apply_async')
+    def test_thumbnail_requests_coalesced(self, apply_async, on_commit):
+        layer = Layer.objects.all().first()
+        queue_thumbnail(layer)
+        queue_thumbnail(layer, overwrite=True)
+        apply_async.assert_called_once()
+
+
+class RegionsAssignmentTest(GeoNodeBaseTestSupport):
+
+    """
+    Compares the indexed regions matching against the per-region loop it replaces.
+    """
+
+    fixtures = GeoNodeBaseTestSupport.fixtures + ['regions.json']
+
+    def _legacy_intersecting_regions(self, poly1):
+        global_regions = []
+        regions_to_add = []
+        for region in Region.objects.all().order_by('name'):
+            srid2, wkt2 = region.geographic_bounding_box.split(";")
+            srid2 = re.findall(r'\d+', srid2)
+            poly2 = GEOSGeometry(wkt2, srid=int(srid2[0]))
+            poly2.transform(4326)
+            if poly2.intersects(poly1):
+                regions_to_add.append(region)
+            if region.level == 0 and region.parent is None:
+                global_regions.append(region)
+        return regions_to_add, global_regions
+
+    def test_regions_bbox_polygon(self):
+        self.assertFalse(Region.objects.filter(bbox_polygon__isnull=True).exists())
+        region = Region.objects.exclude(bbox_x0=None).first()
+        region.bbox_x0, region.bbox_x1, region.bbox_y0, region.bbox_y1 = 10, 20, 30, 40
+        region.save()
+        self.assertEqual(Region.objects.get(id=region.id).bbox_polygon.extent, (10, 30, 20, 40))
+
+    def test_intersecting_regions_match_legacy(self):
+        legacy_time = indexed_time = 0
+        for bbox in ((-180, -90, 180, 90), (10, 40, 20, 50), (-75, 40, -73, 41), (170, -50, 175, -45)):
+            poly = Polygon.from_bbox(bbox)
+            poly.srid = 4326
+
+            start = time.time()
+            legacy = self._legacy_intersecting_regions(poly)
+            legacy_time += time.time() - start
+
+            start = time.time()
+            with self.assertNumQueries(1):
+                indexed = get_intersecting_regions(poly)
+            indexed_time += time.time() - start
+
+            self.assertEqual(indexed, legacy)
+        logger.info("regions assignment: per-region %.4fs - indexed %.4fs", legacy_time, indexed_time)
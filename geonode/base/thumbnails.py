@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2020 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+"""Generation of the resources thumbnails on the 'thumbnails' queue
+"""
+
+import hashlib
+import logging
+
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_PENDING_KEY = 'thumbnail_pending_{}_{}'
+THUMBNAIL_HASH_KEY = 'thumbnail_hash_{}'
+
+
+def _get_default_size():
+    _default_thumb_size = getattr(
+        settings, 'THUMBNAIL_GENERATOR_DEFAULT_SIZE', {'width': 240, 'height': 200})
+    return _default_thumb_size['width'], _default_thumb_size['height']
+
+
+def _get_pending_timeout():
+    return getattr(settings, 'THUMBNAIL_GENERATOR_TIMEOUT', 600)
+
+
+def prepare_thumbnail(image, size=None):
+    """
+    Returns the thumbnail content, of the given size, for an image content.
+
+    The image is decoded once, resized and cropped to cover the thumbnail in a single
+    pass and encoded in memory: as JPEG unless it has transparency, kept then as PNG.
+    Raises an exception if the content is not a valid image.
+    """
+    from PIL import Image, ImageOps
+
+    im = Image.open(BytesIO(image))
+    im.load()
+    size = size or _get_default_size()
+    if im.size != size:
+        im = ImageOps.fit(im, size, method=Image.ANTIALIAS)
+
+    output = BytesIO()
+    if im.mode in ('RGBA', 'LA') or (im.mode == 'P' and 'transparency' in im.info):
+        im.save(output, format='PNG', optimize=True)
+    else:
+        im.convert('RGB').save(output, format='JPEG')
+    return output.getvalue()
+
+
+def get_image_hash(image):
+    return hashlib.sha1(image).hexdigest()
+
+
+def is_thumbnail_unchanged(resource, image):
+    """
+    True if the thumbnail of the resource was generated from the same image content.
+    """
+    return cache.get(THUMBNAIL_HASH_KEY.format(resource.id)) == get_image_hash(image)
+
+
+def set_thumbnail_hash(resource, image):
+    if image:
+        cache.set(THUMBNAIL_HASH_KEY.format(resource.id), get_image_hash(image), None)
+    else:
+        cache.delete(THUMBNAIL_HASH_KEY.format(resource.id))
+
+
+def queue_thumbnail(instance, overwrite=False, check_bbox=False):
+    """
+    Queues the generation of the thumbnail of a resource.
+
+    The requests received for the same resource while one is pending are coalesced
+    into it, the pending generation overwriting the thumbnail if any of them asked so.
+    The task is sent to the 'thumbnails' queue once the transaction is committed.
+    """
+    label = instance._meta.label_lower
+    key = THUMBNAIL_PENDING_KEY.format(label, instance.pk)
+    if not cache.add(key, overwrite, _get_pending_timeout()):
+        if overwrite:
+            cache.set(key, overwrite, _get_pending_timeout())
+        return
+
+    def send_task():
+        from geonode.base.tasks import generate_thumbnail
+        generate_thumbnail.apply_async(args=(label, instance.pk, overwrite, check_bbox))
+
+    transaction.on_commit(send_task)
+
+
+def generate_resource_thumbnail(label, pk, overwrite=False, check_bbox=False):
+    """
+    Generates the thumbnail of a resource with the 'THUMBNAIL_GENERATOR'.
+    """
+    key = THUMBNAIL_PENDING_KEY.format(label, pk)
+    # read the latest request and allow the next ones to be queued
+    overwrite = cache.get(key) or overwrite
+    cache.delete(key)
+
+    try:
+        instance = apps.get_model(label).objects.get(pk=pk)
+    except Exception:
+        logger.debug(f"Thumbnail of {label} #{pk} not generated: the resource does not exist anymore")
+        return
+    implementation = import_string(settings.THUMBNAIL_GENERATOR)
+    implementation(instance, overwrite, check_bbox)
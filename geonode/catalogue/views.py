@@ -27,13 +27,13 @@ from django.shortcuts import render
 from django.contrib.auth import get_user_model
 from django.views.decorators.csrf import csrf_exempt
 from pycsw import server
-from guardian.shortcuts import get_objects_for_user
 from geonode.catalogue.backends.pycsw_local import CONFIGURATION
 from geonode.base.models import ResourceBase
 from geonode.layers.models import Layer
 from geonode.base.auth import get_or_create_token
 from geonode.base.models import ContactRole, SpatialRepresentationType
 from geonode.groups.models import GroupProfile
+from geonode.security.utils import get_viewable_resources
 from django.db import connection
 from django.core.exceptions import ObjectDoesNotExist
 
@@ -80,14 +80,8 @@ def csw_global_dispatch(request):
         else:
             profiles = get_user_model().objects.filter(username="AnonymousUser")
         if profiles:
-            authorized = list(
-                get_objects_for_user(
-                    profiles[0],
-                    'base.view_resourcebase').values('id'))
-            layers = ResourceBase.objects.filter(
-                id__in=[d['id'] for d in authorized])
-            if layers:
-                authorized_ids = [d['id'] for d in authorized]
+            authorized_ids = list(
+                get_viewable_resources(profiles[0]).values_list('id', flat=True))
 
         if len(authorized_ids) > 0:
             authorized_layers = "(" + (", ".join(str(e)
@@ -282,6 +282,7 @@ def logged_in_or_basicauth(realm=""):
     You can provide the name of the realm to ask for authentication within.
     """
     def view_decorator(func):
+        @wraps(func)
         def wrapper(request, *args, **kwargs):
             return view_or_basicauth(func, request,
                                      lambda u: u.is_authenticated,
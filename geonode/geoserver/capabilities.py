@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2020 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+"""Aggregated GetCapabilities documents of the GeoServer layers
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from lxml import etree
+from defusedxml import lxml as dlxml
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.template.loader import get_template
+
+from geonode.compat import ensure_string
+from geonode.utils import http_client
+
+from .helpers import ogc_server_settings
+
+logger = logging.getLogger(__name__)
+
+LAYER_CAPABILITIES_KEY = 'layer_capabilities_{}_{}_{}_{}'
+
+NAMESPACES = {
+    'wms': 'http://www.opengis.net/wms',
+    'xlink': 'http://www.w3.org/1999/xlink',
+    'xsi': 'http://www.w3.org/2001/XMLSchema-instance'
+}
+
+
+def get_layer_capabilities(layer, version='1.3.0', access_token=None, tolerant=False):
+    """
+    Retrieve a layer-specific GetCapabilities document
+    """
+    workspace, layername = layer.alternate.split(":") if ":" in layer.alternate else (None, layer.alternate)
+    if not layer.remote_service:
+        wms_url = '%s%s/%s/wms?service=wms&version=%s&request=GetCapabilities'\
+            % (ogc_server_settings.LOCATION, workspace, layername, version)
+        if access_token:
+            wms_url += ('&access_token=%s' % access_token)
+    else:
+        wms_url = '%s?service=wms&version=%s&request=GetCapabilities'\
+            % (layer.remote_service.service_url, version)
+
+    _user, _password = ogc_server_settings.credentials
+    req, content = http_client.get(wms_url, user=_user)
+    getcap = ensure_string(content)
+    if not getattr(settings, 'DELAYED_SECURITY_SIGNALS', False):
+        if tolerant and ('ServiceException' in getcap or req.status_code == 404):
+            # WARNING Please make sure to have enabled DJANGO CACHE as per
+            # https://docs.djangoproject.com/en/2.0/topics/cache/#filesystem-caching
+            wms_url = '%s%s/ows?service=wms&version=%s&request=GetCapabilities&layers=%s'\
+                % (ogc_server_settings.public_url, workspace, version, layer)
+            if access_token:
+                wms_url += ('&access_token=%s' % access_token)
+            req, content = http_client.get(wms_url, user=_user)
+            getcap = ensure_string(content)
+
+    if 'ServiceException' in getcap or req.status_code == 404:
+        return None
+    return getcap.encode('UTF-8')
+
+
+def format_online_resource(workspace, layer, element, namespaces):
+    """
+    Replace workspace/layer-specific OnlineResource links with the more
+    generic links returned by a site-wide GetCapabilities document
+    """
+    layerName = element.find('.//wms:Capability/wms:Layer/wms:Layer/wms:Name',
+                             namespaces)
+    if layerName is None:
+        return
+
+    layerName.text = workspace + ":" + layer if workspace else layer
+    layerresources = element.findall('.//wms:OnlineResource', namespaces)
+    if layerresources is None:
+        return
+
+    for resource in layerresources:
+        wtf = resource.attrib['{http://www.w3.org/1999/xlink}href']
+        replace_string = "/" + workspace + "/" + layer if workspace else "/" + layer
+        resource.attrib['{http://www.w3.org/1999/xlink}href'] = wtf.replace(
+            replace_string, "")
+
+
+def _get_fragment_cache_key(layer, version, tolerant):
+    last_updated = layer.last_updated.timestamp() if layer.last_updated else None
+    return LAYER_CAPABILITIES_KEY.format(layer.id, last_updated, version, int(bool(tolerant)))
+
+
+def get_layer_capabilities_fragment(layer, version='1.3.0', access_token=None, tolerant=False):
+    """
+    Returns the serialized wms:Layer element of a layer, as found in its
+    GetCapabilities document or, failing that, rendered from the layer model.
+
+    The fragments fetched from GeoServer are cached for 'LAYER_CAPABILITIES_CACHE_TIMEOUT'
+    seconds, keyed by the layer and its last update time.
+    """
+    cache_key = _get_fragment_cache_key(layer, version, tolerant)
+    fragment = cache.get(cache_key)
+    if fragment is not None:
+        return fragment
+
+    workspace, layername = layer.alternate.split(":") if ":" in layer.alternate else (None, layer.alternate)
+    layerelem = None
+    try:
+        layercap = get_layer_capabilities(layer, version=version, access_token=access_token, tolerant=tolerant)
+        if layercap is not None:
+            rootdoc = etree.ElementTree(dlxml.fromstring(layercap))
+            format_online_resource(workspace, layername, rootdoc, NAMESPACES)
+            layerelem = rootdoc.find('.//wms:Capability/wms:Layer/wms:Layer', NAMESPACES)
+    except Exception as e:
+        logger.error(
+            "Error occurred creating GetCapabilities for %s: %s" %
+            (layer.typename, str(e)))
+        layerelem = None
+
+    if layerelem is not None and len(layerelem):
+        fragment = etree.tostring(layerelem, encoding='UTF-8', pretty_print=True)
+        cache.set(cache_key, fragment, getattr(settings, 'LAYER_CAPABILITIES_CACHE_TIMEOUT', 3600))
+        return fragment
+
+    # Get the required info from layer model
+    # TODO: store time dimension on DB also
+    tpl = get_template("geoserver/layer.xml")
+    ctx = {
+        'layer': layer,
+        'geoserver_public_url': ogc_server_settings.public_url,
+        'catalogue_url': settings.CATALOGUE['default']['URL'],
+    }
+    gc_str = tpl.render(ctx).encode("utf-8", "replace")
+    return etree.tostring(etree.XML(gc_str), encoding='UTF-8', pretty_print=True)
+
+
+def _get_fragment(layer, version, access_token, tolerant):
+    try:
+        return get_layer_capabilities_fragment(
+            layer, version=version, access_token=access_token, tolerant=tolerant)
+    except Exception as e:
+        logger.error(
+            "Error occurred creating GetCapabilities for %s:%s" %
+            (layer.typename, str(e)))
+        return None
+    finally:
+        connection.close()
+
+
+def iter_layers_capabilities(layers, version='1.3.0', access_token=None, tolerant=False, workers=None):
+    """
+    Iterates over the capabilities fragments of the layers, in the same order.
+
+    The fragments are fetched concurrently by a pool of 'LAYER_CAPABILITIES_WORKERS'
+    threads sharing the pooled HTTP sessions, and each one is yielded as soon as
+    it and the ones before it are available. The layers whose fragment could not
+    be built are skipped.
+    """
+    workers = workers or getattr(settings, 'LAYER_CAPABILITIES_WORKERS', 8)
+    with ThreadPoolExecutor(max_workers=max(min(workers, len(layers)), 1)) as executor:
+        for fragment in executor.map(
+                lambda layer: _get_fragment(layer, version, access_token, tolerant), layers):
+            if fragment is not None:
+                yield fragment
+
+
+def iter_capabilities(layers, title, version='1.3.0', access_token=None, tolerant=False, workers=None):
+    """
+    Iterates over the chunks of the aggregated GetCapabilities document of the
+    layers: a wms:Layer titled 'title' which contains the wms:Layer of each layer.
+    """
+    yield b"<?xml version='1.0' encoding='UTF-8'?>\n"
+    root = etree.Element('{http://www.opengis.net/wms}Layer', nsmap={
+        None: NAMESPACES['wms'], 'xlink': NAMESPACES['xlink'], 'xsi': NAMESPACES['xsi']})
+    etree.SubElement(root, '{http://www.opengis.net/wms}Title').text = title
+    start_tag, end_tag = etree.tostring(root, encoding='UTF-8').decode('UTF-8').rsplit('</', 1)
+    yield start_tag.encode('UTF-8') + b'\n'
+    for fragment in iter_layers_capabilities(
+            layers, version=version, access_token=access_token, tolerant=tolerant, workers=workers):
+        yield fragment
+    yield ('</' + end_tag).encode('UTF-8') + b'\n'
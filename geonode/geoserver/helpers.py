@@ -72,6 +72,8 @@ from django.utils.module_loading import import_string
 
 logger = logging.getLogger(__name__)
 
+_attribute_statistics = local()
+
 temp_style_name_regex = r'[a-zA-Z0-9]{8}-[a-zA-Z0-9]{4}-[a-zA-Z0-9]{4}-[a-zA-Z0-9]{4}-[a-zA-Z0-9]{12}_ms_.*'
 
 if not hasattr(settings, 'OGC_SERVER'):
@@ -1040,13 +1042,14 @@ def set_attributes_from_geoserver(layer, overwrite=False):
             attribute_map = []
     # Get attribute statistics & package for call to really_set_attributes()
     attribute_stats = defaultdict(dict)
+    _defer_statistics = attribute_statistics_deferred()
     # Add new layer attributes if they don't already exist
     for attribute in attribute_map:
         field, ftype = attribute
         if field is not None:
             if Attribute.objects.filter(layer=layer, attribute=field).exists():
                 continue
-            elif is_layer_attribute_aggregable(
+            elif not _defer_statistics and is_layer_attribute_aggregable(
                     layer.storeType,
                     field,
                     ftype):
@@ -1221,6 +1224,44 @@ def is_layer_attribute_aggregable(store_type, field_name, field_type):
     return True
 
 
+def defer_attribute_statistics(defer=True):
+    """
+    Defer the attribute statistics of the layers published from now on by the
+    current thread, until called again with 'defer' False.
+
+    The statistics of the deferred attributes are computed later by
+    'set_attribute_statistics', usually through the batched
+    'geoserver_attribute_statistics' task.
+    """
+    _attribute_statistics.deferred = defer
+
+
+def attribute_statistics_deferred():
+    return getattr(_attribute_statistics, 'deferred', False)
+
+
+def set_attribute_statistics(layer):
+    """
+    Compute the statistics of the aggregable attributes of a layer which have
+    none yet.
+    """
+    for attribute in layer.attribute_set.filter(last_stats_updated__isnull=True):
+        if not is_layer_attribute_aggregable(layer.storeType, attribute.attribute, attribute.attribute_type):
+            continue
+        result = get_attribute_statistics(layer.alternate or layer.typename, attribute.attribute)
+        if result:
+            attribute.count = result['Count']
+            attribute.min = result['Min']
+            attribute.max = result['Max']
+            attribute.average = result['Average']
+            attribute.median = result['Median']
+            attribute.stddev = result['StandardDeviation']
+            attribute.sum = result['Sum']
+            attribute.unique_values = result['unique_values']
+            attribute.last_stats_updated = datetime.datetime.now(timezone.get_current_timezone())
+            attribute.save()
+
+
 def get_attribute_statistics(layer_name, field):
     """
     Generate statistics (range, mean, median, standard deviation, unique values)
@@ -2012,8 +2053,6 @@ def _render_thumbnail(req_body, width=240, height=200):
     spec = _fixup_ows_url(req_body)
     url = "%srest/printng/render.png" % ogc_server_settings.LOCATION
     headers = {'Content-type': 'text/html'}
-    _default_thumb_size = getattr(
-        settings, 'THUMBNAIL_GENERATOR_DEFAULT_SIZE', {'width': 240, 'height': 200})
     params = dict(width=width, height=height)
     url += "?" + urlencode(params)
     try:
@@ -2027,22 +2066,7 @@ def _render_thumbnail(req_body, width=240, height=200):
             return content
         if not isinstance(content, bytes):
             raise Exception(content)
-
-        # Optimize the Thumbnail size and resolution
-        from PIL import Image
-        from io import BytesIO
-        from resizeimage import resizeimage
-        content_data = BytesIO(content)
-        im = Image.open(content_data)
-        im.thumbnail(
-            (_default_thumb_size['width'], _default_thumb_size['height']),
-            resample=Image.ANTIALIAS)
-        cover = resizeimage.resize_cover(
-            im,
-            [_default_thumb_size['width'], _default_thumb_size['height']])
-        imgByteArr = BytesIO()
-        cover.save(imgByteArr, format='JPEG')
-        content = imgByteArr.getvalue()
+        # the Thumbnail size and resolution are optimized by save_thumbnail
     except Exception as e:
         logger.debug(f"Could not sucesfully send data to {url}")
         logger.debug(f" - user: [{_user}]")
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2020 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+import time
+import base64
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from geonode.geoserver.views import layer_acls, resolve_user
+
+
+class Command(BaseCommand):
+    help = 'Measures the throughput of the GeoServer authorization callbacks, with and without the ACLs cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-u',
+            '--username',
+            dest='username',
+            default=None,
+            help='Username of the basic authentication, anonymous requests if not given.')
+        parser.add_argument(
+            '-p',
+            '--password',
+            dest='password',
+            default='',
+            help='Password of the basic authentication.')
+        parser.add_argument(
+            '-n',
+            '--requests',
+            dest='requests',
+            type=int,
+            default=100,
+            help='Number of requests sent to each callback.')
+
+    def _request(self, credentials):
+        request = RequestFactory().get('/gs/acls', **credentials)
+        request.user = AnonymousUser()
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+        return request
+
+    def _benchmark(self, view, credentials, requests):
+        start = time.time()
+        for _ in range(requests):
+            response = view(self._request(credentials))
+            if response.status_code != 200:
+                raise Exception('{} failed with HTTP status code {}'.format(view.__name__, response.status_code))
+        return requests / max(time.time() - start, 0.001)
+
+    def handle(self, *args, **options):
+        credentials = {}
+        if options.get('username'):
+            credentials['HTTP_AUTHORIZATION'] = 'Basic {}'.format(base64.b64encode('{}:{}'.format(
+                options['username'], options['password']).encode('utf-8')).decode('ascii'))
+
+        for view in (layer_acls, resolve_user):
+            with override_settings(LAYER_ACLS_CACHE_TIMEOUT=0):
+                uncached = self._benchmark(view, credentials, options['requests'])
+            cached = self._benchmark(view, credentials, options['requests'])
+            self.stdout.write('{}: {:.1f} requests/s uncached, {:.1f} requests/s cached'.format(
+                view.__name__, uncached, cached))
@@ -31,8 +31,8 @@ from geonode.utils import json_serializer_producer
 from geonode.decorators import on_ogc_backend
 from geonode.geoserver.helpers import (
     gs_catalog,
-    ogc_server_settings,
-    create_gs_thumbnail)
+    ogc_server_settings)
+from geonode.base.thumbnails import queue_thumbnail
 from geonode.layers.models import Layer
 from geonode.services.enumerations import CASCADED
 
@@ -126,5 +126,5 @@ def geoserver_post_save_map(instance, sender, created, **kwargs):
     if not created:
         if not instance.thumbnail_url or \
         instance.thumbnail_url == staticfiles.static(settings.MISSING_THUMBNAIL):
-            logger.debug("... Creating Thumbnail for Map [%s]" % (instance.title))
-            create_gs_thumbnail(instance, overwrite=False, check_bbox=True)
+            logger.debug("... Queuing Thumbnail for Map [%s]" % (instance.title))
+            queue_thumbnail(instance, overwrite=False, check_bbox=True)
@@ -40,6 +40,7 @@ from geonode.base.models import (
     ResourceBase,
     TopicCategory,
     SpatialRepresentationType)
+from geonode.base.thumbnails import queue_thumbnail
 from geonode.utils import set_resource_default_links
 from geonode.geoserver.upload import geoserver_upload
 from geonode.catalogue.models import catalogue_post_save
@@ -53,8 +54,8 @@ from .helpers import (
     set_layer_style,
     cascading_delete,
     fetch_gs_resource,
-    create_gs_thumbnail,
     set_attributes_from_geoserver,
+    set_attribute_statistics,
     _invalidate_geowebcache_layer,
     _stylefilterparams_geowebcache_layer)
 
@@ -621,20 +622,45 @@ def geoserver_post_save_layers(
         instance.thumbnail_url == staticfiles.static(settings.MISSING_THUMBNAIL):
             _recreate_thumbnail = True
         if _recreate_thumbnail:
-            create_gs_thumbnail(instance, overwrite=True)
-            logger.debug(f"... Created Thumbnail for Layer {instance.title}")
+            queue_thumbnail(instance, overwrite=True)
+            logger.debug(f"... Queued Thumbnail for Layer {instance.title}")
         else:
             logger.debug(f"... Thumbnail for Layer {instance.title} already exists: {instance.thumbnail_url}")
 
     # Updating HAYSTACK Indexes if needed
     if settings.HAYSTACK_SEARCH:
-        from django.core.management import call_command
-        call_command('update_index')
+        from geonode.base.indexing import queue_index_update
+        queue_index_update(instance)
 
     geonode_upload_sessions = UploadSession.objects.filter(resource=instance)
     geonode_upload_sessions.update(processed=True)
 
 
+@app.task(
+    bind=True,
+    name='geonode.geoserver.tasks.geoserver_attribute_statistics',
+    queue='update',
+    countdown=60,
+    # expires=120,
+    acks_late=True,
+    retry=True,
+    retry_policy={
+        'max_retries': 10,
+        'interval_start': 0,
+        'interval_step': 0.2,
+        'interval_max': 0.2,
+    })
+def geoserver_attribute_statistics(self, layer_ids):
+    """
+    Computes the deferred attribute statistics of a batch of layers.
+    """
+    for layer in Layer.objects.filter(id__in=layer_ids):
+        try:
+            set_attribute_statistics(layer)
+        except Exception as e:
+            logger.exception(e)
+
+
 @app.task(
     bind=True,
     name='geonode.geoserver.tasks.geoserver_cascading_delete',
@@ -188,10 +188,10 @@ class GeoNodeGeoServerCapabilities(GeoNodeLiveTestSupport):
             resp = self.client.get(url)
             layercap = dlxml.fromstring(resp.content)
             rootdoc = etree.ElementTree(layercap)
-            layernodes = rootdoc.findall('./[wms:Name]', namespaces)
+            layernodes = rootdoc.findall('./wms:Layer[wms:Name]', namespaces)
 
             # norman has 2 layers
-            self.assertEqual(1, len(layernodes))
+            self.assertEqual(2, len(layernodes))
 
             # the norman two layers are named layer1 and layer2
             count = 0
@@ -200,17 +200,17 @@ class GeoNodeGeoServerCapabilities(GeoNodeLiveTestSupport):
                     count += 1
                 elif layernode.find('wms:Name', namespaces).text == layer2.name:
                     count += 1
-            self.assertEqual(1, count)
+            self.assertEqual(2, count)
 
             # 2. test capabilities_category
             url = reverse('capabilities_category', args=[category.identifier])
             resp = self.client.get(url)
             layercap = dlxml.fromstring(resp.content)
             rootdoc = etree.ElementTree(layercap)
-            layernodes = rootdoc.findall('./[wms:Name]', namespaces)
+            layernodes = rootdoc.findall('./wms:Layer[wms:Name]', namespaces)
 
             # category is in two layers
-            self.assertEqual(1, len(layernodes))
+            self.assertEqual(2, len(layernodes))
 
             # the layers for category are named layer1 and layer3
             count = 0
@@ -219,7 +219,7 @@ class GeoNodeGeoServerCapabilities(GeoNodeLiveTestSupport):
                     count += 1
                 elif layernode.find('wms:Name', namespaces).text == layer3.name:
                     count += 1
-            self.assertEqual(1, count)
+            self.assertEqual(2, count)
 
             # 3. test for a map
             # TODO
@@ -25,11 +25,15 @@ import os
 import shutil
 import tempfile
 
+from unittest import mock
+from lxml import etree
+
 from urllib.parse import urljoin, urlencode
 from django.core.management import call_command
 from os.path import basename, splitext
 
 from django.conf import settings
+from django.core.cache import cache, caches
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.test.utils import override_settings
@@ -888,6 +892,69 @@ class LayerTests(GeoNodeBaseTestSupport):
         self.assertEqual('admin', response_json['fullname'])
         self.assertEqual('ad@m.in', response_json['email'])
 
+    @on_ogc_backend(geoserver.BACKEND_PACKAGE)
+    def test_layer_acls_cached(self):
+        """Verify that the layer_acls responses are cached until a permission changes
+        """
+        with self.settings(VISIBLE_RESOURCES_CACHE='resources'):
+            caches['resources'].clear()
+            valid_auth_headers = {
+                'HTTP_AUTHORIZATION': 'basic ' +
+                base64.b64encode(b"bobby:bob").decode(),
+            }
+            bob = get_user_model().objects.get(username='bobby')
+            layer_ca = Layer.objects.get(alternate='geonode:CA')
+
+            response = self.client.get(reverse('layer_acls'), **valid_auth_headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('geonode:CA', json.loads(response.content)['rw'])
+
+            # The cached response is served without authenticating the user again
+            with mock.patch('geonode.geoserver.views.authenticate') as authenticate, \
+                    mock.patch('geonode.decorators.authenticate') as decorator_authenticate:
+                response = self.client.get(reverse('layer_acls'), **valid_auth_headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(authenticate.called)
+                self.assertFalse(decorator_authenticate.called)
+
+            # A permission change expires the cached responses
+            assign_perm('change_layer_data', bob, layer_ca)
+            response = self.client.get(reverse('layer_acls'), **valid_auth_headers)
+            self.assertIn('geonode:CA', json.loads(response.content)['rw'])
+
+    @on_ogc_backend(geoserver.BACKEND_PACKAGE)
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'capabilities-tests',
+        }
+    })
+    def test_iter_capabilities(self):
+        """Verify that the aggregated GetCapabilities document merges the cached layers fragments
+        """
+        from geonode.geoserver.capabilities import iter_capabilities
+
+        def _layer_capabilities(layer, **kwargs):
+            return ("<WMS_Capabilities xmlns='http://www.opengis.net/wms' "
+                    "xmlns:xlink='http://www.w3.org/1999/xlink'><Capability><Layer><Layer>"
+                    "<Name>{}</Name><Title>{}</Title></Layer></Layer></Capability>"
+                    "</WMS_Capabilities>").format(layer.name, layer.title).encode('UTF-8')
+
+        namespaces = {'wms': 'http://www.opengis.net/wms'}
+        layers = list(Layer.objects.order_by('id')[:3])
+        cache.clear()
+        with mock.patch('geonode.geoserver.capabilities.get_layer_capabilities',
+                        side_effect=_layer_capabilities) as get_layer_capabilities:
+            for _ in range(2):
+                content = b''.join(iter_capabilities(layers, 'Capabilities - test', workers=2))
+                rootdoc = etree.fromstring(content)
+                self.assertEqual('Capabilities - test', rootdoc.find('wms:Title', namespaces).text)
+                self.assertEqual(
+                    [layer.name for layer in layers],
+                    [node.text for node in rootdoc.findall('wms:Layer/wms:Name', namespaces)])
+            # The fragments are fetched once, then served from the cache
+            self.assertEqual(len(layers), get_layer_capabilities.call_count)
+
 
 class UtilsTests(GeoNodeBaseTestSupport):
 
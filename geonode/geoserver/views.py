@@ -23,8 +23,8 @@ import re
 import json
 import logging
 import traceback
+from functools import wraps
 from lxml import etree
-from defusedxml import lxml as dlxml
 from os.path import isfile
 
 from urllib.parse import (
@@ -34,7 +34,8 @@ from urllib.parse import (
     parse_qsl)
 
 from django.contrib.auth import authenticate
-from django.http import HttpResponse, HttpResponseRedirect
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.views.decorators.http import require_POST
 from django.shortcuts import render
 from django.conf import settings
@@ -42,14 +43,10 @@ from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse
-from django.template.loader import get_template
 from django.utils.datastructures import MultiValueDictKeyError
+from django.utils.crypto import salted_hmac
 from django.utils.translation import ugettext as _
 
-from guardian.shortcuts import get_objects_for_user
-
-from geonode.base.models import ResourceBase
-from geonode.compat import ensure_string
 from geonode.base.auth import get_or_create_token
 from geonode.decorators import logged_in_or_basicauth
 from geonode.layers.forms import LayerStyleUploadForm
@@ -57,12 +54,18 @@ from geonode.layers.models import Layer, Style
 from geonode.layers.views import _resolve_layer, _PERMISSION_MSG_MODIFY
 from geonode.maps.models import Map
 from geonode.proxy.views import proxy
+from geonode.security.utils import get_layer_acls, get_layer_acls_version, get_viewable_resources
 from .tasks import geoserver_update_layers
-from geonode.utils import json_response, _get_basic_auth_info, http_client
+from geonode.utils import json_response, _get_basic_auth_info
 from geoserver.catalog import FailedRequestError
 from geonode.geoserver.signals import (
     gs_catalog,
     geoserver_post_save_local)
+from .capabilities import (  # noqa
+    get_layer_capabilities,
+    format_online_resource,
+    iter_capabilities,
+    iter_layers_capabilities)
 from .helpers import (
     get_stores,
     ogc_server_settings,
@@ -79,6 +82,8 @@ from django.views.decorators.cache import cache_control
 
 logger = logging.getLogger(__name__)
 
+LAYER_ACLS_CACHE_KEY = 'layer_acls_{}_{}_{}'
+
 
 def stores(request, store_type=None):
     stores = get_stores(store_type)
@@ -603,6 +608,44 @@ def _response_callback(**kwargs):
         content_type=content_type)
 
 
+def _get_acls_cache_key(request, view_name):
+    """
+    The responses of the authorization callbacks are cached per credentials
+    digest, or per user when authenticated by the session.
+    """
+    if 'HTTP_AUTHORIZATION' in request.META:
+        credentials = salted_hmac(
+            'geonode.geoserver.views.acls', request.META['HTTP_AUTHORIZATION']).hexdigest()
+    elif request.user.is_authenticated:
+        credentials = 'user_{}'.format(request.user.id)
+    else:
+        credentials = 'anonymous'
+    return LAYER_ACLS_CACHE_KEY.format(view_name, get_layer_acls_version(), credentials)
+
+
+def acls_cache(view):
+    """
+    Caches for 'LAYER_ACLS_CACHE_TIMEOUT' seconds the successful responses of an
+    authorization callback, which are then served without authenticating again.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        timeout = getattr(settings, 'LAYER_ACLS_CACHE_TIMEOUT', 60)
+        if not timeout:
+            return view(request, *args, **kwargs)
+        cache = caches[getattr(settings, 'VISIBLE_RESOURCES_CACHE', 'default')]
+        cache_key = _get_acls_cache_key(request, view.__name__)
+        content = cache.get(cache_key)
+        if content is not None:
+            return HttpResponse(content, content_type="application/json")
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(cache_key, response.content, timeout)
+        return response
+    return wrapper
+
+
+@acls_cache
 def resolve_user(request):
     user = None
     geoserver = False
@@ -639,6 +682,7 @@ def resolve_user(request):
     return HttpResponse(json.dumps(resp), content_type="application/json")
 
 
+@acls_cache
 @logged_in_or_basicauth(realm="GeoNode")
 def layer_acls(request):
     """
@@ -679,20 +723,8 @@ def layer_acls(request):
                                 content_type="text/plain")
 
     # Include permissions on the anonymous user
-    # use of polymorphic selectors/functions to optimize performances
-    resources_readable = get_objects_for_user(
-        acl_user, 'view_resourcebase',
-        ResourceBase.objects.filter(polymorphic_ctype__model='layer')).values_list('id', flat=True)
-    layer_writable = get_objects_for_user(
-        acl_user, 'change_layer_data',
-        Layer.objects.all())
-
-    _read = set(
-        Layer.objects.filter(
-            id__in=resources_readable).values_list(
-            'alternate',
-            flat=True))
-    _write = set(layer_writable.values_list('alternate', flat=True))
+    # the readable and writable layer ids are cached per user and group
+    _read, _write = get_layer_acls(acl_user)
 
     read_only = _read ^ _write
     read_write = _read & _write
@@ -712,69 +744,16 @@ def layer_acls(request):
 
 
 # capabilities
-def get_layer_capabilities(layer, version='1.3.0', access_token=None, tolerant=False):
-    """
-    Retrieve a layer-specific GetCapabilities document
-    """
-    workspace, layername = layer.alternate.split(":") if ":" in layer.alternate else (None, layer.alternate)
-    if not layer.remote_service:
-        wms_url = '%s%s/%s/wms?service=wms&version=%s&request=GetCapabilities'\
-            % (ogc_server_settings.LOCATION, workspace, layername, version)
-        if access_token:
-            wms_url += ('&access_token=%s' % access_token)
-    else:
-        wms_url = '%s?service=wms&version=%s&request=GetCapabilities'\
-            % (layer.remote_service.service_url, version)
-
-    _user, _password = ogc_server_settings.credentials
-    req, content = http_client.get(wms_url, user=_user)
-    getcap = ensure_string(content)
-    if not getattr(settings, 'DELAYED_SECURITY_SIGNALS', False):
-        if tolerant and ('ServiceException' in getcap or req.status_code == 404):
-            # WARNING Please make sure to have enabled DJANGO CACHE as per
-            # https://docs.djangoproject.com/en/2.0/topics/cache/#filesystem-caching
-            wms_url = '%s%s/ows?service=wms&version=%s&request=GetCapabilities&layers=%s'\
-                % (ogc_server_settings.public_url, workspace, version, layer)
-            if access_token:
-                wms_url += ('&access_token=%s' % access_token)
-            req, content = http_client.get(wms_url, user=_user)
-            getcap = ensure_string(content)
-
-    if 'ServiceException' in getcap or req.status_code == 404:
-        return None
-    return getcap.encode('UTF-8')
-
-
-def format_online_resource(workspace, layer, element, namespaces):
-    """
-    Replace workspace/layer-specific OnlineResource links with the more
-    generic links returned by a site-wide GetCapabilities document
-    """
-    layerName = element.find('.//wms:Capability/wms:Layer/wms:Layer/wms:Name',
-                             namespaces)
-    if layerName is None:
-        return
-
-    layerName.text = workspace + ":" + layer if workspace else layer
-    layerresources = element.findall('.//wms:OnlineResource', namespaces)
-    if layerresources is None:
-        return
-
-    for resource in layerresources:
-        wtf = resource.attrib['{http://www.w3.org/1999/xlink}href']
-        replace_string = "/" + workspace + "/" + layer if workspace else "/" + layer
-        resource.attrib['{http://www.w3.org/1999/xlink}href'] = wtf.replace(
-            replace_string, "")
-
-
 def get_capabilities(request, layerid=None, user=None,
                      mapid=None, category=None, tolerant=False):
     """
     Compile a GetCapabilities document containing public layers
     filtered by layer, user, map, or category
-    """
 
-    rootdoc = None
+    The view permission is checked for all the layers at once, and their
+    fragments are fetched concurrently; the document of several layers is
+    streamed as their fragments become available.
+    """
     layers = None
     cap_name = ' Capabilities - '
     if layerid is not None:
@@ -795,67 +774,32 @@ def get_capabilities(request, layerid=None, user=None,
             if layer.local:
                 alternates.append(layer.name)
         layers = Layer.objects.filter(alternate__in=alternates)
+    if layers is None:
+        return HttpResponse(status=200)
 
-    for layer in layers:
-        if request.user.has_perm('view_resourcebase',
-                                 layer.get_self_resource()):
-            access_token = get_or_create_token(request.user)
-            if access_token and not access_token.is_expired():
-                access_token = access_token.token
-            else:
-                access_token = None
-            try:
-                workspace, layername = layer.alternate.split(":") if ":" in layer.alternate else (None, layer.alternate)
-                layercap = get_layer_capabilities(layer,
-                                                  access_token=access_token,
-                                                  tolerant=tolerant)
-                if layercap is not None:  # 1st one, seed with real GetCapabilities doc
-                    try:
-                        namespaces = {'wms': 'http://www.opengis.net/wms',
-                                      'xlink': 'http://www.w3.org/1999/xlink',
-                                      'xsi': 'http://www.w3.org/2001/XMLSchema-instance'}
-                        layercap = dlxml.fromstring(layercap)
-                        rootdoc = etree.ElementTree(layercap)
-                        format_online_resource(workspace, layername, rootdoc, namespaces)
-                        service_name = rootdoc.find('.//wms:Service/wms:Name', namespaces)
-                        if service_name is not None:
-                            service_name.text = cap_name
-                        rootdoc = rootdoc.find('.//wms:Capability/wms:Layer/wms:Layer', namespaces)
-                    except Exception as e:
-                        import traceback
-                        traceback.print_exc()
-                        logger.error(
-                            "Error occurred creating GetCapabilities for %s: %s" %
-                            (layer.typename, str(e)))
-                        rootdoc = None
-                if layercap is None or not len(layercap) or rootdoc is None or not len(rootdoc):
-                    # Get the required info from layer model
-                    # TODO: store time dimension on DB also
-                    tpl = get_template("geoserver/layer.xml")
-                    ctx = {
-                        'layer': layer,
-                        'geoserver_public_url': ogc_server_settings.public_url,
-                        'catalogue_url': settings.CATALOGUE['default']['URL'],
-                    }
-                    gc_str = tpl.render(ctx)
-                    gc_str = gc_str.encode("utf-8", "replace")
-                    layerelem = etree.XML(gc_str)
-                    rootdoc = etree.ElementTree(layerelem)
-            except Exception as e:
-                import traceback
-                traceback.print_exc()
-                logger.error(
-                    "Error occurred creating GetCapabilities for %s:%s" %
-                    (layer.typename, str(e)))
-                rootdoc = None
-    if rootdoc is not None:
+    layers = list(get_viewable_resources(request.user, layers).select_related('remote_service', 'owner'))
+    if not layers:
+        return HttpResponse(status=200)
+
+    access_token = get_or_create_token(request.user)
+    if access_token and not access_token.is_expired():
+        access_token = access_token.token
+    else:
+        access_token = None
+
+    if len(layers) == 1:
+        fragment = next(iter_layers_capabilities(layers, access_token=access_token, tolerant=tolerant), None)
+        if fragment is None:
+            return HttpResponse(status=200)
         capabilities = etree.tostring(
-            rootdoc,
+            etree.ElementTree(etree.XML(fragment)),
             xml_declaration=True,
             encoding='UTF-8',
             pretty_print=True)
         return HttpResponse(capabilities, content_type="text/xml")
-    return HttpResponse(status=200)
+    return StreamingHttpResponse(
+        iter_capabilities(layers, cap_name, access_token=access_token, tolerant=tolerant),
+        content_type="text/xml")
 
 
 def server_online(request):
@@ -153,6 +153,37 @@ class Command(BaseCommand):
             default='UTF-8',
             help=("Specify the charset of the data"))
 
+        parser.add_argument(
+            '-w',
+            '--workers',
+            dest='workers',
+            type=int,
+            default=1,
+            help="Number of files uploaded in parallel (defaults 1)")
+
+        parser.add_argument(
+            '--retries',
+            dest='retries',
+            type=int,
+            default=0,
+            help="Number of times the upload of a file is retried on errors (defaults 0)")
+
+        parser.add_argument(
+            '--manifest',
+            dest='manifest',
+            default=None,
+            help=("A file recording the outcome of each file. The files already"
+                  " imported according to the manifest are not processed again,"
+                  " so that an interrupted import can be resumed"))
+
+        parser.add_argument(
+            '--defer-statistics',
+            dest='defer_statistics',
+            default=False,
+            action="store_true",
+            help=("Compute the attribute statistics of the imported layers in"
+                  " batches at the end of the import"))
+
     def handle(self, *args, **options):
         verbosity = int(options.get('verbosity'))
         # ignore_errors = options.get('ignore_errors')
@@ -169,6 +200,10 @@ class Command(BaseCommand):
         metadata_uploaded_preserve = options.get('metadata_uploaded_preserve',
                                                  False)
         charset = options.get('charset', 'UTF-8')
+        workers = max(1, options.get('workers') or 1)
+        retries = max(0, options.get('retries') or 0)
+        manifest = options.get('manifest', None)
+        defer_statistics = options.get('defer_statistics', False)
 
         if verbosity > 0:
             console = self.stdout
@@ -211,7 +246,11 @@ class Command(BaseCommand):
                 regions=regions,
                 private=private,
                 metadata_uploaded_preserve=metadata_uploaded_preserve,
-                charset=charset)
+                charset=charset,
+                workers=workers,
+                retries=retries,
+                manifest=manifest,
+                defer_statistics=defer_statistics)
 
             output.extend(out)
 
@@ -248,3 +287,7 @@ class Command(BaseCommand):
 
             if len(output) > 0:
                 print("{} seconds per layer".format(duration * 1.0 / len(output)))
+                processed = len(created) + len(updated) + len(failed)
+                if duration > 0:
+                    print("{} layers per second with {} workers".format(
+                        round(processed / duration, 2), workers))
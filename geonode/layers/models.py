@@ -35,7 +35,7 @@ from tinymce.models import HTMLField
 
 from geonode.base.models import ResourceBase, ResourceBaseManager, resourcebase_post_save
 from geonode.people.utils import get_valid_user
-from geonode.utils import check_shp_columnnames
+from geonode.utils import check_shp_columnnames, remove_download_archives
 from geonode.security.models import PermissionLevelMixin
 from geonode.security.utils import remove_object_permissions
 from geonode.notifications_helper import (
@@ -277,14 +277,11 @@ class Layer(ResourceBase):
     @property
     def gtype(self):
         # return attribute type without 'gml:' and 'PropertyType'
-        if self.attribute_set and self.attribute_set.count():
-            _attrs = self.attribute_set
-        else:
-            _attrs = Attribute.objects.filter(layer=self)
-        if _attrs.filter(attribute='the_geom').exists():
-            _att_type = _attrs.filter(attribute='the_geom').first().attribute_type
-            _gtype = re.match(r'\(\'gml:(.*?)\',', _att_type)
-            return _gtype.group(1) if _gtype else None
+        # (iterates over 'attribute_set.all()' so that prefetched attributes are reused)
+        for _att in self.attribute_set.all():
+            if _att.attribute == 'the_geom':
+                _gtype = re.match(r'\(\'gml:(.*?)\',', _att.attribute_type)
+                return _gtype.group(1) if _gtype else None
         return None
 
     def get_base_file(self):
@@ -332,11 +329,12 @@ class Layer(ResourceBase):
             args=("%s:%s" % (self.store, self.alternate),)
         )
 
-    def attribute_config(self):
+    def attribute_config(self, visible_attributes=None):
         # Get custom attribute sort order and labels if any
         cfg = {}
-        visible_attributes = self.attribute_set.visible()
-        if (visible_attributes.count() > 0):
+        if visible_attributes is None:
+            visible_attributes = self.attribute_set.visible()
+        if (len(visible_attributes) > 0):
             cfg["getFeatureInfo"] = {
                 "fields": [lyr.attribute for lyr in visible_attributes],
                 "propertyNames": dict([(lyr.attribute, lyr.attribute_label) for lyr in visible_attributes]),
@@ -605,6 +603,10 @@ def pre_save_layer(instance, sender, **kwargs):
         except Exception as e:
             logger.exception(e)
 
+    if instance.pk:
+        # the cached archives of the original dataset are stale once updated
+        remove_download_archives(instance.pk)
+
     if instance.abstract == '' or instance.abstract is None:
         instance.abstract = 'No abstract provided'
     if instance.title == '' or instance.title is None:
@@ -705,6 +707,8 @@ def post_delete_layer(instance, sender, **kwargs):
             default_style__id=instance.default_style.id).count() == 0:
         instance.default_style.delete()
 
+    remove_download_archives(instance.id)
+
     try:
         if instance.upload_session:
             for lf in instance.upload_session.layerfile_set.all():
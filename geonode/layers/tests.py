@@ -42,7 +42,8 @@ from django.db.models import Count
 from django.contrib.auth import get_user_model
 
 from django.conf import settings
-from django.test.utils import override_settings
+from django.db import connection
+from django.test.utils import override_settings, CaptureQueriesContext
 
 from guardian.shortcuts import get_anonymous_user
 from guardian.shortcuts import assign_perm, remove_perm
@@ -324,6 +325,20 @@ class LayersTest(GeoNodeBaseTestSupport):
 
         self.assertEqual(len(keywords), 13)
 
+    def test_layer_detail_read_only(self):
+        """The layer detail page does not write permissions nor contact roles"""
+        lyr = Layer.objects.all().first()
+        self.client.login(username='admin', password='admin')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('layer_detail', args=(lyr.alternate,)))
+        self.assertEqual(response.status_code, 200)
+        writes = [
+            query['sql'] for query in ctx.captured_queries
+            if query['sql'].startswith(('INSERT', 'DELETE')) and
+            ('guardian_' in query['sql'] or 'base_contactrole' in query['sql'])]
+        self.assertEqual(writes, [])
+        self.assertNotIn('users', response.context)
+
     def test_layer_links(self):
         lyr = Layer.objects.filter(storeType="dataStore").first()
         self.assertEqual(lyr.storeType, "dataStore")
@@ -712,6 +727,26 @@ class LayersTest(GeoNodeBaseTestSupport):
         self.assertRaises(GeoNodeException, get_valid_layer_name, 12, False)
         self.assertRaises(GeoNodeException, get_valid_layer_name, 12, True)
 
+    def test_upload_manifest(self):
+        d = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(d, 'imported.tif')
+            open(filename, 'w').close()
+            manifest = os.path.join(d, 'manifest.json')
+            with open(manifest, 'w') as f:
+                f.write(json.dumps({'source': filename, 'status': 'created', 'name': 'imported'}) + '\n')
+                # truncated by an interrupted run
+                f.write('{"source": ')
+
+            entries = utils.read_upload_manifest(manifest)
+            self.assertEqual(list(entries.keys()), [filename])
+
+            # the files already imported are not uploaded again
+            output = utils.upload(d, manifest=manifest, workers=2, verbosity=0)
+            self.assertEqual(output, [{'file': filename, 'status': 'skipped', 'name': 'imported'}])
+        finally:
+            shutil.rmtree(d)
+
     # NOTE: we don't care about file content for many of these tests (the
     # forms under test validate based only on file name, and leave actual
     # content inspection to GeoServer) but Django's form validation will omit
@@ -28,10 +28,13 @@ import glob
 import string
 import sys
 import json
+import time
 import logging
 import tarfile
+import threading
 
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
 from osgeo import gdal, osr, ogr
@@ -42,13 +45,14 @@ from six import string_types, reraise as raise_
 # Django functionality
 from django.conf import settings
 from django.db.models import Q
-from django.db import IntegrityError, transaction
+from django.db import IntegrityError, transaction, connection
 from django.core.files import File
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
 from django.template.defaultfilters import slugify
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.files.storage import default_storage as storage
+from django.utils import timezone
 from django.utils.translation import ugettext as _
 
 # Geonode functionality
@@ -70,7 +74,7 @@ from geonode.utils import (http_client,
                            extract_tarfile,
                            get_layer_name,
                            get_layer_workspace,
-                           bbox_to_projection)
+                           bboxes_to_projection)
 
 READ_PERMISSIONS = [
     'view_resourcebase'
@@ -797,27 +801,7 @@ def file_upload(filename,
     return layer
 
 
-def upload(incoming, user=None, overwrite=False,
-           name=None, title=None, abstract=None, date=None,
-           license=None,
-           category=None, keywords=None, regions=None,
-           skip=True, ignore_errors=True,
-           verbosity=1, console=None,
-           private=False, metadata_uploaded_preserve=False,
-           charset='UTF-8'):
-    """Upload a directory of spatial data files to GeoNode
-
-       This function also verifies that each layer is in GeoServer.
-
-       Supported extensions are: .shp, .tif, .tar, .tar.gz, and .zip (of a shapefile).
-       It catches GeoNodeExceptions and gives a report per file
-    """
-    if verbosity > 1:
-        print("Verifying that GeoNode is running ...", file=console)
-
-    if console is None:
-        console = open(os.devnull, 'w')
-
+def _get_upload_files(incoming):
     potential_files = []
     if os.path.isfile(incoming):
         ___, short_filename = os.path.split(incoming)
@@ -844,41 +828,47 @@ def upload(incoming, user=None, overwrite=False,
                     potential_files.append((basename, filename))
                 elif short_filename.endswith('.tar.gz'):
                     potential_files.append((basename, filename))
+    return potential_files
 
-    # After gathering the list of potential files,
-    # let's process them one by one.
-    number = len(potential_files)
-    if verbosity > 1:
-        msg = "Found %d potential layers." % number
-        print(msg, file=console)
 
-    if (number > 1) and (name is not None):
-        msg = 'Failed to process.  Cannot specify name with multiple imports.'
-        raise Exception(msg)
+def read_upload_manifest(manifest):
+    """Returns the last status of the files recorded in an upload manifest,
+    a JSON lines file with an entry per processed file.
+    """
+    entries = {}
+    if manifest and os.path.exists(manifest):
+        with open(manifest) as manifest_file:
+            for line in manifest_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # truncated by an interrupted run
+                    continue
+                entries[entry['source']] = entry
+    return entries
 
-    output = []
-    for i, file_pair in enumerate(potential_files):
-        basename, filename = file_pair
-        existing_layers = Layer.objects.filter(name=basename)
 
-        if existing_layers.count() > 0:
-            existed = True
-        else:
-            existed = False
+def _upload_file(basename, filename, user=None, overwrite=False,
+                 skip=True, private=False, retries=0, verbosity=1,
+                 **kwargs):
+    """Uploads a single data file, retrying 'retries' times on errors.
+
+    Returns a tuple (status, layer, exc_info).
+    """
+    try:
+        existing_layers = Layer.objects.filter(name=basename)
+        existed = existing_layers.exists()
 
         if existed and skip:
-            save_it = False
-            status = 'skipped'
-            layer = existing_layers[0]
             if verbosity > 0:
                 msg = ('Stopping process because '
                        '--overwrite was not set '
                        'and a layer with this name already exists.')
                 print(msg, file=sys.stderr)
-        else:
-            save_it = True
+            return 'skipped', existing_layers[0], None
 
-        if save_it:
+        attempt = 0
+        while True:
             try:
                 if is_zipfile(filename):
                     filename = unzip_file(filename)
@@ -886,63 +876,198 @@ def upload(incoming, user=None, overwrite=False,
                 if tarfile.is_tarfile(filename):
                     filename = extract_tarfile(filename)
 
+                # A failed attempt may have left a layer behind: overwrite
+                # it instead of creating a duplicate
+                _overwrite = overwrite or (
+                    attempt > 0 and not existed and Layer.objects.filter(name=basename).exists())
                 layer = file_upload(
                     filename,
-                    name=name,
-                    title=title,
-                    abstract=abstract,
-                    date=date,
                     user=user,
-                    overwrite=overwrite,
-                    license=license,
-                    category=category,
-                    keywords=keywords,
-                    regions=regions,
-                    metadata_uploaded_preserve=metadata_uploaded_preserve,
-                    charset=charset)
-                if not existed:
-                    status = 'created'
-                else:
-                    status = 'updated'
-                if private and user:
-                    perm_spec = {
-                        "users": {
-                            "AnonymousUser": [],
-                            user.username: [
-                                "change_resourcebase_metadata",
-                                "change_layer_data",
-                                "change_layer_style",
-                                "change_resourcebase",
-                                "delete_resourcebase",
-                                "change_resourcebase_permissions",
-                                "publish_resourcebase"]},
-                        "groups": {}}
-                    layer.set_permissions(perm_spec)
+                    overwrite=_overwrite,
+                    **kwargs)
+                break
             except Exception as e:
-                if ignore_errors:
-                    status = 'failed'
-                    exception_type, error, traceback = sys.exc_info()
-                else:
-                    if verbosity > 0:
-                        msg = ('Stopping process because '
-                               '--ignore-errors was not set '
-                               'and an error was found.')
-                        print(msg, file=sys.stderr)
-                        msg = 'Failed to process %s' % filename
-                        raise_(Exception, e, sys.exc_info()[2])
-
-        msg = "[%s] Layer for '%s' (%d/%d)" % (status, filename, i + 1, number)
-        info = {'file': filename, 'status': status}
-        if status == 'failed':
-            info['traceback'] = traceback
-            info['exception_type'] = exception_type
-            info['error'] = error
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                logger.warning(
+                    "Failed to upload %s (attempt %d of %d): %s" % (filename, attempt, retries + 1, e))
+                time.sleep(min(2 ** attempt, 30))
+
+        if private and user:
+            perm_spec = {
+                "users": {
+                    "AnonymousUser": [],
+                    user.username: [
+                        "change_resourcebase_metadata",
+                        "change_layer_data",
+                        "change_layer_style",
+                        "change_resourcebase",
+                        "delete_resourcebase",
+                        "change_resourcebase_permissions",
+                        "publish_resourcebase"]},
+                "groups": {}}
+            layer.set_permissions(perm_spec)
+        return 'updated' if existed else 'created', layer, None
+    except Exception:
+        return 'failed', None, sys.exc_info()
+
+
+def _upload_file_worker(args):
+    basename, filename, kwargs = args
+    kwargs = dict(kwargs)
+    defer_statistics = kwargs.pop('defer_statistics', False)
+    if defer_statistics:
+        # the deferral is scoped to the thread uploading the file
+        from geonode.geoserver.helpers import defer_attribute_statistics
+        defer_attribute_statistics()
+    try:
+        return _upload_file(basename, filename, **kwargs)
+    finally:
+        if defer_statistics:
+            defer_attribute_statistics(False)
+        # every worker thread opens its own database connection
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()
+
+
+def queue_attribute_statistics(since, batch_size=50):
+    """Queues, in batches, the computation of the attribute statistics
+    deferred for the layers updated since a date.
+    """
+    if not check_ogc_backend(geoserver.BACKEND_PACKAGE):
+        return 0
+    from geonode.geoserver.tasks import geoserver_attribute_statistics
+
+    layer_ids = list(Layer.objects.filter(
+        last_updated__gte=since,
+        attribute_set__last_stats_updated__isnull=True).distinct().values_list('id', flat=True))
+    for i in range(0, len(layer_ids), batch_size):
+        geoserver_attribute_statistics.apply_async((layer_ids[i:i + batch_size], ))
+    return len(layer_ids)
+
+
+def upload(incoming, user=None, overwrite=False,
+           name=None, title=None, abstract=None, date=None,
+           license=None,
+           category=None, keywords=None, regions=None,
+           skip=True, ignore_errors=True,
+           verbosity=1, console=None,
+           private=False, metadata_uploaded_preserve=False,
+           charset='UTF-8', workers=1, retries=0, manifest=None,
+           defer_statistics=False):
+    """Upload a directory of spatial data files to GeoNode
+
+       This function also verifies that each layer is in GeoServer.
+
+       Supported extensions are: .shp, .tif, .tar, .tar.gz, and .zip (of a shapefile).
+       It catches GeoNodeExceptions and gives a report per file
+
+       The files are uploaded by a pool of 'workers' threads, each file being
+       retried 'retries' times on errors. The outcome of each file is appended
+       to the 'manifest' file, if any, and the files already created, updated
+       or skipped by a previous run with the same manifest are not processed
+       again.
+
+       With 'defer_statistics', the attribute statistics of the layers
+       published by this run are not computed while they are published, but
+       queued in batches at the end of the run.
+    """
+    if verbosity > 1:
+        print("Verifying that GeoNode is running ...", file=console)
+
+    if console is None:
+        console = open(os.devnull, 'w')
+
+    potential_files = _get_upload_files(incoming)
+
+    # After gathering the list of potential files,
+    # let's process them one by one.
+    number = len(potential_files)
+    if verbosity > 1:
+        msg = "Found %d potential layers." % number
+        print(msg, file=console)
+
+    if (number > 1) and (name is not None):
+        msg = 'Failed to process.  Cannot specify name with multiple imports.'
+        raise Exception(msg)
+
+    start = timezone.now()
+    _defer_statistics = defer_statistics and check_ogc_backend(geoserver.BACKEND_PACKAGE)
+    processed = read_upload_manifest(manifest)
+    output = []
+    jobs = []
+    for basename, filename in potential_files:
+        entry = processed.get(filename)
+        if entry and entry['status'] != 'failed':
+            output.append({'file': filename, 'status': 'skipped', 'name': entry.get('name')})
+            if verbosity > 0:
+                print("[skipped] Layer for '%s' already processed" % filename, file=console)
+            continue
+        jobs.append((basename, filename, dict(
+            name=name,
+            title=title,
+            abstract=abstract,
+            date=date,
+            user=user,
+            overwrite=overwrite,
+            license=license,
+            category=category,
+            keywords=keywords,
+            regions=regions,
+            metadata_uploaded_preserve=metadata_uploaded_preserve,
+            charset=charset,
+            skip=skip,
+            private=private,
+            retries=retries,
+            verbosity=verbosity,
+            defer_statistics=_defer_statistics)))
+
+    manifest_file = open(manifest, 'a') if manifest else None
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    futures = []
+    try:
+        if executor:
+            futures = [executor.submit(_upload_file_worker, job) for job in jobs]
+            results = (future.result() for future in futures)
         else:
-            info['name'] = layer.name
+            results = map(_upload_file_worker, jobs)
+        for i, ((basename, filename, ___), (status, layer, exc_info)) in enumerate(zip(jobs, results)):
+            if status == 'failed' and not ignore_errors:
+                if verbosity > 0:
+                    msg = ('Stopping process because '
+                           '--ignore-errors was not set '
+                           'and an error was found.')
+                    print(msg, file=sys.stderr)
+                raise_(Exception, exc_info[1], exc_info[2])
+
+            msg = "[%s] Layer for '%s' (%d/%d)" % (status, filename, i + 1, len(jobs))
+            info = {'file': filename, 'status': status}
+            if status == 'failed':
+                info['exception_type'], info['error'], info['traceback'] = exc_info
+            else:
+                info['name'] = layer.name
 
-        output.append(info)
-        if verbosity > 0:
-            print(msg, file=console)
+            if manifest_file:
+                manifest_file.write(json.dumps({
+                    'source': filename,
+                    'status': status,
+                    'name': info.get('name'),
+                    'error': str(info['error']) if status == 'failed' else None}) + '\n')
+                manifest_file.flush()
+
+            output.append(info)
+            if verbosity > 0:
+                print(msg, file=console)
+    finally:
+        if executor:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+        if manifest_file:
+            manifest_file.close()
+        if _defer_statistics:
+            queue_attribute_statistics(start)
     return output
 
 
@@ -1116,8 +1241,7 @@ def create_gs_thumbnail_geonode(instance, overwrite=False, check_bbox=False):
                 elif Layer.objects.filter(alternate=layer.name).count() > 0:
                     _l = Layer.objects.filter(alternate=layer.name).first()
                 if _l:
-                    wgs84_bbox = bbox_to_projection(_l.bbox)
-                    local_bboxes.append(wgs84_bbox)
+                    local_bboxes.append(_l.bbox)
                     if _l.storeType != "remoteStore":
                         local_layers.append(_l.alternate)
         layers = ",".join(local_layers)
@@ -1132,14 +1256,14 @@ def create_gs_thumbnail_geonode(instance, overwrite=False, check_bbox=False):
                 alternate=instance.alternate)
         for _l in _ll:
             if _l.name == instance.name:
-                wgs84_bbox = bbox_to_projection(_l.bbox)
-                local_bboxes.append(wgs84_bbox)
+                local_bboxes.append(_l.bbox)
                 if _l.storeType != "remoteStore":
                     local_layers.append(_l.alternate)
         layers = ",".join(local_layers)
 
     if local_bboxes:
-        for _bbox in local_bboxes:
+        # Reproject the bboxes of all the layers at once
+        for _bbox in bboxes_to_projection(local_bboxes):
             if bbox is None:
                 bbox = list(_bbox)
             else:
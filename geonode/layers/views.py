@@ -48,6 +48,7 @@ from django.urls import reverse
 from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import render
 from django.conf import settings
+from django.core.cache import cache
 from django.utils.translation import ugettext as _
 from django.views.decorators.http import require_http_methods
 
@@ -100,14 +101,13 @@ from geonode.utils import (
     default_map_config,
     check_ogc_backend,
     llbbox_to_mercator,
-    bbox_to_projection,
+    bboxes_to_projection,
     build_social_links,
     GXPLayer,
     GXPMap)
 
 from geonode.geoserver.helpers import (ogc_server_settings,
                                        set_layer_style)
-from geonode.base.utils import ManageResourceOwnerPermissions
 from geonode.tasks.tasks import set_permissions
 
 from celery.utils.log import get_logger
@@ -141,6 +141,25 @@ _PERMISSION_MSG_METADATA = _(
     "You are not permitted to modify this layer's metadata")
 _PERMISSION_MSG_VIEW = _("You are not permitted to view this layer")
 
+LAYER_DETAIL_CONFIG_KEY = 'layer_detail_config_{}_{}'
+
+GXP_CAPABILITY_FORMATS = [
+    "image/png", "application/atom xml", "application/atom+xml", "application/json;type=utfgrid",
+    "application/openlayers", "application/pdf", "application/rss xml", "application/rss+xml",
+    "application/vnd.google-earth.kml", "application/vnd.google-earth.kml xml",
+    "application/vnd.google-earth.kml+xml", "application/vnd.google-earth.kml+xml;mode=networklink",
+    "application/vnd.google-earth.kmz", "application/vnd.google-earth.kmz xml",
+    "application/vnd.google-earth.kmz+xml", "application/vnd.google-earth.kmz;mode=networklink", "atom",
+    "image/geotiff", "image/geotiff8", "image/gif", "image/gif;subtype=animated", "image/jpeg", "image/png8",
+    "image/png; mode=8bit", "image/svg", "image/svg xml", "image/svg+xml", "image/tiff", "image/tiff8",
+    "image/vnd.jpeg-png", "kml", "kmz", "openlayers", "rss", "text/html; subtype=openlayers", "utfgrid"
+]
+
+GXP_CAPABILITY_INFO_FORMATS = [
+    "text/plain", "application/vnd.ogc.gml", "text/xml", "application/vnd.ogc.gml/3.1.1",
+    "text/xml; subtype=gml/3.1.1", "text/html", "application/json"
+]
+
 
 def log_snippet(log_file):
     if not log_file or not os.path.isfile(log_file):
@@ -402,25 +421,18 @@ def layer_upload(request, template='upload/layer_upload.html'):
             status=status_code)
 
 
-def layer_detail(request, layername, template='layers/layer_detail.html'):
-    try:
-        layer = _resolve_layer(
-            request,
-            layername,
-            'base.view_resourcebase',
-            _PERMISSION_MSG_VIEW)
-    except PermissionDenied:
-        return HttpResponse(_("Not allowed"), status=403)
-    except Exception:
-        raise Http404(_("Not found"))
-    if not layer:
-        raise Http404(_("Not found"))
-
-    permission_manager = ManageResourceOwnerPermissions(layer)
-    permission_manager.set_owner_permissions_according_to_workflow()
+def _get_layer_detail_config(request, layer):
+    """
+    Returns the GXP configuration of the layer displayed by the detail page,
+    along with the time dimension values of the layer, if any.
 
-    # Add metadata_author or poc if missing
-    layer.add_missing_metadata_author_or_poc()
+    The configuration depends on the layer metadata only, hence it is cached
+    until the layer is updated instead of being rebuilt for every request.
+    """
+    cache_key = LAYER_DETAIL_CONFIG_KEY.format(layer.id, layer.last_updated.isoformat() if layer.last_updated else '')
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
 
     def decimal_encode(bbox):
         _bbox = []
@@ -466,6 +478,11 @@ def layer_detail(request, layername, template='layers/layer_detail.html'):
         layer.owner)
     srs = getattr(settings, 'DEFAULT_MAP_CRS', 'EPSG:3857')
     srs_srid = int(srs.split(":")[1]) if srs != "EPSG:900913" else 3857
+    # Reproject the bbox once for every target projection
+    native_bbox = [float(coord) for coord in layer_bbox] + [layer.srid, ]
+    projected_bboxes = dict(
+        (target_srid, bboxes_to_projection([native_bbox], target_srid=target_srid)[0])
+        for target_srid in set((int(srs.split(":")[1]), srs_srid, 4326, 3857)))
     config["attribution"] = "<span class='gx-attribution-title'>%s</span>" % attribution
     config["format"] = getattr(
         settings, 'DEFAULT_LAYER_FORMAT', 'image/png')
@@ -473,8 +490,7 @@ def layer_detail(request, layername, template='layers/layer_detail.html'):
     config["wrapDateLine"] = True
     config["visibility"] = True
     config["srs"] = srs
-    config["bbox"] = bbox_to_projection([float(coord) for coord in layer_bbox] + [layer.srid, ],
-                                        target_srid=int(srs.split(":")[1]))[:4]
+    config["bbox"] = projected_bboxes[int(srs.split(":")[1])][:4]
 
     config["capability"] = {
         "abstract": layer.abstract,
@@ -490,52 +506,35 @@ def layer_detail(request, layername, template='layers/layer_detail.html'):
             },
             srs: {
                 "srs": srs,
-                "bbox": bbox_to_projection([float(coord) for coord in layer_bbox] + [layer.srid, ],
-                                           target_srid=srs_srid)[:4]
+                "bbox": projected_bboxes[srs_srid][:4]
             },
             "EPSG:4326": {
                 "srs": "EPSG:4326",
                 "bbox": decimal_encode(bbox) if layer.srid == 'EPSG:4326' else
-                bbox_to_projection(
-                    [float(coord) for coord in layer_bbox] + [layer.srid, ], target_srid=4326)[:4]
+                projected_bboxes[4326][:4]
             },
             "EPSG:900913": {
                 "srs": "EPSG:900913",
                 "bbox": decimal_encode(bbox) if layer.srid == 'EPSG:900913' else
-                bbox_to_projection(
-                    [float(coord) for coord in layer_bbox] + [layer.srid, ], target_srid=3857)[:4]
+                projected_bboxes[3857][:4]
             }
         },
         "srs": {
             srs: True
         },
-        "formats": ["image/png", "application/atom xml", "application/atom+xml", "application/json;type=utfgrid",
-                    "application/openlayers", "application/pdf", "application/rss xml", "application/rss+xml",
-                    "application/vnd.google-earth.kml", "application/vnd.google-earth.kml xml",
-                    "application/vnd.google-earth.kml+xml", "application/vnd.google-earth.kml+xml;mode=networklink",
-                    "application/vnd.google-earth.kmz", "application/vnd.google-earth.kmz xml",
-                    "application/vnd.google-earth.kmz+xml", "application/vnd.google-earth.kmz;mode=networklink",
-                    "atom", "image/geotiff", "image/geotiff8", "image/gif", "image/gif;subtype=animated",
-                    "image/jpeg", "image/png8", "image/png; mode=8bit", "image/svg", "image/svg xml",
-                    "image/svg+xml", "image/tiff", "image/tiff8", "image/vnd.jpeg-png",
-                    "kml", "kmz", "openlayers", "rss", "text/html; subtype=openlayers", "utfgrid"],
+        "formats": GXP_CAPABILITY_FORMATS,
         "attribution": {
             "title": attribution
         },
-        "infoFormats": ["text/plain", "application/vnd.ogc.gml", "text/xml", "application/vnd.ogc.gml/3.1.1",
-                        "text/xml; subtype=gml/3.1.1", "text/html", "application/json"],
+        "infoFormats": GXP_CAPABILITY_INFO_FORMATS,
         "styles": [sld_definition(s) for s in layer.styles.all()],
         "prefix": layer.alternate.split(":")[0] if ":" in layer.alternate else "",
         "keywords": [k.name for k in layer.keywords.all()] if layer.keywords else [],
         "llbbox": decimal_encode(bbox) if layer.srid == 'EPSG:4326' else
-        bbox_to_projection(
-            [float(coord) for coord in layer_bbox] + [layer.srid, ], target_srid=4326)[:4]
+        projected_bboxes[4326][:4]
     }
 
-    granules = None
     all_times = None
-    all_granules = None
-    filter = None
     if check_ogc_backend(geoserver.BACKEND_PACKAGE):
         if layer.has_time:
             from geonode.geoserver.views import get_capabilities
@@ -575,6 +574,30 @@ def layer_detail(request, layername, template='layers/layer_detail.html'):
                         "values": all_times
                     }
                 }
+    cache.set(cache_key, (config, all_times))
+    return config, all_times
+
+
+def layer_detail(request, layername, template='layers/layer_detail.html'):
+    try:
+        layer = _resolve_layer(
+            request,
+            layername,
+            'base.view_resourcebase',
+            _PERMISSION_MSG_VIEW)
+    except PermissionDenied:
+        return HttpResponse(_("Not allowed"), status=403)
+    except Exception:
+        raise Http404(_("Not found"))
+    if not layer:
+        raise Http404(_("Not found"))
+
+    config, all_times = _get_layer_detail_config(request, layer)
+
+    granules = None
+    all_granules = None
+    filter = None
+    if check_ogc_backend(geoserver.BACKEND_PACKAGE):
         if layer.is_mosaic:
             try:
                 cat = gs_catalog
@@ -752,13 +775,13 @@ def layer_detail(request, layername, template='layers/layer_detail.html'):
             from geonode.favorite.utils import get_favorite_info
             context_dict["favorite_info"] = get_favorite_info(request.user, layer)
 
+    # the users are loaded by the permissions form through the profiles API, and
+    # the groups are only fetched when the form is actually rendered
     if request.user.is_authenticated and (request.user.is_superuser or "change_resourcebase_permissions" in perms_list):
-        context_dict['users'] = [user for user in get_user_model().objects.all().exclude(
-            id=request.user.id).exclude(is_superuser=True).order_by('username')]
         if request.user.is_superuser:
-            context_dict['groups'] = [group for group in GroupProfile.objects.all()]
+            context_dict['groups'] = GroupProfile.objects.all()
         else:
-            context_dict['groups'] = [group for group in request.user.group_list_all()]
+            context_dict['groups'] = request.user.group_list_all()
 
     register_event(request, 'view', layer)
     context_dict['map_layers'] = [map_layer for map_layer in layer.maps() if
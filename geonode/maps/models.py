@@ -18,13 +18,15 @@
 #
 #########################################################################
 
+import copy
+import json
+import hashlib
 import logging
 import uuid
 
 from django.conf import settings
 from django.db import models
-from django.db.models import signals
-import json
+from django.db.models import signals, F, Prefetch
 from django.contrib.contenttypes.models import ContentType
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ObjectDoesNotExist
@@ -32,11 +34,11 @@ from django.urls import reverse
 from django.template.defaultfilters import slugify
 from django.core.cache import cache
 
-from geonode.layers.models import Layer
+from geonode.layers.models import Layer, Attribute
 from geonode.compat import ensure_string
 from geonode.base.models import ResourceBase, resourcebase_post_save
 from geonode.maps.signals import map_changed_signal
-from geonode.security.utils import remove_object_permissions
+from geonode.security.utils import remove_object_permissions, get_resources_ids_with_perm
 from geonode.client.hooks import hookset
 from geonode.utils import (GXPMapBase,
                            GXPLayerBase,
@@ -51,6 +53,8 @@ from pinax.ratings.models import OverallRating
 
 logger = logging.getLogger("geonode.maps.models")
 
+MAP_LAYERS_CONFIG_KEY = 'map_layers_config_{}_{}'
+
 
 class Map(ResourceBase, GXPMapBase):
 
@@ -106,6 +110,43 @@ class Map(ResourceBase, GXPMapBase):
         layers = MapLayer.objects.filter(map=self.id)
         return [layer for layer in layers]
 
+    def layers_config(self, layers, user=None):
+        """
+        Bulk version of 'MapLayer.layer_config' for the layers of this map.
+
+        The local layers, their visible attributes and the user permissions are
+        resolved with a fixed number of queries, whatever the number of layers.
+        The permission independent part of the configuration is cached per map
+        version, so that only the user specific overlay is computed per request.
+        """
+        stored = bool(self.id) and all(lyr.id and lyr.map_id == self.id for lyr in layers)
+        cache_key = None
+        base_configs = None
+        if stored:
+            version = hashlib.md5(json.dumps(
+                [str(self.last_updated)] + [lyr.id for lyr in layers]).encode('utf-8')).hexdigest()
+            cache_key = MAP_LAYERS_CONFIG_KEY.format(self.id, version)
+            base_configs = cache.get(cache_key)
+        if base_configs is None:
+            base_configs = [
+                (lyr.base_layer_config(layer), layer.id if layer else None)
+                for lyr, layer in zip(layers, MapLayer.resolve_layers(layers))]
+            if cache_key:
+                cache.set(cache_key, base_configs)
+
+        readable = None
+        if user is not None:
+            readable = get_resources_ids_with_perm(
+                user, [resource_id for cfg, resource_id in base_configs])
+        configs = []
+        for cfg, resource_id in base_configs:
+            cfg = copy.deepcopy(cfg)
+            if resource_id and readable is not None and resource_id not in readable:
+                cfg['disabled'] = True
+                cfg['visibility'] = False
+            configs.append(cfg)
+        return configs
+
     @property
     def local_layers(self):
         layer_names = MapLayer.objects.filter(map__id=self.id).values('name')
@@ -496,6 +537,51 @@ class MapLayer(models.Model, GXPLayerBase):
     local = models.BooleanField(default=False)
     # True if this layer is served by the local geoserver
 
+    @staticmethod
+    def resolve_layers(map_layers):
+        """
+        Returns the local Layer of each one of the given map layers, in the same
+        order, or None if the layer cannot be resolved.
+
+        All the layers are fetched with a single query, and their visible
+        attributes with another one.
+        """
+        names = set(lyr.name for lyr in map_layers if lyr.name)
+        if not names:
+            return [None] * len(map_layers)
+        layers = Layer.objects.filter(alternate__in=names).annotate(
+            remote_service_url=F('remote_service__base_url')).prefetch_related(
+                Prefetch(
+                    'attribute_set',
+                    queryset=Attribute.objects.filter(visible=True).order_by('display_order'),
+                    to_attr='visible_attributes'))
+        layers_by_name = {}
+        for layer in layers:
+            layers_by_name.setdefault(layer.alternate, []).append(layer)
+
+        resolved = []
+        for lyr in map_layers:
+            resolved.append(next((
+                layer for layer in layers_by_name.get(lyr.name, [])
+                if lyr.local and layer.store == lyr.store or
+                not lyr.local and layer.remote_service_url == lyr.ows_url), None))
+        return resolved
+
+    def base_layer_config(self, layer=None):
+        """
+        Returns the user independent part of the layer configuration, merging the
+        attribute configuration of the resolved local layer, if any.
+        """
+        cfg = GXPLayerBase.layer_config(self)
+        if layer is not None:
+            attribute_cfg = layer.attribute_config(
+                visible_attributes=getattr(layer, 'visible_attributes', None))
+            if "ftInfoTemplate" in attribute_cfg:
+                cfg["ftInfoTemplate"] = attribute_cfg["ftInfoTemplate"]
+            if "getFeatureInfo" in attribute_cfg:
+                cfg["getFeatureInfo"] = attribute_cfg["getFeatureInfo"]
+        return cfg
+
     def layer_config(self, user=None):
         # Try to use existing user-specific cache of layer config
         if self.id:
@@ -506,32 +592,17 @@ class MapLayer(models.Model, GXPLayerBase):
             if cfg is not None:
                 return cfg
 
-        cfg = GXPLayerBase.layer_config(self, user=user)
         # if this is a local layer, get the attribute configuration that
         # determines display order & attribute labels
-        if Layer.objects.filter(alternate=self.name).exists():
-            try:
-                if self.local:
-                    layer = Layer.objects.get(store=self.store, alternate=self.name)
-                else:
-                    layer = Layer.objects.get(
-                        alternate=self.name,
-                        remote_service__base_url=self.ows_url)
-                attribute_cfg = layer.attribute_config()
-                if "ftInfoTemplate" in attribute_cfg:
-                    cfg["ftInfoTemplate"] = attribute_cfg["ftInfoTemplate"]
-                if "getFeatureInfo" in attribute_cfg:
-                    cfg["getFeatureInfo"] = attribute_cfg["getFeatureInfo"]
-                if not user.has_perm(
-                        'base.view_resourcebase',
-                        obj=layer.resourcebase_ptr):
-                    cfg['disabled'] = True
-                    cfg['visibility'] = False
-            except Exception:
-                # shows maplayer with pink tiles,
-                # and signals that there is problem
-                # TODO: clear orphaned MapLayers
-                layer = None
+        # shows maplayer with pink tiles if the layer cannot be resolved
+        # TODO: clear orphaned MapLayers
+        layer = MapLayer.resolve_layers([self])[0]
+        cfg = self.base_layer_config(layer)
+        if layer is not None and user is not None and not user.has_perm(
+                'base.view_resourcebase',
+                obj=layer.resourcebase_ptr):
+            cfg['disabled'] = True
+            cfg['visibility'] = False
 
         if self.id:
             # Create temporary cache of maplayer config, should not last too long in case
@@ -26,6 +26,8 @@ from defusedxml import lxml as dlxml
 from pinax.ratings.models import OverallRating
 
 from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.conf import settings
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
@@ -257,6 +259,18 @@ community."
                       for x in cfg['map']['layers'] if is_wms_layer(x)]
         self.assertEqual(layernames, ['geonode:CA', ])
 
+    def test_map_layers_config(self):
+        """ The map layers configuration is resolved with a fixed number of queries
+            and matches the one of the single map layers"""
+        map_obj = Map.objects.all().first()
+        layers = list(map_obj.layers)
+        user = get_user_model().objects.get(username='bobby')
+        expected = [lyr.layer_config(user=user) for lyr in layers]
+        with CaptureQueriesContext(connection) as ctx:
+            configs = map_obj.layers_config(layers, user=user)
+        self.assertEqual(configs, expected)
+        self.assertLessEqual(len(ctx.captured_queries), 5)
+
     def test_map_to_wmc(self):
         """ /maps/1/wmc -> Test map WMC export
             Make some assertions about the data structure produced
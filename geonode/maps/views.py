@@ -55,7 +55,7 @@ from geonode.utils import (
     build_social_links,
     http_client,
     forward_mercator,
-    bbox_to_projection,
+    bboxes_to_projection,
     default_map_config,
     resolve_object,
     check_ogc_backend)
@@ -808,6 +808,7 @@ def add_layers_to_map_config(
 
     bbox = []
     layers = []
+    visible_layers = []
     for layer_name in layer_names:
         try:
             layer = _resolve_layer(request, layer_name)
@@ -823,7 +824,18 @@ def add_layers_to_map_config(
                 obj=layer.get_self_resource()):
             # invisible layer, skip inclusion
             continue
-
+        visible_layers.append(layer)
+
+    srs = getattr(settings, 'DEFAULT_MAP_CRS', 'EPSG:3857')
+    srs_srid = int(srs.split(":")[1]) if srs != "EPSG:900913" else 3857
+    # Reproject the bboxes of all the layers at once for every target projection
+    native_bboxes = [
+        [float(coord) for coord in layer.bbox[0:4]] + [layer.srid, ] for layer in visible_layers]
+    projected_bboxes = dict(
+        (target_srid, bboxes_to_projection(native_bboxes, target_srid=target_srid))
+        for target_srid in set((int(srs.split(":")[1]), srs_srid, 4326, 3857)))
+
+    for index, layer in enumerate(visible_layers):
         layer_bbox = layer.bbox[0:4]
         bbox = layer_bbox[:]
         bbox[0] = layer_bbox[0]
@@ -867,8 +879,6 @@ def add_layers_to_map_config(
         attribution = "%s %s" % (layer.owner.first_name,
                                  layer.owner.last_name) if layer.owner.first_name or layer.owner.last_name else str(
             layer.owner)
-        srs = getattr(settings, 'DEFAULT_MAP_CRS', 'EPSG:3857')
-        srs_srid = int(srs.split(":")[1]) if srs != "EPSG:900913" else 3857
         config["attribution"] = "<span class='gx-attribution-title'>%s</span>" % attribution
         config["format"] = getattr(
             settings, 'DEFAULT_LAYER_FORMAT', 'image/png')
@@ -876,9 +886,7 @@ def add_layers_to_map_config(
         config["wrapDateLine"] = True
         config["visibility"] = True
         config["srs"] = srs
-        config["bbox"] = decimal_encode(
-            bbox_to_projection([float(coord) for coord in layer_bbox] + [layer.srid, ],
-                               target_srid=int(srs.split(":")[1]))[:4])
+        config["bbox"] = decimal_encode(projected_bboxes[int(srs.split(":")[1])][index][:4])
         config["capability"] = {
             "abstract": layer.abstract,
             "store": layer.store,
@@ -893,21 +901,17 @@ def add_layers_to_map_config(
                 },
                 srs: {
                     "srs": srs,
-                    "bbox": decimal_encode(
-                        bbox_to_projection([float(coord) for coord in layer_bbox] + [layer.srid, ],
-                                           target_srid=srs_srid)[:4])
+                    "bbox": decimal_encode(projected_bboxes[srs_srid][index][:4])
                 },
                 "EPSG:4326": {
                     "srs": "EPSG:4326",
                     "bbox": decimal_encode(bbox) if layer.srid == 'EPSG:4326' else
-                    bbox_to_projection(
-                        [float(coord) for coord in layer_bbox] + [layer.srid, ], target_srid=4326)[:4]
+                    projected_bboxes[4326][index][:4]
                 },
                 "EPSG:900913": {
                     "srs": "EPSG:900913",
                     "bbox": decimal_encode(bbox) if layer.srid == 'EPSG:900913' else
-                    bbox_to_projection(
-                        [float(coord) for coord in layer_bbox] + [layer.srid, ], target_srid=3857)[:4]
+                    projected_bboxes[3857][index][:4]
                 }
             },
             "srs": {
@@ -932,8 +936,7 @@ def add_layers_to_map_config(
             "prefix": layer.alternate.split(":")[0] if ":" in layer.alternate else "",
             "keywords": [k.name for k in layer.keywords.all()] if layer.keywords else [],
             "llbbox": decimal_encode(bbox) if layer.srid == 'EPSG:4326' else
-            bbox_to_projection(
-                [float(coord) for coord in layer_bbox] + [layer.srid, ], target_srid=4326)[:4]
+            projected_bboxes[4326][index][:4]
         }
 
         all_times = None
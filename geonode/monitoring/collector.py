@@ -23,6 +23,7 @@ import pytz
 from datetime import datetime, timedelta
 from decimal import Decimal
 from itertools import chain
+from collections import Counter
 from six import string_types, integer_types
 
 from django.conf import settings
@@ -38,8 +39,9 @@ from django.urls import resolve, Resolver404
 from geonode.utils import raw_sql
 from geonode.notifications_helper import send_notification
 from geonode.monitoring import MonitoringAppConfig as AppConf
-from geonode.monitoring.models import (Metric, MetricValue, RequestEvent, MonitoredResource,
-                                       ExceptionEvent, EventType, NotificationCheck, BuiltIns)
+from geonode.monitoring.models import (Metric, MetricValue, MetricLabel, RequestEvent, MonitoredResource,
+                                       ServiceTypeMetric, ExceptionEvent, EventType, NotificationCheck,
+                                       BuiltIns)
 
 from geonode.monitoring.utils import generate_periods, align_period_start, align_period_end
 from geonode.monitoring.aggregation import (aggregate_past_periods, calculate_rate, calculate_percent,
@@ -56,6 +58,22 @@ log = logging.getLogger(__name__)
 
 class CollectorAPI(object):
 
+    # (metric name, RequestEvent column) pairs computed for each requests batch
+    REQUEST_METRICS = (('request.ip', 'client_ip',),
+                       ('request.users', 'user_identifier',),
+                       ('request.country', 'client_country'),
+                       ('request.city', 'client_city',),
+                       ('request.region', 'client_region'),
+                       ('request.ua', 'user_agent',),
+                       ('request.ua.family', 'user_agent_family',),
+                       ('response.time', 'response_time',),
+                       ('response.size', 'response_size',),
+                       ('response.status', 'response_status',),
+                       ('request.method', 'request_method',),
+                       )
+
+    METRIC_VALUES_BATCH_SIZE = 1000
+
     def __init__(self):
         pass
 
@@ -506,92 +524,171 @@ class CollectorAPI(object):
             defaults['samples_count'] = cnt
             log.debug(MetricValue.add(value=cnt, value_num=cnt, value_raw=cnt, **defaults))
 
+    def get_metric_rows(self, metric, column_name, requests):
+        """
+        Computes in memory the (label, value, samples) rows of a metric from
+        a list of request values, as set_metric_values does with aggregates
+        """
+        values = [r[column_name] for r in requests]
+        not_null = [v for v in values if v is not None]
+        if metric.is_rate:
+            value = sum(not_null) / len(not_null) if not_null else None
+            return [(Metric.TYPE_RATE, value, len(values),)]
+        elif metric.is_count:
+            q = [(v, v * cnt if v is not None else None, cnt if v is not None else 0,)
+                 for v, cnt in Counter(values).items()]
+        elif metric.is_value:
+            if column_name == "user_identifier":
+                usernames = {}
+                for r in requests:
+                    usernames.setdefault(r[column_name], r['user_username'])
+                q = [((v, usernames[v],), cnt, cnt,) for v, cnt in Counter(not_null).items()]
+            else:
+                q = [(v, cnt, cnt,) for v, cnt in Counter(not_null).items()]
+        elif metric.is_value_numeric:
+            return [(Metric.TYPE_VALUE_NUMERIC, max(not_null) if not_null else None, len(not_null),)]
+        else:
+            raise ValueError("Unsupported metric type: {}".format(metric.type))
+        q.sort(key=lambda row: row[1] or 0, reverse=True)
+        return q[:100]
+
+    def get_metric_labels(self, label_users):
+        """
+        Returns MetricLabel objects by name, creating the missing ones
+        """
+        labels = {}
+        # reversed, so the oldest label wins as in MetricValue.add
+        for label in MetricLabel.objects.filter(name__in=label_users).order_by('-id'):
+            labels[label.name] = label
+        missing = [MetricLabel(name=name, user=user)
+                   for name, user in label_users.items() if name not in labels]
+        if missing:
+            MetricLabel.objects.bulk_create(missing)
+            for label in MetricLabel.objects.filter(
+                    name__in=[label.name for label in missing]).order_by('-id'):
+                labels[label.name] = label
+        return labels
+
     def process_requests_batch(self, service, requests, valid_from, valid_to):
         """
         Processes requests information into metric values
+
+        Requests of the period are fetched once, metric values for each resource
+        and event type are computed in memory and stored with a bulk insert.
         """
-        log.debug("Processing batch of %s requests from %s to %s", requests.count(), valid_from, valid_to)
-        if not requests.count():
+        if not requests.exists():
             return
         event_all = EventType.objects.get(name=EventType.EVENT_ALL)
-        metric_defaults = {'valid_from': valid_from,
-                           'valid_to': valid_to,
-                           'event_type': event_all,
-                           'resource': None,
-                           'service': service}
+        ows_all = EventType.get(EventType.EVENT_OWS)
+        nonows_all = EventType.get(EventType.EVENT_OTHER)
         MetricValue.objects.filter(
             valid_from__gte=valid_from,
             valid_to__lte=valid_to,
-            service=service).delete()
+            service=service).exclude(
+                service_metric__metric__name__in=BuiltIns.writer_metrics).delete()
         requests = requests.filter(service=service)
-        resources = self.extract_resources(requests)
-
-        def push_metric_values(srequests, **mdefaults):
-
-            count = srequests.count()
-            count_mdefaults = mdefaults.copy()
-            count_mdefaults['value'] = count
-            count_mdefaults['label'] = 'Count'
-            count_mdefaults['value_num'] = count
-            count_mdefaults['value_raw'] = count
-            count_mdefaults['samples_count'] = count
-
-            log.debug(MetricValue.add('request.count', **count_mdefaults))
-
-            paths = srequests.distinct('request_path') \
-                .values_list('request_path', flat=True)
-            for path in paths:
-                count = srequests.filter(request_path=path).count()
-                count_mdefaults['value'] = count
-                count_mdefaults['label'] = path
-                count_mdefaults['value_num'] = count
-                count_mdefaults['value_raw'] = count
-                count_mdefaults['samples_count'] = count
-
-                log.debug(MetricValue.add('request.path', **count_mdefaults))
-
-            for mname, cname in (('request.ip', 'client_ip',),
-                                 ('request.users', 'user_identifier',),
-                                 ('request.country', 'client_country'),
-                                 ('request.city', 'client_city',),
-                                 ('request.region', 'client_region'),
-                                 ('request.ua', 'user_agent',),
-                                 ('request.ua.family', 'user_agent_family',),
-                                 ('response.time', 'response_time',),
-                                 ('response.size', 'response_size',),
-                                 ('response.status', 'response_status',),
-                                 ('request.method', 'request_method',),
-                                 ):
-                # calculate overall stats
-                self.set_metric_values(mname, cname, srequests, **mdefaults)
-
-            self.set_error_values(
-                srequests,
-                valid_from,
-                valid_to,
-                service=service,
-                resource=None)
-
-        push_metric_values(requests, **metric_defaults)
 
-        # for each resource we should calculate another set of stats
-        for resource, _requests in [(None, requests,)] + resources:
+        rows = list(requests.values('id', 'event_type_id', 'request_path', 'user_username',
+                                    *[cname for mname, cname in self.REQUEST_METRICS]))
+        log.debug("Processing batch of %s requests from %s to %s", len(rows), valid_from, valid_to)
+        rows_by_id = dict((r['id'], r,) for r in rows)
+
+        resources_rows = {}
+        for request_id, resource_id in RequestEvent.resources.through.objects.filter(
+                requestevent__in=requests.values('id')).values_list('requestevent_id', 'monitoredresource_id'):
+            resources_rows.setdefault(resource_id, []).append(rows_by_id[request_id])
+        resources = MonitoredResource.objects.in_bulk(list(resources_rows))
+
+        errors = {}
+        for request_id, error_type in ExceptionEvent.objects.filter(
+                request__in=requests.values('id')).values_list('request_id', 'error_type'):
+            errors.setdefault(request_id, []).append(error_type)
+
+        event_types = EventType.objects.in_bulk(
+            list(set(r['event_type_id'] for r in rows if r['event_type_id'])))
+        service_metrics = dict(
+            (stm.metric.name, stm,) for stm in ServiceTypeMetric.objects.filter(
+                service_type=service.service_type).select_related('metric'))
+
+        metric_values = {}
+        label_users = {}
+
+        def add_metric_value(metric, label, value_raw, samples_count, value_num, resource, event_type):
+            label_user = None
+            if label and isinstance(label, tuple):
+                label, label_user = label
+            label = str(label or 'count')
+            label_users.setdefault(label, label_user)
+            service_metric = service_metrics[metric]
+            key = (service_metric.id, resource.id if resource else None,
+                   label, event_type.id if event_type else None,)
+            metric_values[key] = {'service_metric': service_metric,
+                                  'resource': resource,
+                                  'event_type': event_type,
+                                  'label': label,
+                                  'value': value_raw,
+                                  'value_raw': value_raw,
+                                  'value_num': value_num,
+                                  'samples_count': samples_count or 0}
+
+        def push_metric_values(srequests, resource, event_type):
+            count = len(srequests)
+            add_metric_value('request.count', 'Count', count, count, count, resource, event_type)
+
+            for path, count in Counter(r['request_path'] for r in srequests).items():
+                add_metric_value('request.path', path, count, count, count, resource, event_type)
+
+            for mname, cname in self.REQUEST_METRICS:
+                metric = service_metrics[mname].metric
+                for label, value, samples in self.get_metric_rows(metric, cname, srequests):
+                    value_num = value if isinstance(value, integer_types + (float, Decimal,)) else None
+                    add_metric_value(mname, label, value or 0, samples, value_num, resource, event_type)
+
+        # error metrics are only recorded for the whole batch, without
+        # resource nor event type
+        with_errors = [r for r in rows if r['id'] in errors]
+        if with_errors:
+            count = len(with_errors)
+            add_metric_value('response.error.count', 'count', count, len(rows), count, None, None)
+            error_types = Counter(chain.from_iterable(errors[r['id']] for r in with_errors))
+            for error_type, count in error_types.items():
+                add_metric_value('response.error.types', error_type, count, count, count, None, None)
 
-            metric_defaults['resource'] = resource
-            metric_defaults['event_type'] = event_all
-            push_metric_values(_requests, **metric_defaults)
+        # for each resource we should calculate another set of stats
+        for resource_id, _requests in [(None, rows,)] + list(resources_rows.items()):
+            resource = resources.get(resource_id)
+            push_metric_values(_requests, resource, event_all)
 
             # for each event type we need separate metrics set
-            event_types = self.extract_event_types(_requests)
-            for event_type in event_types:
-                event_type_requests = _requests.filter(event_type=event_type)
-                metric_defaults['event_type'] = event_type
-                push_metric_values(event_type_requests, **metric_defaults)
+            event_type_rows = {}
+            for r in _requests:
+                if r['event_type_id']:
+                    event_type_rows.setdefault(r['event_type_id'], []).append(r)
+            for event_type_id, event_type_requests in event_type_rows.items():
+                push_metric_values(event_type_requests, resource, event_types[event_type_id])
 
             # combined event types: ows and non-ows
-            for evt, rq in self.extract_special_event_types(_requests):
-                metric_defaults['event_type'] = evt
-                push_metric_values(rq, **metric_defaults)
+            ows_rq = []
+            nonows_rq = []
+            for event_type_id, event_type_requests in event_type_rows.items():
+                name = event_types[event_type_id].name
+                if name.startswith('OWS:'):
+                    if name != EventType.EVENT_OWS:
+                        ows_rq.extend(event_type_requests)
+                elif name != EventType.EVENT_OTHER:
+                    nonows_rq.extend(event_type_requests)
+            push_metric_values(ows_rq, resource, ows_all)
+            push_metric_values(nonows_rq, resource, nonows_all)
+
+        labels = self.get_metric_labels(label_users)
+        MetricValue.objects.bulk_create(
+            [MetricValue(valid_from=valid_from,
+                         valid_to=valid_to,
+                         service=service,
+                         data={},
+                         **dict(mvalues, label=labels[mvalues['label']]))
+             for mvalues in metric_values.values()],
+            batch_size=self.METRIC_VALUES_BATCH_SIZE)
 
     def get_metrics_for(self, metric_name,
                         valid_from=None,
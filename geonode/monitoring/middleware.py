@@ -26,7 +26,7 @@ from six import string_types
 from datetime import datetime
 from django.conf import settings
 from geonode.monitoring.models import Service, Host
-from geonode.monitoring.utils import MonitoringHandler
+from geonode.monitoring.utils import MonitoringHandler, RequestToMonitoringThread
 from django.http import HttpResponse
 from django.utils.deprecation import MiddlewareMixin
 
@@ -53,7 +53,11 @@ class MonitoringMiddleware(MiddlewareMixin):
         self.log.setLevel(logging.DEBUG)
         self.log.handlers = []
         self.service = self.get_service()
-        self.handler = MonitoringHandler(self.service)
+        self.writer = None
+        if self.service and getattr(settings, 'MONITORING_BATCH_WRITER', False):
+            self.writer = RequestToMonitoringThread(self.service)
+            self.writer.start()
+        self.handler = MonitoringHandler(self.service, writer=self.writer)
         self.handler.setLevel(logging.DEBUG)
         self.log.addHandler(self.handler)
 
@@ -26,10 +26,11 @@ from urllib.parse import urlparse
 from socket import gethostbyname
 from datetime import datetime, timedelta
 from decimal import Decimal
+from functools import lru_cache
 from six import string_types
 
 from django import forms
-from django.db import models
+from django.db import models, connection
 from django.conf import settings
 from django.http import Http404
 from jsonfield import JSONField
@@ -500,38 +501,19 @@ class RequestEvent(models.Model):
         return out
 
     @classmethod
-    def _get_or_create_resources(cls, res_name, res_type, res_id):
-        out = []
+    def _get_or_create_resource(cls, res_name, res_type, res_id):
         r, _ = MonitoredResource.objects.get_or_create(
             name=res_name, type=res_type
         )
-        if r and res_id:
+        if r and res_id and r.resource_id != res_id:
             r.resource_id = res_id
             r.save()
-        out.append(r)
-        return out
-
-    @classmethod
-    def _get_geonode_resources(cls, request):
-        """
-        Return serialized resources affected by request
-        """
-        rqmeta = getattr(request, '_monitoring', {})
-        events = rqmeta['events']
-        resources = []
-        # for type_name in 'layer map document style'.split():
-        #     res = rqmeta['resources'].get(type_name) or []
-        #     resources.extend(cls._get_resources(type_name, res))
-
-        for evt_type, res_type, res_name, res_id in events:
-            resources.extend(cls._get_or_create_resources(res_name, res_type, res_id))
-
-        return resources
+        return r
 
     @classmethod
-    def _get_event_type(cls, request, default_event_type='view'):
+    def _get_event_type_name(cls, request, default_event_type='view'):
         """
-        Returns event type based on events
+        Returns event type name based on events
         """
         rqmeta = getattr(request, '_monitoring', {})
         events = set(e[0] for e in rqmeta['events'])
@@ -541,9 +523,17 @@ class RequestEvent(models.Model):
         elif len(events) == 2 and default_event_type in events:
             events.remove(default_event_type)
             event_name = events.pop()
-        return EventType.get(event_name)
+        return event_name
+
+    @classmethod
+    def _get_event_type(cls, request, default_event_type='view'):
+        """
+        Returns event type based on events
+        """
+        return EventType.get(cls._get_event_type_name(request, default_event_type))
 
     @staticmethod
+    @lru_cache(maxsize=1024)
     def _get_ua_family(ua):
         return str(user_agents.parse(ua))
 
@@ -561,6 +551,7 @@ class RequestEvent(models.Model):
         # return True
 
     @classmethod
+    @lru_cache(maxsize=1024)
     def _get_user_location(cls, request_ip):
         out = {}
         lat = lon = None
@@ -593,29 +584,6 @@ class RequestEvent(models.Model):
                             'client_city': city})
         return out
 
-    @classmethod
-    def _get_user_data_gn(cls, request):
-        out = {}
-        # check consent
-        if not cls._get_user_consent(request):
-            return out
-
-        rqmeta = getattr(request, '_monitoring', {})
-        if rqmeta.get('user_identifier'):
-            out['user_identifier'] = rqmeta.get('user_identifier')
-        if rqmeta.get('user_username'):
-            out['user_username'] = rqmeta.get('user_username')
-
-        ua = request.META.get('HTTP_USER_AGENT') or ''
-        ua_data = cls._get_user_agent(ua)
-        out.update(ua_data)
-
-        request_ip, is_routable = get_client_ip(request)
-        if request_ip and is_routable:
-            location_data = cls._get_user_location(request_ip)
-            out.update(location_data)
-        return out
-
     @classmethod
     def _get_user_data_gs(cls, request):
         out = {}
@@ -635,7 +603,11 @@ class RequestEvent(models.Model):
         return out
 
     @classmethod
-    def from_geonode(cls, service, request, response):
+    def _get_geonode_data(cls, request, response):
+        """
+        Returns the data of a geonode request, without any database or
+        geoip lookup, so it can be stored later
+        """
         from geonode.utils import parse_datetime
 
         received = datetime.utcnow().replace(tzinfo=pytz.utc)
@@ -649,49 +621,11 @@ class RequestEvent(models.Model):
                 tzinfo=pytz.utc))
         duration = (_ended - created).microseconds / 1000.0
 
-        sensitive_data = cls._get_user_data_gn(request)
-        event_type = cls._get_event_type(request)
-
-        # ua = request.META.get('HTTP_USER_AGENT') or ''
-        # ua_family = cls._get_ua_family(ua)
-        #
-        # ip, is_routable = get_client_ip(request)
-        # lat = lon = None
-        # country = region = city = None
-        # if ip and is_routable:
-        #     ip = ip.split(':')[0]
-        #     if settings.TEST and ip == 'testserver':
-        #         ip = '127.0.0.1'
-        #     try:
-        #         ip = gethostbyname(ip)
-        #     except Exception as err:
-        #         pass
-        #
-        #     geoip = get_geoip()
-        #     try:
-        #         client_loc = geoip.city(ip)
-        #     except Exception as err:
-        #         log.warning("Cannot resolve %s: %s", ip, err)
-        #         client_loc = None
-        #
-        #     if client_loc:
-        #         lat, lon = client_loc['latitude'], client_loc['longitude'],
-        #         country = client_loc.get(
-        #             'country_code3') or client_loc['country_code']
-        #         if len(country) == 2:
-        #             _c = pycountry.countries.get(alpha_2=country)
-        #             country = _c.alpha_3
-        #
-        #         region = client_loc['region']
-        #         city = client_loc['city']
-
         data = {'received': received,
                 'created': created,
                 'host': request.get_host(),
-                'service': service,
                 'user_identifier': None,
                 'user_username': None,
-                'event_type': event_type,
                 'request_path': request.get_full_path(),
                 'request_method': request.method,
                 'response_status': response.status_code,
@@ -700,15 +634,69 @@ class RequestEvent(models.Model):
                 'response_type': response.get('Content-type'),
                 'response_time': duration}
 
-        data.update(sensitive_data)
+        user_agent = client_ip = None
+        # check consent
+        if cls._get_user_consent(request):
+            if rqmeta.get('user_identifier'):
+                data['user_identifier'] = rqmeta.get('user_identifier')
+            if rqmeta.get('user_username'):
+                data['user_username'] = rqmeta.get('user_username')
+            user_agent = request.META.get('HTTP_USER_AGENT') or ''
+            request_ip, is_routable = get_client_ip(request)
+            if request_ip and is_routable:
+                client_ip = request_ip
+
+        return {'data': data,
+                'event_type': cls._get_event_type_name(request),
+                'resources': [(res_name, res_type, res_id,)
+                              for evt_type, res_type, res_name, res_id in rqmeta.get('events', [])],
+                'user_agent': user_agent,
+                'client_ip': client_ip,
+                'exceptions': []}
 
-        try:
-            inst = cls.objects.create(**data)
-            resources = cls._get_geonode_resources(request)
-            if resources:
-                inst.resources.add(*resources)
+    @classmethod
+    def bulk_from_geonode(cls, service, items, get_resource=None, get_event_type=None):
+        """
+        Writes RequestEvents, their resources and exceptions for a list of
+        geonode requests data with bulk inserts
+        """
+        get_resource = get_resource or cls._get_or_create_resource
+        get_event_type = get_event_type or EventType.get
+
+        instances = []
+        for item in items:
+            data = dict(item['data'])
+            if item['user_agent'] is not None:
+                data.update(cls._get_user_agent(item['user_agent']))
+            if item['client_ip']:
+                data.update(cls._get_user_location(item['client_ip']))
+            instances.append(cls(service=service, event_type=get_event_type(item['event_type']), **data))
+
+        if connection.features.can_return_ids_from_bulk_insert:
+            cls.objects.bulk_create(instances)
+        else:
+            for inst in instances:
                 inst.save()
-            return inst
+
+        resources = []
+        exceptions = []
+        for inst, item in zip(instances, items):
+            for res_name, res_type, res_id in item['resources']:
+                resources.append(cls.resources.through(
+                    requestevent_id=inst.id,
+                    monitoredresource_id=get_resource(res_name, res_type, res_id).id))
+            for error_type, stack_trace in item['exceptions']:
+                exceptions.append(ExceptionEvent.get_error(
+                    service, error_type, stack_trace, request=inst))
+        cls.resources.through.objects.bulk_create(resources, ignore_conflicts=True)
+        ExceptionEvent.objects.bulk_create(exceptions)
+        return instances
+
+    @classmethod
+    def from_geonode(cls, service, request, response):
+        item = cls._get_geonode_data(request, response)
+        try:
+            return cls.bulk_from_geonode(service, [item])[0]
         except Exception:
             return None
 
@@ -824,13 +812,21 @@ class ExceptionEvent(models.Model):
     error_data = models.TextField(null=False, default='')
     request = models.ForeignKey(RequestEvent, related_name='exceptions', on_delete=models.CASCADE)
 
-    @classmethod
-    def add_error(cls, from_service, error_type, stack_trace,
-                  request=None, created=None, message=None):
-        received = datetime.utcnow().replace(tzinfo=pytz.utc)
+    @staticmethod
+    def get_error_type(error_type):
         if not isinstance(error_type, string_types):
             _cls = error_type.__class__
             error_type = '{}.{}'.format(_cls.__module__, _cls.__name__)
+        return error_type
+
+    @classmethod
+    def get_error(cls, from_service, error_type, stack_trace,
+                  request=None, created=None, message=None):
+        """
+        Returns a new, unsaved, ExceptionEvent
+        """
+        received = datetime.utcnow().replace(tzinfo=pytz.utc)
+        error_type = cls.get_error_type(error_type)
         if not message:
             message = str(error_type)
         if isinstance(stack_trace, (list, tuple)):
@@ -838,13 +834,21 @@ class ExceptionEvent(models.Model):
 
         if not isinstance(created, datetime):
             created = received
-        return cls.objects.create(created=created,
-                                  received=received,
-                                  service=from_service,
-                                  error_type=error_type,
-                                  error_data=stack_trace,
-                                  error_message=message or '',
-                                  request=request)
+        return cls(created=created,
+                   received=received,
+                   service=from_service,
+                   error_type=error_type,
+                   error_data=stack_trace,
+                   error_message=message or '',
+                   request=request)
+
+    @classmethod
+    def add_error(cls, from_service, error_type, stack_trace,
+                  request=None, created=None, message=None):
+        inst = cls.get_error(from_service, error_type, stack_trace,
+                             request=request, created=created, message=message)
+        inst.save()
+        return inst
 
     @property
     def url(self):
@@ -1724,12 +1728,15 @@ class BuiltIns(object):
     metrics_rate = ('response.time', 'response.size',)
     # metrics_count = ('request.count', 'request.method', 'request.
 
+    # metrics of the batched requests writer, not computed by the collector
+    writer_metrics = ('request.queue.size', 'request.dropped',)
+
     geonode_metrics = (
         'request', 'request.count', 'request.users', 'request.ip', 'request.ua', 'request.path',
         'request.ua.family', 'request.method', 'response.error.count',
         'request.country', 'request.region', 'request.city',
         'response.time', 'response.status', 'response.size',
-        'response.error.types',)
+        'response.error.types',) + writer_metrics
     host_metrics = ('load.1m', 'load.5m', 'load.15m',
                     'mem.free', 'mem.usage', 'mem.usage.percent', 'mem.buffers', 'mem.all',
                     'uptime', 'cpu.usage', 'cpu.usage.rate', 'cpu.usage.percent',
@@ -1748,9 +1755,10 @@ class BuiltIns(object):
 
     values_numeric = (
         'storage.total', 'storage.used', 'storage.free', 'mem.free', 'mem.usage',
-        'mem.buffers', 'mem.all',)
+        'mem.buffers', 'mem.all', 'request.queue.size',)
     counters = (
         'request.count',
+        'request.dropped',
         'network.in',
         'network.out',
         'response.error.count',
@@ -1774,6 +1782,8 @@ class BuiltIns(object):
                     'network.out.rate': 'Network outgoing traffic rate',
                     'network.out': 'Network outgoing traffic bytes',
                     'network.in': 'Network incoming traffic bytes',
+                    'request.queue.size': 'Number of requests waiting to be written',
+                    'request.dropped': 'Number of requests not written because of a full queue',
                     }
 
 
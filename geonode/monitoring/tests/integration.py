@@ -39,7 +39,7 @@ from django.core import mail
 from django.conf import settings
 from django.db import connections
 from django.urls import reverse
-from django.test.utils import override_settings
+from django.test.utils import override_settings, CaptureQueriesContext
 from django.core.management import call_command
 from django.contrib.auth import get_user, get_user_model
 
@@ -337,6 +337,94 @@ class RequestsTestCase(MonitoringTestBase):
         if eq:
             self.assertEqual('django.http.response.Http404', eq.error_type)
 
+    def test_process_requests_batch(self):
+        """
+        Test that metric values of a requests batch are computed in a few queries
+        """
+        now = datetime.utcnow().replace(tzinfo=pytz.utc)
+        valid_from = now - timedelta(minutes=1)
+        wms = EventType.get('OWS:WMS')
+        view = EventType.get(EventType.EVENT_VIEW)
+        resource = MonitoredResource.get(MonitoredResource.TYPE_LAYER, 'geonode:sample', or_create=True)
+        for idx, (event_type, status) in enumerate(((wms, 200,), (wms, 404,), (view, 200,),)):
+            rq = RequestEvent.objects.create(
+                created=now - timedelta(seconds=30),
+                received=now,
+                service=self.service,
+                event_type=event_type,
+                request_path='/path/{}'.format(idx),
+                request_method='GET',
+                response_status=status,
+                response_time=10 * (idx + 1),
+                client_ip='127.0.0.1')
+            rq.resources.add(resource)
+        ExceptionEvent.objects.create(
+            created=now, received=now, service=self.service, error_type='Http404', request=rq)
+
+        requests = RequestEvent.objects.filter(created__gte=valid_from, created__lt=now)
+        collector = CollectorAPI()
+        with CaptureQueriesContext(connections['default']) as ctx:
+            collector.process_requests_batch(self.service, requests, valid_from, now)
+        # the number of queries doesn't depend on resources, event types and labels
+        self.assertLessEqual(len(ctx.captured_queries), 20)
+
+        values = MetricValue.objects.filter(service=self.service, valid_from=valid_from, valid_to=now)
+        count = values.get(service_metric__metric__name='request.count', resource=None,
+                           event_type__name=EventType.EVENT_ALL)
+        self.assertEqual(count.value_num, 3)
+        ows = values.get(service_metric__metric__name='request.count', resource=resource,
+                         event_type__name=EventType.EVENT_OWS)
+        self.assertEqual(ows.value_num, 2)
+        status = values.get(service_metric__metric__name='response.status', resource=None,
+                            event_type=wms, label__name='404')
+        self.assertEqual(status.value_num, 1)
+        rtime = values.get(service_metric__metric__name='response.time', resource=None,
+                           event_type__name=EventType.EVENT_ALL)
+        self.assertEqual(rtime.value_num, 20)
+        # the error metrics are recorded for the whole batch, without resource nor event type
+        errors = values.get(service_metric__metric__name='response.error.count', resource=None,
+                            event_type=None)
+        self.assertEqual(errors.value_num, 1)
+        self.assertEqual(errors.samples_count, 3)
+        error_types = values.get(service_metric__metric__name='response.error.types', resource=None,
+                                 event_type=None, label__name='Http404')
+        self.assertEqual(error_types.value_num, 1)
+        self.assertFalse(values.filter(
+            service_metric__metric__name__in=('response.error.count', 'response.error.types'),
+            event_type__isnull=False).exists())
+
+    def test_batch_writer(self):
+        """
+        Test that the requests writer stores requests in batches and counts the dropped ones
+        """
+        from django.http import HttpResponse
+        from django.test.client import RequestFactory
+        from geonode.monitoring.utils import RequestToMonitoringThread
+
+        writer = RequestToMonitoringThread(self.service, queue_size=2, batch_size=10, flush_interval=0.1)
+        now = datetime.utcnow().replace(tzinfo=pytz.utc)
+        for idx in range(3):
+            req = RequestFactory().get('/layers/{}'.format(idx), HTTP_USER_AGENT=self.ua)
+            req._monitoring = {'started': now,
+                               'finished': now,
+                               'resources': {},
+                               'events': [('view', 'layer', 'geonode:sample', None,)]}
+            queued = writer.add(req, HttpResponse('ok'), None)
+            self.assertEqual(queued, idx < 2)
+        self.assertEqual(writer.dropped, 1)
+
+        batch = writer.get_batch()
+        self.assertEqual(len(batch), 2)
+        writer.flush(batch)
+        writer.add_metric_values(now, datetime.utcnow().replace(tzinfo=pytz.utc))
+
+        requests = RequestEvent.objects.filter(service=self.service, request_path__startswith='/layers/')
+        self.assertEqual(requests.count(), 2)
+        self.assertEqual(requests.filter(resources__name='geonode:sample').count(), 2)
+        self.assertEqual(writer.dropped, 0)
+        dropped = MetricValue.objects.get(service=self.service, service_metric__metric__name='request.dropped')
+        self.assertEqual(dropped.value_num, 1)
+
     def test_service_handlers(self):
         """
         Test if we can calculate metrics
@@ -25,9 +25,11 @@ import logging
 import xmljson
 import requests
 import threading
+import time
 import traceback
 
 from hashlib import md5
+from functools import lru_cache
 from math import floor, ceil
 from urllib.parse import urlencode
 from urllib.parse import urlsplit
@@ -49,9 +51,10 @@ log = logging.getLogger(__name__)
 
 class MonitoringHandler(logging.Handler):
 
-    def __init__(self, service, *args, **kwargs):
+    def __init__(self, service, writer=None, *args, **kwargs):
         super(MonitoringHandler, self).__init__(*args, **kwargs)
         self.service = service
+        self.writer = writer
 
     def emit(self, record):
         from geonode.monitoring.models import RequestEvent, ExceptionEvent
@@ -59,6 +62,11 @@ class MonitoringHandler(logging.Handler):
         exc_info = record.exc_info
         req = record.request
         resp = record.response
+        if self.writer is not None:
+            if not req._monitoring.get('processed'):
+                req._monitoring['processed'] = self.writer.add(req, resp, exc_info)
+            return
+
         if not req._monitoring.get('processed'):
             try:
                 re = RequestEvent.from_geonode(self.service, req, resp)
@@ -73,25 +81,105 @@ class MonitoringHandler(logging.Handler):
 
 
 class RequestToMonitoringThread(threading.Thread):
-    q = queue.Queue()
+    """
+    Writes the monitored requests in batches.
 
-    def __init__(self, service, *args, **kwargs):
+    Requests data is put in a bounded queue and written with bulk inserts
+    every `batch_size` requests or `flush_interval` seconds. Requests are
+    dropped when the queue is full; the number of dropped requests and the
+    queue size are stored as `request.dropped` and `request.queue.size` metrics.
+    """
+
+    def __init__(self, service, queue_size=None, batch_size=None, flush_interval=None,
+                 cache_size=1024, *args, **kwargs):
         super(RequestToMonitoringThread, self).__init__(*args, **kwargs)
+        from geonode.monitoring.models import RequestEvent, EventType
+
+        self.daemon = True
         self.service = service
+        self.q = queue.Queue(maxsize=queue_size or settings.MONITORING_QUEUE_SIZE)
+        self.batch_size = batch_size or settings.MONITORING_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.MONITORING_FLUSH_INTERVAL
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.written = 0
+        self.get_resource = lru_cache(maxsize=cache_size)(RequestEvent._get_or_create_resource)
+        self.get_event_type = lru_cache(maxsize=cache_size)(EventType.get)
+
+    def add(self, req, resp, exc_info=None):
+        """
+        Queues the request data, returns False if the request has been dropped
+        """
+        from geonode.monitoring.models import RequestEvent, ExceptionEvent
+
+        try:
+            item = RequestEvent._get_geonode_data(req, resp)
+        except Exception as e:
+            log.debug("Cannot monitor request: %s", e)
+            return False
+        if exc_info:
+            item['exceptions'].append((ExceptionEvent.get_error_type(exc_info[1]),
+                                       traceback.format_exception(*exc_info),))
+        try:
+            self.q.put_nowait(item)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+        return True
 
-    def add(self, req, resp):
-        item = (req, resp,)
-        RequestToMonitoringThread.q.put(item)
+    def get_batch(self):
+        """
+        Blocks until a batch is full or the flush interval is elapsed
+        """
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.q.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
 
-    def run(self):
+    def flush(self, batch):
         from geonode.monitoring.models import RequestEvent
 
-        q = RequestToMonitoringThread.q
+        if batch:
+            RequestEvent.bulk_from_geonode(
+                self.service, batch,
+                get_resource=self.get_resource,
+                get_event_type=self.get_event_type)
+            self.written += len(batch)
+
+    def add_metric_values(self, valid_from, valid_to):
+        from geonode.monitoring.models import MetricValue
+
+        with self.lock:
+            dropped, self.dropped = self.dropped, 0
+        queue_size = self.q.qsize()
+        MetricValue.add('request.dropped', valid_from, valid_to, self.service, 'count',
+                        value=dropped, value_raw=dropped, value_num=dropped, samples_count=dropped)
+        MetricValue.add('request.queue.size', valid_from, valid_to, self.service, 'value',
+                        value=queue_size, value_raw=queue_size, value_num=queue_size, samples_count=1)
+
+    def run(self):
+        valid_from = datetime.utcnow().replace(tzinfo=pytz.utc)
         while True:
-            if not q.empty():
-                item = q.get()
-                req, resp = item
-                RequestEvent.from_geonode(self.service, req, resp)
+            batch = self.get_batch()
+            try:
+                self.flush(batch)
+                if batch or self.dropped:
+                    valid_to = datetime.utcnow().replace(tzinfo=pytz.utc)
+                    self.add_metric_values(valid_from, valid_to)
+                    valid_from = valid_to
+            except Exception as e:
+                log.exception(e)
+            finally:
+                for _ in batch:
+                    self.q.task_done()
 
 
 class GeoServerMonitorClient(object):
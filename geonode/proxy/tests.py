@@ -24,21 +24,28 @@ unittest). These will both pass when you run "manage.py test".
 
 Replace these with more appropriate tests for your application.
 """
+import io
+import os
 import json
+import shutil
+import tempfile
+import zipfile
 
 try:
-    from unittest.mock import MagicMock
+    from unittest.mock import MagicMock, patch
 except ImportError:
-    from mock import MagicMock
+    from mock import MagicMock, patch
 
 from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
 from django.test.utils import override_settings
 
 from geonode import geoserver
 from geonode.base.models import Link
-from geonode.layers.models import Layer
+from geonode.layers.models import Layer, LayerFile, UploadSession
 from geonode.decorators import on_ogc_backend
+from geonode.utils import get_download_archive_file, purge_download_archives
 from geonode.tests.base import GeoNodeBaseTestSupport
 from geonode.base.populate_test_data import create_models
 
@@ -144,6 +151,69 @@ class DownloadResourceTestCase(GeoNodeBaseTestSupport):
         self.assertTrue(
             "No files have been found for this resource. Please, contact a system administrator." in data)
 
+    @patch('geonode.proxy.views._fetch_link', return_value=b'<metadata/>')
+    def test_download_streamed_and_cached(self, fetch_link):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        admin = get_user_model().objects.get(username='admin')
+        layer = Layer.objects.all().first()
+        upload_session = UploadSession.objects.create(resource=layer, user=admin)
+        layer_file = LayerFile.objects.create(
+            upload_session=upload_session,
+            name='shp',
+            base=True,
+            file=SimpleUploadedFile('download_test.shp', b'shapefile content'))
+        self.addCleanup(layer_file.file.delete, save=False)
+        Layer.objects.filter(id=layer.id).update(upload_session=upload_session)
+
+        self.client.login(username='admin', password='admin')
+        with override_settings(DOWNLOAD_CACHE_DIR=cache_dir):
+            response = self.client.get(reverse('download', args=(layer.id,)))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            content = b''.join(response.streaming_content)
+            with zipfile.ZipFile(io.BytesIO(content)) as archive:
+                self.assertEqual(archive.read('download_test.shp'), b'shapefile content')
+                self.assertIn('.metadata/%s.dump' % layer.name, archive.namelist())
+                entries = dict((name, archive.read(name)) for name in archive.namelist())
+            fetched = set(name for name, data in entries.items() if data == b'<metadata/>')
+            self.assertEqual(len(fetched), fetch_link.call_count)
+
+            # the entries fetched with the credentials of the requester are not cached
+            with zipfile.ZipFile(get_download_archive_file(layer)) as cached:
+                self.assertEqual(set(cached.namelist()), set(entries) - fetched)
+
+            # the cached entries are served until the layer is updated, the
+            # remote ones are fetched again for every requester
+            fetch_link.reset_mock()
+            response = self.client.get(reverse('download', args=(layer.id,)))
+            self.assertEqual(response.status_code, 200)
+            with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+                self.assertEqual(dict((name, archive.read(name)) for name in archive.namelist()), entries)
+            self.assertEqual(len(fetched), fetch_link.call_count)
+
+    def test_download_archives_purged(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        layers = list(Layer.objects.all()[:2])
+        with override_settings(DOWNLOAD_CACHE_DIR=cache_dir):
+            archives = []
+            for mtime, layer in enumerate(layers):
+                archive_file = get_download_archive_file(layer)
+                with open(archive_file, 'wb') as f:
+                    f.write(b'0' * 100)
+                os.utime(archive_file, (mtime, mtime))
+                archives.append(archive_file)
+
+            # the least recently used archive is evicted first
+            purge_download_archives(max_size=150)
+            self.assertFalse(os.path.exists(archives[0]))
+            self.assertTrue(os.path.exists(archives[1]))
+
+            # the archives of a layer are removed once it is updated
+            layers[1].save()
+            self.assertFalse(os.path.exists(archives[1]))
+
 
 class OWSApiTestCase(GeoNodeBaseTestSupport):
 
@@ -24,18 +24,19 @@ import re
 import six
 import gzip
 import json
-import shutil
 import logging
-import tempfile
 import traceback
 
 from hyperlink import URL
+from zipfile import ZipFile
 from slugify import slugify
 from urllib.parse import urlparse, urlsplit, urljoin
+from concurrent.futures import ThreadPoolExecutor
 
 from django.conf import settings
 from django.template import loader
-from django.http import HttpResponse
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.generic import View
 from distutils.version import StrictVersion
 from django.http.request import validate_host
@@ -49,8 +50,10 @@ from geonode.layers.models import Layer, LayerFile
 from geonode.utils import (
     resolve_object,
     check_ogc_backend,
-    get_dir_time_suffix,
-    zip_dir,
+    zip_stream,
+    get_download_archive_file,
+    remove_download_archives,
+    purge_download_archives,
     get_headers,
     http_client,
     json_response,
@@ -61,6 +64,7 @@ from geonode import geoserver, qgis_server  # noqa
 from geonode.monitoring import register_event
 
 TIMEOUT = 300
+DOWNLOAD_WORKERS = 4
 
 LINK_TYPES = [L for L in _LT if L.startswith("OGC:")]
 
@@ -261,6 +265,101 @@ def proxy(request, url=None, response_callback=None,
                 content_type=content_type)
 
 
+def _cached_archive_stream(entries, archive_file):
+    for chunk in zip_stream(entries, archive_file=archive_file):
+        yield chunk
+    # keep the cached archives within their size quota
+    purge_download_archives()
+
+
+def _fetch_link(url, headers, access_token, user):
+    if access_token and 'Authorization' not in headers:
+        headers['Authorization'] = 'Bearer %s' % access_token
+    try:
+        response, content = http_client.get(
+            url,
+            headers=headers,
+            timeout=TIMEOUT,
+            user=user)
+        if response.status_code == 200:
+            return response.content
+    except Exception:
+        tb = traceback.format_exc()
+        logger.debug(tb)
+    finally:
+        # the worker threads must not leak their database connections
+        connection.close()
+    return None
+
+
+def _download_entries(request, instance, layer_files, cached_archive=None):
+    """
+    Yields the entries of the archive of the original dataset.
+
+    The layer files, the SLD bodies, the metadata dump and the OGC links do not
+    depend on the requester: they are read from 'cached_archive' if any, or else
+    from the storage and the database, and yielded as (name, content) pairs.
+    The remote styles and the metadata links are fetched concurrently in the
+    meantime with the credentials of the requester, and yielded as
+    (name, content, False) triples, so that they are never cached.
+    """
+    def submit(url):
+        headers, access_token = get_headers(request, urlsplit(url), url)
+        return executor.submit(_fetch_link, url, headers, access_token, request.user)
+
+    executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS)
+    try:
+        remote = []
+        entries = []
+        try:
+            # Let's check for associated SLD files (if any)
+            for s in instance.styles.all():
+                entries.append(("".join([s.name, ".sld"]), s.sld_body.strip()))
+                if s.sld_url:
+                    remote.append(("".join([s.name, "_remote.sld"]), submit(s.sld_url)))
+        except Exception:
+            tb = traceback.format_exc()
+            logger.debug(tb)
+
+        # Let's dump metadata
+        try:
+            serialized_obj = json_serializer_producer(model_to_dict(instance))
+            entries.append((
+                os.path.join(".metadata", "".join([instance.name, ".dump"])),
+                json.dumps(serialized_obj)))
+
+            for link in Link.objects.filter(resource=instance.resourcebase_ptr):
+                link_file = os.path.join(".metadata", "".join([slugify(link.name), ".%s" % link.extension]))
+                if link.link_type == 'data':
+                    # Skipping 'data' download links
+                    continue
+                elif link.link_type in ('metadata', 'image'):
+                    # Dumping metadata files and images
+                    remote.append((link_file, submit(link.url)))
+                elif link.link_type.startswith('OGC'):
+                    # Dumping OGC/OWS links
+                    entries.append((link_file, link.url.strip()))
+        except Exception:
+            tb = traceback.format_exc()
+            logger.debug(tb)
+
+        if cached_archive:
+            with ZipFile(cached_archive) as archive:
+                for name in archive.namelist():
+                    yield name, archive.open(name)
+        else:
+            for lyr in layer_files:
+                yield os.path.basename(str(lyr.file)), storage.open(str(lyr.file), 'rb')
+            for name, content in entries:
+                yield name, content
+        for name, future in remote:
+            content = future.result()
+            if content is not None:
+                yield name, content, False
+    finally:
+        executor.shutdown(wait=False)
+
+
 def download(request, resourceid, sender=Layer):
 
     _not_authorized = _("You are not authorized to download this resource.")
@@ -274,140 +373,13 @@ def download(request, resourceid, sender=Layer):
                               permission_msg=_not_permitted)
 
     if isinstance(instance, Layer):
-        # Create Target Folder
-        dirpath = tempfile.mkdtemp()
-        dir_time_suffix = get_dir_time_suffix()
-        target_folder = os.path.join(dirpath, dir_time_suffix)
-        if not os.path.exists(target_folder):
-            os.makedirs(target_folder)
-
         layer_files = []
-        try:
-            upload_session = instance.get_upload_session()
-            if upload_session:
-                layer_files = [
-                    item for idx, item in enumerate(LayerFile.objects.filter(upload_session=upload_session))]
-                if layer_files:
-                    # Copy all Layer related files into a temporary folder
-                    for lyr in layer_files:
-                        if storage.exists(str(lyr.file)):
-                            geonode_layer_path = storage.path(str(lyr.file))
-                            shutil.copy2(geonode_layer_path, target_folder)
-                        else:
-                            return HttpResponse(
-                                loader.render_to_string(
-                                    '401.html',
-                                    context={
-                                        'error_title': _("No files found."),
-                                        'error_message': _no_files_found
-                                    },
-                                    request=request), status=404)
-
-            # Check we can access the original files
-            if not layer_files:
-                return HttpResponse(
-                    loader.render_to_string(
-                        '401.html',
-                        context={
-                            'error_title': _("No files found."),
-                            'error_message': _no_files_found
-                        },
-                        request=request), status=404)
+        upload_session = instance.get_upload_session()
+        if upload_session:
+            layer_files = list(LayerFile.objects.filter(upload_session=upload_session))
 
-            # Let's check for associated SLD files (if any)
-            try:
-                for s in instance.styles.all():
-                    sld_file_path = os.path.join(target_folder, "".join([s.name, ".sld"]))
-                    sld_file = open(sld_file_path, "w")
-                    sld_file.write(s.sld_body.strip())
-                    sld_file.close()
-                    try:
-                        # Collecting headers and cookies
-                        headers, access_token = get_headers(request, urlsplit(s.sld_url), s.sld_url)
-
-                        response, content = http_client.get(
-                            s.sld_url,
-                            headers=headers,
-                            timeout=TIMEOUT,
-                            user=request.user)
-                        sld_remote_content = response.text
-                        sld_file_path = os.path.join(target_folder, "".join([s.name, "_remote.sld"]))
-                        sld_file = open(sld_file_path, "w")
-                        sld_file.write(sld_remote_content.strip())
-                        sld_file.close()
-                    except Exception:
-                        traceback.print_exc()
-                        tb = traceback.format_exc()
-                        logger.debug(tb)
-            except Exception:
-                traceback.print_exc()
-                tb = traceback.format_exc()
-                logger.debug(tb)
-
-            # Let's dump metadata
-            target_md_folder = os.path.join(target_folder, ".metadata")
-            if not os.path.exists(target_md_folder):
-                os.makedirs(target_md_folder)
-
-            try:
-                dump_file = os.path.join(target_md_folder, "".join([instance.name, ".dump"]))
-                with open(dump_file, 'w') as outfile:
-                    serialized_obj = json_serializer_producer(model_to_dict(instance))
-                    json.dump(serialized_obj, outfile)
-
-                links = Link.objects.filter(resource=instance.resourcebase_ptr)
-                for link in links:
-                    link_name = slugify(link.name)
-                    link_file = os.path.join(target_md_folder, "".join([link_name, ".%s" % link.extension]))
-                    if link.link_type in ('data'):
-                        # Skipping 'data' download links
-                        continue
-                    elif link.link_type in ('metadata', 'image'):
-                        # Dumping metadata files and images
-                        link_file = open(link_file, "wb")
-                        try:
-                            # Collecting headers and cookies
-                            headers, access_token = get_headers(request, urlsplit(link.url), link.url)
-
-                            response, raw = http_client.get(
-                                link.url,
-                                stream=True,
-                                headers=headers,
-                                timeout=TIMEOUT,
-                                user=request.user)
-                            raw.decode_content = True
-                            shutil.copyfileobj(raw, link_file)
-                        except Exception:
-                            traceback.print_exc()
-                            tb = traceback.format_exc()
-                            logger.debug(tb)
-                        finally:
-                            link_file.close()
-                    elif link.link_type.startswith('OGC'):
-                        # Dumping OGC/OWS links
-                        link_file = open(link_file, "w")
-                        link_file.write(link.url.strip())
-                        link_file.close()
-            except Exception:
-                traceback.print_exc()
-                tb = traceback.format_exc()
-                logger.debug(tb)
-
-            # ZIP everything and return
-            target_file_name = "".join([instance.name, ".zip"])
-            target_file = os.path.join(dirpath, target_file_name)
-            zip_dir(target_folder, target_file)
-            register_event(request, 'download', instance)
-            response = HttpResponse(
-                content=open(target_file, mode='rb'),
-                status=200,
-                content_type="application/zip")
-            response['Content-Disposition'] = 'attachment; filename="%s"' % target_file_name
-            return response
-        except NotImplementedError:
-            traceback.print_exc()
-            tb = traceback.format_exc()
-            logger.debug(tb)
+        # Check we can access the original files
+        if not layer_files or not all(storage.exists(str(lyr.file)) for lyr in layer_files):
             return HttpResponse(
                 loader.render_to_string(
                     '401.html',
@@ -416,6 +388,23 @@ def download(request, resourceid, sender=Layer):
                         'error_message': _no_files_found
                     },
                     request=request), status=404)
+
+        target_file_name = "".join([instance.name, ".zip"])
+        archive_file = get_download_archive_file(instance)
+        register_event(request, 'download', instance)
+        if os.path.exists(archive_file):
+            # the least recently used archives are evicted first
+            os.utime(archive_file)
+            response = StreamingHttpResponse(
+                zip_stream(_download_entries(request, instance, layer_files, cached_archive=archive_file)),
+                content_type="application/zip")
+        else:
+            remove_download_archives(instance.id)
+            response = StreamingHttpResponse(
+                _cached_archive_stream(_download_entries(request, instance, layer_files), archive_file),
+                content_type="application/zip")
+        response['Content-Disposition'] = 'attachment; filename="%s"' % target_file_name
+        return response
     return HttpResponse(
         loader.render_to_string(
             '401.html',
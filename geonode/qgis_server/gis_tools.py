@@ -23,7 +23,7 @@ import traceback
 from urllib.parse import urlencode
 from urllib.request import urlretrieve
 from os.path import splitext
-from math import atan, degrees, sinh, pi
+from math import atan, degrees, sinh, pi, asinh, tan, radians
 from defusedxml import lxml as dlxml
 
 from django.conf import settings as geonode_config
@@ -162,3 +162,29 @@ def num2deg(x_tile, y_tile, zoom):
     lat_rad = atan(sinh(pi * (1 - 2 * y_tile / n)))
     lat_deg = degrees(lat_rad)
     return lat_deg, lon_deg
+
+
+def deg2num(lat_deg, lon_deg, zoom):
+    """Conversion of lat/lon coordinates to the X,Y of the TMS tile
+    containing them, the reverse of num2deg.
+    See http://wiki.openstreetmap.org/wiki/Slippy_map_tilenames
+
+    :param lat_deg: The latitude.
+    :type lat_deg: float
+
+    :param lon_deg: The longitude.
+    :type lon_deg: float
+
+    :param zoom: The zoom level, usually between 0 and 20.
+    :type zoom: integer
+
+    :return: Tuple (x, y).
+    :rtype: tuple
+    """
+    n = 2 ** zoom
+    # Web Mercator does not cover the poles
+    lat_deg = max(min(lat_deg, 85.0511287798), -85.0511287798)
+    lat_rad = radians(lat_deg)
+    x_tile = int((lon_deg + 180.0) / 360.0 * n)
+    y_tile = int((1.0 - asinh(tan(lat_rad)) / pi) / 2.0 * n)
+    return max(min(x_tile, n - 1), 0), max(min(y_tile, n - 1), 0)
@@ -194,7 +194,7 @@ def tile_url_format(layer_name, style=None):
     return url
 
 
-def tile_url(layer, z, x, y, style=None, internal=True):
+def tile_url(layer, z, x, y, style=None, internal=True, size=1):
     """Construct actual tile request to QGIS Server.
 
     Different than tile_url_format, this method will return url for requesting
@@ -219,6 +219,10 @@ def tile_url(layer, z, x, y, style=None, internal=True):
         Public url will be served by Django Geonode (proxified).
     :type internal: bool
 
+    :param size: Number of tiles on each side of the requested image, to
+        request a metatile whose top left tile is x, y.
+    :type size: int
+
     :return: Tile url
     :rtype: str
     """
@@ -236,7 +240,7 @@ def tile_url(layer, z, x, y, style=None, internal=True):
 
     # Call the WMS
     top, left = num2deg(x, y, z)
-    bottom, right = num2deg(x + 1, y + 1, z)
+    bottom, right = num2deg(x + size, y + size, z)
 
     transform = CoordTransform(SpatialReference(4326), SpatialReference(3857))
     top_left_corner = Point(left, top, srid=4326)
@@ -264,8 +268,8 @@ def tile_url(layer, z, x, y, style=None, internal=True):
         'REQUEST': 'GetMap',
         'BBOX': bbox,
         'CRS': 'EPSG:3857',
-        'WIDTH': '256',
-        'HEIGHT': '256',
+        'WIDTH': str(256 * size),
+        'HEIGHT': str(256 * size),
         'MAP': qgis_layer.qgis_project_path,
         'LAYERS': layer.name,
         'STYLE': style,
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2020 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+from django.core.management.base import BaseCommand
+
+from geonode.qgis_server.tiles import evict_tiles, get_tiles_cache_stats
+
+
+class Command(BaseCommand):
+    help = ("Delete the least recently accessed QGIS Server tiles to keep "
+            "the tiles cache under its size quota, and report its usage.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-s',
+            '--max-size',
+            dest='max_size',
+            type=int,
+            default=None,
+            help="Size quota in megabytes, defaults to the 'tiles_max_size' "
+                 "option of QGIS_SERVER_CONFIG.")
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            dest='stats',
+            default=False,
+            help='Only report the tiles cache statistics.')
+
+    def handle(self, *args, **options):
+        if not options['stats']:
+            max_size = options['max_size']
+            deleted, freed = evict_tiles(
+                max_size * 1024 * 1024 if max_size is not None else None)
+            print("Deleted {} tiles, {:.1f} MB freed".format(
+                deleted, freed / (1024.0 * 1024.0)))
+
+        stats = get_tiles_cache_stats()
+        requests = stats['hits'] + stats['misses']
+        print("Tiles cache: {} tiles, {:.1f} MB".format(
+            stats['tiles'], stats['size'] / (1024.0 * 1024.0)))
+        if stats['max_size']:
+            print("Size quota: {:.1f} MB".format(stats['max_size'] / (1024.0 * 1024.0)))
+        print("Requests: {} hits, {} misses ({:.1f}% hit ratio)".format(
+            stats['hits'], stats['misses'],
+            100.0 * stats['hits'] / requests if requests else 0))
+        for layer_name, layer_stats in sorted(stats['layers'].items()):
+            print("  {}: {} tiles, {:.1f} MB".format(
+                layer_name, layer_stats['tiles'], layer_stats['size'] / (1024.0 * 1024.0)))
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2020 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+from django.core.management.base import BaseCommand, CommandError
+
+from geonode.layers.models import Layer
+from geonode.maps.models import Map
+from geonode.qgis_server.helpers import get_model_path
+from geonode.qgis_server.tasks.update import seed_qgis_server_tiles
+from geonode.qgis_server.tiles import seed_resource_tiles
+
+
+class Command(BaseCommand):
+    help = ("Render in advance the QGIS Server tiles of layers or maps "
+            "over a zoom range.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-l',
+            '--layer',
+            dest='layers',
+            action='append',
+            default=[],
+            help='Name of a layer to seed, can be repeated.')
+        parser.add_argument(
+            '-m',
+            '--map',
+            dest='maps',
+            action='append',
+            type=int,
+            default=[],
+            help='Id of a map whose layers are seeded, can be repeated.')
+        parser.add_argument(
+            '--min-zoom',
+            dest='min_zoom',
+            type=int,
+            default=0,
+            help='First zoom level to seed.')
+        parser.add_argument(
+            '--max-zoom',
+            dest='max_zoom',
+            type=int,
+            required=True,
+            help='Last zoom level to seed.')
+        parser.add_argument(
+            '-b',
+            '--bbox',
+            dest='bbox',
+            default=None,
+            help='Bounding box to seed in EPSG:4326 as xmin,ymin,xmax,ymax. '
+                 'Defaults to the layer bounding box.')
+        parser.add_argument(
+            '-s',
+            '--style',
+            dest='style',
+            default=None,
+            help='Style to seed, defaults to the layer default style.')
+        parser.add_argument(
+            '-w',
+            '--workers',
+            dest='workers',
+            type=int,
+            default=None,
+            help='Number of threads fetching the metatiles.')
+        parser.add_argument(
+            '-o',
+            '--overwrite',
+            action='store_true',
+            dest='overwrite',
+            default=False,
+            help='Render again the tiles already in the cache.')
+        parser.add_argument(
+            '--async',
+            action='store_true',
+            dest='async_seed',
+            default=False,
+            help='Run the seeding as Celery tasks instead of in this process.')
+
+    def handle(self, *args, **options):
+        bbox = None
+        if options['bbox']:
+            try:
+                bbox = [float(coord) for coord in options['bbox'].split(',')]
+            except ValueError:
+                bbox = []
+            if len(bbox) != 4:
+                raise CommandError('The bounding box must be xmin,ymin,xmax,ymax')
+
+        resources = list(Layer.objects.filter(name__in=options['layers']))
+        resources += list(Map.objects.filter(id__in=options['maps']))
+        if not resources:
+            raise CommandError('No layer or map to seed.')
+
+        kwargs = dict(
+            bbox=bbox,
+            style=options['style'],
+            workers=options['workers'],
+            overwrite=options['overwrite'])
+        for resource in resources:
+            if options['async_seed']:
+                seed_qgis_server_tiles.apply_async(
+                    (get_model_path(resource), resource.id,
+                     options['min_zoom'], options['max_zoom']), kwargs)
+                print("Seeding of {} queued".format(resource.title))
+                continue
+            stats = seed_resource_tiles(
+                resource, options['min_zoom'], options['max_zoom'], **kwargs)
+            for layer_name, layer_stats in stats.items():
+                print("{}: {rendered} metatiles rendered, {skipped} skipped, {failed} failed".format(
+                    layer_name, **layer_stats))
@@ -159,3 +159,48 @@ def cache_request(self, url, cache_file):
     del response
 
     return True
+
+
+@app.task(
+    name='geonode.qgis_server.tasks.update.seed_qgis_server_tiles',
+    queue='update')
+@on_ogc_backend(qgis_server.BACKEND_PACKAGE)
+def seed_qgis_server_tiles(model_path, object_id, min_zoom, max_zoom,
+                           bbox=None, style=None, workers=None, overwrite=False):
+    """Task to render in advance the tiles of a layer or map.
+
+    :param model_path: Model of the resource, can be a layer or map
+    :type model_path: str
+
+    :param bbox: Bounding box in EPSG:4326 in 4 tuple format
+        [xmin,ymin,xmax,ymax]
+    :type bbox: list(float)
+
+    :return: Number of metatiles rendered, skipped and failed per layer.
+    :rtype: dict
+    """
+    from geonode.qgis_server.tiles import seed_resource_tiles
+
+    instance = apps.get_model(model_path).objects.get(id=object_id)
+    return seed_resource_tiles(
+        instance, min_zoom, max_zoom, bbox=bbox, style=style,
+        workers=workers, overwrite=overwrite)
+
+
+@app.task(
+    name='geonode.qgis_server.tasks.update.evict_qgis_server_tiles',
+    queue='update')
+@on_ogc_backend(qgis_server.BACKEND_PACKAGE)
+def evict_qgis_server_tiles(max_size=None):
+    """Task to keep the tiles cache under its size quota.
+
+    :param max_size: Size quota in bytes, defaults to the 'tiles_max_size'
+        option of QGIS_SERVER_CONFIG.
+    :type max_size: int
+
+    :return: Number of tiles deleted and bytes freed.
+    :rtype: tuple
+    """
+    from geonode.qgis_server.tiles import evict_tiles
+
+    return evict_tiles(max_size)
@@ -20,7 +20,9 @@
 
 from geonode.tests.base import GeoNodeBaseTestSupport
 
+import io
 import os
+import tempfile
 from urllib.parse import urlparse, parse_qs
 import unittest
 from imghdr import what
@@ -33,6 +35,7 @@ import gisdata
 import shutil
 
 import requests
+from PIL import Image
 from django.conf import settings
 from django.core.management import call_command
 from django.core.files.storage import default_storage as storage
@@ -48,6 +51,9 @@ from geonode.qgis_server.helpers import get_model_path, \
     qgis_server_endpoint, tile_url_format, tile_url, \
     style_get_url, style_add_url, style_list, style_set_default_url, \
     style_remove_url
+from geonode.qgis_server.gis_tools import deg2num, num2deg
+from geonode.qgis_server.tiles import get_metatile, slice_metatile, \
+    iter_metatiles, evict_tiles, get_tiles_cache_stats
 
 
 class HelperTest(GeoNodeBaseTestSupport):
@@ -146,6 +152,61 @@ class HelperTest(GeoNodeBaseTestSupport):
 
         uploaded.delete()
 
+    @on_ogc_backend(qgis_server.BACKEND_PACKAGE)
+    def test_metatiles(self):
+        """Test metatiles coordinates and slicing."""
+        self.assertEqual(get_metatile(11, 1577, 1054, size=4), (1576, 1052, 4))
+        self.assertEqual(get_metatile(1, 1, 0, size=4), (0, 0, 2))
+
+        metatile = Image.new('RGBA', (512, 512), (255, 0, 0, 255))
+        metatile.paste((0, 0, 255, 255), (256, 0, 512, 256))
+        content = io.BytesIO()
+        metatile.save(content, 'PNG')
+        tiles = dict(
+            ((dx, dy), Image.open(io.BytesIO(tile)))
+            for dx, dy, tile in slice_metatile(content.getvalue(), 2))
+        self.assertEqual(len(tiles), 4)
+        self.assertEqual(tiles[(0, 0)].size, (256, 256))
+        self.assertEqual(tiles[(1, 0)].getpixel((0, 0)), (0, 0, 255, 255))
+        self.assertEqual(tiles[(0, 1)].getpixel((0, 0)), (255, 0, 0, 255))
+        with self.assertRaises(ValueError):
+            slice_metatile(content.getvalue(), 4)
+
+    @on_ogc_backend(qgis_server.BACKEND_PACKAGE)
+    def test_tiles_cache_eviction(self):
+        """Test seeding range, eviction and statistics of the tiles cache."""
+        self.assertEqual(deg2num(*num2deg(1576.5, 1054.5, 11), zoom=11), (1576, 1054))
+        metatiles = list(iter_metatiles([96.956, -5.518, 97.109, -5.303], 11, 12, size=4))
+        self.assertEqual(metatiles, [
+            (11, 1572, 1052, 4), (11, 1576, 1052, 4),
+            (12, 3148, 2108, 4), (12, 3152, 2108, 4)])
+
+        tiles_directory = tempfile.mkdtemp()
+        try:
+            for y in range(4):
+                tile_filename = os.path.join(
+                    tiles_directory, 'layer', 'style', '1', '0', '{}.png'.format(y))
+                os.makedirs(os.path.dirname(tile_filename), exist_ok=True)
+                with open(tile_filename, 'wb') as tile_file:
+                    tile_file.write(b'0' * 100)
+                # the first tiles are the least recently accessed
+                os.utime(tile_filename, (1000 + y, 1000 + y))
+            with open(os.path.join(tiles_directory, 'layer', 'style', 'legend.png'), 'wb') as legend_file:
+                legend_file.write(b'0' * 1000)
+
+            stats = get_tiles_cache_stats(tiles_directory)
+            self.assertEqual(stats['tiles'], 4)
+            self.assertEqual(stats['size'], 400)
+            self.assertEqual(stats['layers']['layer']['tiles'], 4)
+
+            self.assertEqual(evict_tiles(250, tiles_directory), (2, 200))
+            remaining = sorted(os.listdir(os.path.join(tiles_directory, 'layer', 'style', '1', '0')))
+            self.assertEqual(remaining, ['2.png', '3.png'])
+            self.assertTrue(os.path.exists(os.path.join(tiles_directory, 'layer', 'style', 'legend.png')))
+            self.assertEqual(evict_tiles(250, tiles_directory), (0, 0))
+        finally:
+            shutil.rmtree(tiles_directory)
+
     @on_ogc_backend(qgis_server.BACKEND_PACKAGE)
     def test_style_management_url(self):
         """Test QGIS Server style management url construction."""
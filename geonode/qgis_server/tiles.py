@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2020 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+"""Tile engine of the QGIS Server backend.
+
+Missing tiles are rendered by metatiles: a single GetMap request covers a
+block of tiles, which is then sliced and stored in the tiles cache. Concurrent
+requests for the same metatile wait for the one rendering it instead of
+sending their own GetMap request to QGIS Server.
+
+The tiles cache can be seeded in advance, and is kept under a size quota by
+evicting the least recently accessed tiles.
+"""
+
+import io
+import os
+import time
+import heapq
+import hashlib
+import logging
+import tempfile
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from geonode.qgis_server.gis_tools import deg2num
+from geonode.qgis_server.helpers import tile_url
+from geonode.qgis_server.models import QGISServerLayer
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+METATILE_LOCK_KEY = 'qgis_metatile_{}'
+TILES_HITS_KEY = 'qgis_tiles_hits'
+TILES_MISSES_KEY = 'qgis_tiles_misses'
+# Do not update the access time of a tile more than once in this interval
+ACCESS_TIME_RESOLUTION = 3600
+
+
+def get_metatile_size():
+    return settings.QGIS_SERVER_CONFIG.get('metatile_size', 4)
+
+
+def get_metatile_timeout():
+    return settings.QGIS_SERVER_CONFIG.get('metatile_timeout', 60)
+
+
+def get_seed_workers():
+    return settings.QGIS_SERVER_CONFIG.get('seed_workers', 4)
+
+
+def get_tiles_max_size():
+    """Size quota of the tiles cache in bytes, None if unbounded."""
+    max_size = settings.QGIS_SERVER_CONFIG.get('tiles_max_size')
+    return int(max_size) if max_size else None
+
+
+def tile_filename_function(qgis_layer, style, z):
+    """Get the function returning the cache file of a tile of a layer style
+    and zoom level from its x, y coordinates.
+    """
+    tile_path = settings.QGIS_SERVER_CONFIG['tile_path']
+
+    def tile_filename(x, y):
+        return os.path.normpath(
+            tile_path % (qgis_layer.qgis_layer_name, style, z, x, y))
+    return tile_filename
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+class _KeyLock(object):
+    """Weak referenceable holder of the lock of a metatile."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+
+_key_locks = weakref.WeakValueDictionary()
+_key_locks_guard = threading.Lock()
+
+
+def _get_key_lock(key):
+    with _key_locks_guard:
+        key_lock = _key_locks.get(key)
+        if key_lock is None:
+            key_lock = _KeyLock()
+            _key_locks[key] = key_lock
+        return key_lock
+
+
+def get_metatile(z, x, y, size=None):
+    """Get the metatile containing a tile.
+
+    :return: Tuple (x, y, size) of the top left tile of the metatile and of
+        its number of tiles on each side.
+    :rtype: tuple
+    """
+    size = min(size or get_metatile_size(), 2 ** z)
+    return x - x % size, y - y % size, size
+
+
+def slice_metatile(content, size):
+    """Slice a metatile image into its tiles.
+
+    :param content: The PNG content of the metatile.
+    :type content: bytes
+
+    :param size: Number of tiles on each side of the metatile.
+    :type size: int
+
+    :return: List of tuples (dx, dy, content) with the offset of each tile
+        from the top left one, and its PNG content.
+    :rtype: list
+    """
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(content))
+    image.load()
+    if image.size != (TILE_SIZE * size, TILE_SIZE * size):
+        raise ValueError(
+            'Unexpected metatile size: {0}x{1}'.format(*image.size))
+
+    tiles = []
+    for dx in range(size):
+        for dy in range(size):
+            tile = image.crop((
+                dx * TILE_SIZE, dy * TILE_SIZE,
+                (dx + 1) * TILE_SIZE, (dy + 1) * TILE_SIZE))
+            out = io.BytesIO()
+            tile.save(out, 'PNG')
+            tiles.append((dx, dy, out.getvalue()))
+    return tiles
+
+
+def _write_file(filename, content):
+    # Write to a temporary file first, so that a tile is never served
+    # while it is being written
+    directory = os.path.dirname(filename)
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    fd, tmp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out_file:
+            out_file.write(content)
+        os.replace(tmp_filename, filename)
+    except Exception:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
+def render_metatile(url, x, y, size, tile_filename):
+    """Fetch a metatile from QGIS Server and store its tiles.
+
+    :param url: The GetMap url of the metatile, as given by tile_url.
+    :type url: str
+
+    :param tile_filename: Function returning the cache file of a tile from
+        its x, y coordinates.
+    :type tile_filename: callable
+
+    :return: True if succeeded
+    :rtype: bool
+    """
+    logger.debug('Requesting metatile: {url}'.format(url=url))
+    try:
+        response = requests.get(url, timeout=get_metatile_timeout())
+    except requests.RequestException as e:
+        logger.error('Failed to fetch metatile {0}: {1}'.format(url, e))
+        return False
+    if response.status_code != 200:
+        logger.error(
+            'Failed to fetch metatile {0} with HTTP status code {1}'.format(
+                url, response.status_code))
+        return False
+
+    try:
+        tiles = slice_metatile(response.content, size)
+    except Exception as e:
+        logger.error('Invalid metatile {0}: {1}'.format(url, e))
+        return False
+
+    for dx, dy, content in tiles:
+        _write_file(tile_filename(x + dx, y + dy), content)
+    return True
+
+
+def _render_metatile_once(key, url, x, y, size, tile_filename, is_rendered):
+    # Only one request per metatile is sent to QGIS Server: the threads of
+    # this process are serialized by a lock per metatile, and the other
+    # processes wait for the cache flag set by the one rendering it
+    with _get_key_lock(key).lock:
+        if is_rendered():
+            return True
+
+        lock_key = METATILE_LOCK_KEY.format(key)
+        timeout = get_metatile_timeout()
+        if not cache.add(lock_key, True, timeout):
+            deadline = time.time() + timeout
+            while not is_rendered() and cache.get(lock_key) and time.time() < deadline:
+                time.sleep(0.1)
+            if is_rendered():
+                return True
+        try:
+            return render_metatile(url, x, y, size, tile_filename)
+        finally:
+            cache.delete(lock_key)
+
+
+def _metatile_key(layer, style, z, x, y):
+    return hashlib.md5('{0}_{1}_{2}_{3}_{4}'.format(
+        layer.id, style, z, x, y).encode('utf-8')).hexdigest()
+
+
+def get_tile(layer, style, z, x, y, tile_filename):
+    """Make sure a tile is in the tiles cache, rendering its metatile if
+    missing.
+
+    :param tile_filename: Function returning the cache file of a tile of
+        the zoom level z from its x, y coordinates.
+    :type tile_filename: callable
+
+    :return: The cache file of the tile, or None if it could not be rendered.
+    :rtype: str
+    """
+    filename = tile_filename(x, y)
+    if os.path.exists(filename):
+        _incr(TILES_HITS_KEY)
+        return filename
+    _incr(TILES_MISSES_KEY)
+
+    meta_x, meta_y, size = get_metatile(z, x, y)
+    url = tile_url(layer, z, meta_x, meta_y, style=style, internal=True, size=size)
+    _render_metatile_once(
+        _metatile_key(layer, style, z, meta_x, meta_y), url,
+        meta_x, meta_y, size, tile_filename,
+        lambda: os.path.exists(filename))
+    return filename if os.path.exists(filename) else None
+
+
+def iter_metatiles(bbox, min_zoom, max_zoom, size=None):
+    """Iterate over the metatiles covering a bounding box.
+
+    :param bbox: Bounding box in EPSG:4326, as [xmin, ymin, xmax, ymax].
+    :type bbox: list(float)
+
+    :return: Tuples (z, x, y, size) of the metatiles.
+    :rtype: iterator
+    """
+    xmin, ymin, xmax, ymax = [float(coord) for coord in bbox]
+    for z in range(min_zoom, max_zoom + 1):
+        top_x, top_y = deg2num(ymax, xmin, z)
+        bottom_x, bottom_y = deg2num(ymin, xmax, z)
+        meta_x, meta_y, meta_size = get_metatile(z, top_x, top_y, size)
+        for x in range(meta_x, bottom_x + 1, meta_size):
+            for y in range(meta_y, bottom_y + 1, meta_size):
+                yield z, x, y, meta_size
+
+
+def seed_tiles(layer, min_zoom, max_zoom, bbox=None, style=None,
+               workers=None, overwrite=False):
+    """Render in advance the tiles of a layer.
+
+    The GetMap urls are built by the calling thread, while the metatiles are
+    fetched, sliced and stored by a pool of 'workers' threads.
+
+    :param bbox: Bounding box in EPSG:4326, as [xmin, ymin, xmax, ymax].
+        Defaults to the layer bounding box.
+    :type bbox: list(float)
+
+    :param overwrite: set True to render the tiles already in the cache.
+    :type overwrite: bool
+
+    :return: Number of metatiles rendered, skipped and failed.
+    :rtype: dict
+    """
+    qgis_layer = QGISServerLayer.objects.get(layer=layer)
+    if not style and qgis_layer.default_style:
+        style = qgis_layer.default_style.name
+    if not bbox:
+        ll_bbox = layer.ll_bbox
+        bbox = [ll_bbox[0], ll_bbox[2], ll_bbox[1], ll_bbox[3]]
+    workers = workers or get_seed_workers()
+
+    stats = {'rendered': 0, 'skipped': 0, 'failed': 0}
+
+    def collect(futures):
+        for future in futures:
+            stats['rendered' if future.result() else 'failed'] += 1
+
+    tile_filenames = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for z, x, y, size in iter_metatiles(bbox, min_zoom, max_zoom):
+            if z not in tile_filenames:
+                tile_filenames[z] = tile_filename_function(qgis_layer, style, z)
+            tile_filename = tile_filenames[z]
+            filenames = [
+                tile_filename(x + dx, y + dy)
+                for dx in range(size) for dy in range(size)]
+
+            def is_rendered(filenames=filenames):
+                return all(os.path.exists(filename) for filename in filenames)
+
+            if not overwrite and is_rendered():
+                stats['skipped'] += 1
+                continue
+            url = tile_url(layer, z, x, y, style=style, internal=True, size=size)
+            pending.add(executor.submit(
+                _render_metatile_once, _metatile_key(layer, style, z, x, y), url,
+                x, y, size, tile_filename, (lambda: False) if overwrite else is_rendered))
+            # Do not queue more metatiles than the workers can process
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(pending)
+    return stats
+
+
+def seed_resource_tiles(instance, min_zoom, max_zoom, **kwargs):
+    """Render in advance the tiles of a layer, or of the layers of a map.
+
+    :return: Statistics of 'seed_tiles' per layer name.
+    :rtype: dict
+    """
+    from geonode.maps.models import Map
+
+    if isinstance(instance, Map):
+        layer_names = [
+            map_layer.name for map_layer in instance.layers if map_layer.local]
+        layers = [
+            qgis_layer.layer for qgis_layer in QGISServerLayer.objects.filter(
+                layer__alternate__in=layer_names).select_related('layer')]
+    else:
+        layers = [instance]
+    return dict(
+        (layer.name, seed_tiles(layer, min_zoom, max_zoom, **kwargs))
+        for layer in layers)
+
+
+def iter_cached_tiles(tiles_directory=None):
+    """Iterate over the tiles in the tiles cache.
+
+    Only the files following the 'tile_path' layout, i.e.
+    <layer>/<style>/<z>/<x>/<y>.png, are considered: legends and thumbnails
+    stored in the same directory are left alone.
+
+    :return: Tuples (layer name, path, os.stat_result) of the tiles.
+    :rtype: iterator
+    """
+    tiles_directory = tiles_directory or settings.QGIS_SERVER_CONFIG['tiles_directory']
+    for root, dirs, files in os.walk(tiles_directory):
+        parts = os.path.relpath(root, tiles_directory).split(os.sep)
+        if len(parts) != 4 or not (parts[2].isdigit() and parts[3].isdigit()):
+            continue
+        for filename in files:
+            name, extension = os.path.splitext(filename)
+            if extension != '.png' or not name.isdigit():
+                continue
+            path = os.path.join(root, filename)
+            try:
+                yield parts[0], path, os.stat(path)
+            except OSError:
+                # evicted or replaced meanwhile
+                continue
+
+
+def evict_tiles(max_size=None, tiles_directory=None):
+    """Delete the least recently accessed tiles until the tiles cache fits in
+    its size quota.
+
+    :param max_size: Size quota in bytes, defaults to the 'tiles_max_size'
+        option of QGIS_SERVER_CONFIG.
+    :type max_size: int
+
+    :return: Tuple (number of tiles deleted, bytes freed).
+    :rtype: tuple
+    """
+    max_size = max_size if max_size is not None else get_tiles_max_size()
+    if max_size is None:
+        return 0, 0
+
+    tiles = []
+    total_size = 0
+    for layer_name, path, stat in iter_cached_tiles(tiles_directory):
+        tiles.append((stat.st_atime, stat.st_size, path))
+        total_size += stat.st_size
+    if total_size <= max_size:
+        return 0, 0
+
+    heapq.heapify(tiles)
+    deleted = freed = 0
+    while tiles and total_size - freed > max_size:
+        atime, size, path = heapq.heappop(tiles)
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        deleted += 1
+        freed += size
+    logger.info('Evicted {0} tiles ({1} bytes)'.format(deleted, freed))
+    return deleted, freed
+
+
+def get_tiles_cache_stats(tiles_directory=None):
+    """Get the disk usage of the tiles cache, in total and per layer, and the
+    number of tile requests served from the cache (hits) or rendered (misses).
+
+    :rtype: dict
+    """
+    stats = {
+        'tiles': 0,
+        'size': 0,
+        'max_size': get_tiles_max_size(),
+        'hits': cache.get(TILES_HITS_KEY) or 0,
+        'misses': cache.get(TILES_MISSES_KEY) or 0,
+        'layers': {}
+    }
+    for layer_name, path, stat in iter_cached_tiles(tiles_directory):
+        layer_stats = stats['layers'].setdefault(layer_name, {'tiles': 0, 'size': 0})
+        layer_stats['tiles'] += 1
+        layer_stats['size'] += stat.st_size
+        stats['tiles'] += 1
+        stats['size'] += stat.st_size
+    return stats
+
+
+def tile_response(request, filename, content_type='image/png'):
+    """Serve a cached tile, honoring the conditional request headers.
+
+    The file is streamed by FileResponse, which lets the WSGI server use
+    sendfile when available, instead of being read in memory.
+    """
+    stat = os.stat(filename)
+    etag = '"{0:x}-{1:x}"'.format(int(stat.st_mtime), stat.st_size)
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        not_modified = etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+    else:
+        not_modified = not was_modified_since(
+            request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime, stat.st_size)
+
+    if not_modified:
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(open(filename, 'rb'), content_type=content_type)
+
+    # The access time drives the eviction of the least recently used tiles,
+    # it is not reliably updated by the filesystems mounted with noatime
+    if time.time() - stat.st_atime > ACCESS_TIME_RESOLUTION:
+        try:
+            os.utime(filename, (time.time(), stat.st_mtime))
+        except OSError:
+            pass
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
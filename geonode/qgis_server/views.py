@@ -48,12 +48,12 @@ from geonode.qgis_server.forms import QGISLayerStyleUploadForm
 from geonode.qgis_server.helpers import (
     tile_url_format,
     legend_url,
-    tile_url,
     qgs_url,
     qlr_url,
     qgis_server_endpoint, style_get_url, style_list, style_add_url,
     style_remove_url, style_set_default_url)
 from geonode.qgis_server.models import QGISServerLayer
+from geonode.qgis_server.tiles import get_tile, tile_filename_function, tile_response
 from geonode.qgis_server.tasks.update import (
     create_qgis_server_thumbnail,
     cache_request)
@@ -312,35 +312,27 @@ def tile(request, layername, z, x, y, style=None):
             style = qgis_layer.default_style.name
 
     tiles_directory = QGIS_SERVER_CONFIG['tiles_directory']
-    tile_path = QGIS_SERVER_CONFIG['tile_path']
-    tile_filename = tile_path % (qgis_layer.qgis_layer_name, style, z, x, y)
+    tile_filename = tile_filename_function(qgis_layer, style, z)
+
     # GOOD -- Verify with normalised version of path
-    tile_filename = os.path.normpath(tile_filename)
-    if not tile_filename.startswith(tiles_directory):
+    if not tile_filename(x, y).startswith(tiles_directory):
         return HttpResponseServerError()
 
-    if not os.path.exists(tile_filename):
-
-        if not os.path.exists(os.path.dirname(tile_filename)):
-            os.makedirs(os.path.dirname(tile_filename))
-        # Use internal url
-        url = tile_url(layer, z, x, y, style=style, internal=True)
-        result = cache_request.apply_async((url, tile_filename))
-
-        # Attempt to run task synchronously
-        if not result.get():
-            # If not succeded, provides error message.
-            return HttpResponseServerError('Failed to fetch tile.')
+    # Render the missing tile along with its metatile, concurrent requests
+    # of the same metatile waiting for it to be rendered
+    filename = get_tile(layer, style, z, x, y, tile_filename)
+    if not filename:
+        # If not succeded, provides error message.
+        return HttpResponseServerError('Failed to fetch tile.')
 
-    if image_format(tile_filename) != 'png':
-        logger.error('%s is not valid PNG.' % tile_filename)
-        os.remove(tile_filename)
+    if image_format(filename) != 'png':
+        logger.error('%s is not valid PNG.' % filename)
+        os.remove(filename)
 
-    if not os.path.exists(tile_filename):
+    if not os.path.exists(filename):
         return HttpResponse('The tile could not be found.', status=409)
 
-    with open(tile_filename, 'rb') as f:
-        return HttpResponse(f.read(), content_type='image/png')
+    return tile_response(request, filename)
 
 
 def layer_ogc_request(request, layername):
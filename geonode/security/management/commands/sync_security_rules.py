@@ -19,7 +19,12 @@
 #########################################################################
 
 from django.core.management.base import BaseCommand
-from geonode.security.utils import sync_resources_with_guardian
+from geonode.security.utils import (
+    get_dirty_layers_chunks,
+    get_security_sync_progress,
+    start_security_sync_progress,
+    sync_layers_with_guardian
+)
 
 
 class Command(BaseCommand):
@@ -27,6 +32,23 @@ class Command(BaseCommand):
     Sync resources with Guardian and clear their dirty state
     """
 
-    def handle(self, *args, **options):
-        sync_resources_with_guardian()
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            dest='chunk_size',
+            type=int,
+            default=None,
+            help='Number of layers synced at once, defaults to SECURITY_SYNC_CHUNK_SIZE')
 
+    def handle(self, *args, **options):
+        chunks = get_dirty_layers_chunks(options.get('chunk_size'))
+        if not chunks:
+            return
+        start_security_sync_progress(sum(len(chunk) for chunk in chunks))
+        for chunk in chunks:
+            sync_layers_with_guardian(chunk)
+            progress = get_security_sync_progress()
+            if progress:
+                self.stdout.write(
+                    "{synced}/{total} layers synced, {failed} failed ({throughput:.2f} layers/s)".format(
+                        **progress))
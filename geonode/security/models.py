@@ -21,12 +21,15 @@ import logging
 import traceback
 
 from django.conf import settings
+from django.dispatch import receiver
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models.signals import post_save, post_delete, m2m_changed
 
 from geonode.groups.conf import settings as groups_settings
 
+from guardian.models import UserObjectPermission, GroupObjectPermission
 from guardian.shortcuts import (
     assign_perm,
     get_groups_with_perms
@@ -38,8 +41,10 @@ from .utils import (
     get_users_with_perms,
     set_owner_permissions,
     remove_object_permissions,
-    purge_geofence_layer_rules,
-    sync_geofence_with_guardian
+    GeofenceLayerRules,
+    sync_geofence_with_guardian,
+    invalidate_layer_acls,
+    invalidate_visible_resource_ids
 )
 
 logger = logging.getLogger("geonode.security.models")
@@ -209,7 +214,7 @@ class PermissionLevelMixin(object):
             assign_perm('change_layer_data', self.owner, self)
             assign_perm('change_layer_style', self.owner, self)
             if settings.OGC_SERVER['default'].get("GEOFENCE_SECURITY_ENABLED", False):
-                purge_geofence_layer_rules(self.get_self_resource())
+                geofence_rules = GeofenceLayerRules(self.layer)
 
                 # Owner & Managers
                 perms = [
@@ -219,21 +224,28 @@ class PermissionLevelMixin(object):
                     "change_resourcebase",
                     "change_resourcebase_permissions",
                     "download_resourcebase"]
-                sync_geofence_with_guardian(self.layer, perms, user=self.owner)
+                sync_geofence_with_guardian(self.layer, perms, user=self.owner, geofence_rules=geofence_rules)
                 for _group_manager in obj_group_managers:
-                    sync_geofence_with_guardian(self.layer, perms, user=_group_manager)
+                    sync_geofence_with_guardian(
+                        self.layer, perms, user=_group_manager, geofence_rules=geofence_rules)
                 for user_group in user_groups:
                     if not skip_registered_members_common_group(user_group):
-                        sync_geofence_with_guardian(self.layer, perms, group=user_group)
+                        sync_geofence_with_guardian(
+                            self.layer, perms, group=user_group, geofence_rules=geofence_rules)
 
                 # Anonymous
                 perms = ["view_resourcebase"]
                 if anonymous_can_view:
-                    sync_geofence_with_guardian(self.layer, perms, user=None, group=None)
+                    sync_geofence_with_guardian(
+                        self.layer, perms, user=None, group=None, geofence_rules=geofence_rules)
 
                 perms = ["download_resourcebase"]
                 if anonymous_can_download:
-                    sync_geofence_with_guardian(self.layer, perms, user=None, group=None)
+                    sync_geofence_with_guardian(
+                        self.layer, perms, user=None, group=None, geofence_rules=geofence_rules)
+
+                # Only the differences with the current rules are sent to GeoFence
+                geofence_rules.apply()
 
     def set_permissions(self, perm_spec, created=False):
         """
@@ -254,7 +266,12 @@ class PermissionLevelMixin(object):
                 ]
         }
         """
-        remove_object_permissions(self)
+        geofence_rules = None
+        if settings.OGC_SERVER['default'].get("GEOFENCE_SECURITY_ENABLED", False):
+            if self.polymorphic_ctype.name == 'layer':
+                # The stale GeoFence Rules are purged when the new ones are applied
+                geofence_rules = GeofenceLayerRules(self.layer)
+        remove_object_permissions(self, purge=geofence_rules is None)
 
         # default permissions for resource owner
         set_owner_permissions(self)
@@ -272,8 +289,6 @@ class PermissionLevelMixin(object):
         # Owner
         if settings.OGC_SERVER['default'].get("GEOFENCE_SECURITY_ENABLED", False):
             if self.polymorphic_ctype.name == 'layer':
-                if not created:
-                    purge_geofence_layer_rules(self.get_self_resource())
                 perms = [
                     "view_resourcebase",
                     "change_layer_data",
@@ -281,7 +296,7 @@ class PermissionLevelMixin(object):
                     "change_resourcebase",
                     "change_resourcebase_permissions",
                     "download_resourcebase"]
-                sync_geofence_with_guardian(self.layer, perms, user=self.owner)
+                sync_geofence_with_guardian(self.layer, perms, user=self.owner, geofence_rules=geofence_rules)
 
         # All the other users
         if 'users' in perm_spec and len(perm_spec['users']) > 0:
@@ -302,7 +317,9 @@ class PermissionLevelMixin(object):
                             group_perms = None
                             if 'groups' in perm_spec and len(perm_spec['groups']) > 0:
                                 group_perms = perm_spec['groups']
-                            sync_geofence_with_guardian(self.layer, perms, user=_user, group_perms=group_perms)
+                            sync_geofence_with_guardian(
+                                self.layer, perms, user=_user, group_perms=group_perms,
+                                geofence_rules=geofence_rules)
 
         # All the other groups
         if 'groups' in perm_spec and len(perm_spec['groups']) > 0:
@@ -321,7 +338,7 @@ class PermissionLevelMixin(object):
                     if self.polymorphic_ctype.name == 'layer':
                         if _group and _group.name and _group.name == 'anonymous':
                             _group = None
-                        sync_geofence_with_guardian(self.layer, perms, group=_group)
+                        sync_geofence_with_guardian(self.layer, perms, group=_group, geofence_rules=geofence_rules)
 
         # AnonymousUser
         if 'users' in perm_spec and len(perm_spec['users']) > 0:
@@ -338,7 +355,15 @@ class PermissionLevelMixin(object):
                 # Set the GeoFence Rules (user = None)
                 if settings.OGC_SERVER['default'].get("GEOFENCE_SECURITY_ENABLED", False):
                     if self.polymorphic_ctype.name == 'layer':
-                        sync_geofence_with_guardian(self.layer, perms)
+                        sync_geofence_with_guardian(self.layer, perms, geofence_rules=geofence_rules)
+
+        if geofence_rules is not None:
+            geofence_rules.apply()
+
+        # Approved resources are read only for their owner when uploads are moderated
+        if self.owner and self.is_approved and settings.ADMIN_MODERATE_UPLOADS:
+            from geonode.base.utils import ManageResourceOwnerPermissions
+            ManageResourceOwnerPermissions(self).set_owner_permissions_according_to_workflow()
 
     def set_workflow_perms(self, approved=False, published=False):
         """
@@ -380,3 +405,40 @@ class PermissionLevelMixin(object):
             if settings.OGC_SERVER['default'].get("GEOFENCE_SECURITY_ENABLED", False):
                 if self.polymorphic_ctype.name == 'layer':
                     sync_geofence_with_guardian(self.layer, VIEW_PERMISSIONS)
+
+
+# Invalidate the cached visible resources whenever an object permission
+# is assigned or removed, or the group membership of a user changes.
+@receiver(post_save, sender=UserObjectPermission)
+@receiver(post_delete, sender=UserObjectPermission)
+def user_object_permission_changed(sender, instance, **kwargs):
+    invalidate_visible_resource_ids(user_ids=[instance.user_id])
+
+
+@receiver(post_save, sender=GroupObjectPermission)
+@receiver(post_delete, sender=GroupObjectPermission)
+def group_object_permission_changed(sender, instance, **kwargs):
+    invalidate_visible_resource_ids(group_ids=[instance.group_id])
+
+
+@receiver(m2m_changed)
+def group_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if sender is not get_user_model().groups.through:
+        return
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_visible_resource_ids(user_ids=[instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        invalidate_visible_resource_ids(user_ids=pk_set)
+    elif action == 'pre_clear':
+        invalidate_visible_resource_ids(
+            user_ids=list(instance.user_set.values_list('id', flat=True)))
+
+
+# The cached ACLs also depend on the credentials and the flags of the users
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_layer_acls()
@@ -17,10 +17,19 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 #########################################################################
+import logging
+
 from django.conf import settings
 from celery import shared_task
 
-from .utils import sync_resources_with_guardian
+from .utils import (
+    get_dirty_layers_chunks,
+    get_security_sync_progress,
+    start_security_sync_progress,
+    sync_layers_with_guardian
+)
+
+logger = logging.getLogger(__name__)
 
 
 @shared_task(
@@ -29,9 +38,36 @@ from .utils import sync_resources_with_guardian
     queue='update',
     autoretry_for=(Exception, ),
     retry_kwargs={'max_retries': 5, 'countdown': 180})
-def synch_guardian():
+def synch_guardian(self):
     """
     Sync resources with Guardian and clear their dirty state
+
+    The dirty Layers are split in chunks of 'SECURITY_SYNC_CHUNK_SIZE', each one
+    synced by a 'synch_guardian_chunk' task on any worker.
     """
     if getattr(settings, 'DELAYED_SECURITY_SIGNALS', False):
-        sync_resources_with_guardian()
+        progress = get_security_sync_progress()
+        if progress and progress['synced'] + progress['failed'] < progress['total'] and \
+                progress['elapsed'] < getattr(settings, 'SECURITY_SYNC_TIMEOUT', 3600):
+            # The chunks of the previous run are still being synced
+            logger.debug("Security sync in progress: {}".format(progress))
+            return
+        chunks = get_dirty_layers_chunks()
+        if chunks:
+            start_security_sync_progress(sum(len(chunk) for chunk in chunks))
+            for chunk in chunks:
+                synch_guardian_chunk.apply_async((chunk, ))
+
+
+@shared_task(
+    bind=True,
+    name='geonode.security.tasks.synch_guardian_chunk',
+    queue='update',
+    acks_late=True,
+    autoretry_for=(Exception, ),
+    retry_kwargs={'max_retries': 5, 'countdown': 180})
+def synch_guardian_chunk(self, layer_ids):
+    """
+    Sync a chunk of Layers with Guardian and clear their dirty state
+    """
+    sync_layers_with_guardian(layer_ids)
@@ -21,16 +21,21 @@ from geonode.tests.base import GeoNodeBaseTestSupport
 
 import os
 import json
+import time
 import base64
 import logging
 import gisdata
 import contextlib
 
+from unittest import mock
+
 from urllib.request import urlopen, Request
 from tastypie.test import ResourceTestCaseMixin
 
 from django.conf import settings
+from django.core.cache import caches
 from django.http import HttpRequest
+from django.test.utils import override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 
@@ -41,6 +46,7 @@ from guardian.shortcuts import (
 )
 from geonode import qgis_server, geoserver
 from geonode.base.models import (
+    ResourceBase,
     UserGeoLimit,
     GroupGeoLimit
 )
@@ -62,9 +68,18 @@ from .utils import (
     get_geofence_rules,
     get_geofence_rules_count,
     get_highest_priority,
+    get_visible_resources,
+    get_visible_resource_ids,
+    get_viewable_resources,
+    get_resources_ids_with_perm,
     set_geofence_all,
+    GeofenceLayerRules,
     sync_geofence_with_guardian,
-    sync_resources_with_guardian
+    sync_layers_with_guardian,
+    sync_resources_with_guardian,
+    get_dirty_layers_chunks,
+    get_security_sync_progress,
+    start_security_sync_progress
 )
 
 
@@ -190,6 +205,101 @@ class SecurityTest(GeoNodeBaseTestSupport):
         response = self.client.get('/admin')
         self.assertEqual(response.status_code, 302)
 
+    @on_ogc_backend(geoserver.BACKEND_PACKAGE)
+    @dump_func_name
+    def test_geofence_layer_rules_diff(self):
+        """
+        Only the missing GeoFence Rules are added and the stale ones deleted.
+        """
+        layer = Layer.objects.first()
+        current_rules = {'rules': [
+            # Kept
+            {'id': 1, 'priority': 1, 'userName': 'bobby', 'roleName': None, 'layer': layer.name,
+             'service': 'WMS', 'request': None, 'access': 'ALLOW'},
+            # Duplicated
+            {'id': 2, 'priority': 2, 'userName': 'bobby', 'roleName': None, 'layer': layer.name,
+             'service': 'WMS', 'request': None, 'access': 'ALLOW'},
+            # Stale
+            {'id': 3, 'priority': 3, 'userName': 'norman', 'roleName': None, 'layer': layer.name,
+             'service': 'WFS', 'request': None, 'access': 'ALLOW'},
+            # Another layer
+            {'id': 4, 'priority': 4, 'userName': 'norman', 'roleName': None, 'layer': 'other',
+             'service': 'WFS', 'request': None, 'access': 'ALLOW'},
+        ]}
+        session = mock.MagicMock()
+        session.get.return_value = mock.MagicMock(status_code=200, json=lambda: current_rules)
+        session.post.return_value = mock.MagicMock(status_code=201, text='')
+        session.delete.return_value = mock.MagicMock(status_code=200, text='')
+        with mock.patch('geonode.security.utils._get_geofence_session', return_value=session), \
+                mock.patch('geonode.security.utils.get_highest_priority', return_value=10) as highest_priority, \
+                mock.patch('geonode.security.utils.set_geofence_invalidate_cache'), \
+                mock.patch('geonode.security.utils.toggle_layer_cache'):
+            geofence_rules = GeofenceLayerRules(layer)
+            geofence_rules.add('WMS', user='bobby')
+            geofence_rules.add('WMS', user='bobby')
+            geofence_rules.add('WPS', user='bobby')
+            geofence_rules.add('WMS', group='registered-members')
+            geofence_rules.apply()
+
+        self.assertEqual(session.get.call_count, 1)
+        self.assertEqual(
+            sorted(_call[0][0].split('/')[-1] for _call in session.delete.call_args_list), ['2', '3'])
+        self.assertEqual(session.post.call_count, 2)
+        self.assertEqual(highest_priority.call_count, 1)
+        payloads = [ensure_string(_call[1]['data']) for _call in session.post.call_args_list]
+        self.assertIn('<service>WPS</service>', payloads[0])
+        self.assertIn('<priority>10</priority>', payloads[0])
+        self.assertIn('<roleName>ROLE_REGISTERED-MEMBERS</roleName>', payloads[1])
+        self.assertIn('<priority>11</priority>', payloads[1])
+
+    @on_ogc_backend(geoserver.BACKEND_PACKAGE)
+    @dump_func_name
+    def test_geofence_layer_rules_revoked_requests_first(self):
+        """
+        The WFS-T DENY Rules of a user losing 'change_layer_data' precede its ALLOW Rules.
+        """
+        layer = Layer.objects.first()
+        current_rules = {'rules': [
+            {'id': 1, 'priority': 1, 'userName': 'bobby', 'roleName': None, 'layer': layer.name,
+             'service': 'WMS', 'request': None, 'access': 'ALLOW'},
+            {'id': 2, 'priority': 2, 'userName': 'bobby', 'roleName': None, 'layer': layer.name,
+             'service': 'WFS', 'request': None, 'access': 'ALLOW'},
+            # Unchanged principal
+            {'id': 3, 'priority': 3, 'userName': 'norman', 'roleName': None, 'layer': layer.name,
+             'service': 'WFS', 'request': None, 'access': 'ALLOW'},
+        ]}
+        session = mock.MagicMock()
+        session.get.return_value = mock.MagicMock(status_code=200, json=lambda: current_rules)
+        session.post.return_value = mock.MagicMock(status_code=201, text='')
+        session.delete.return_value = mock.MagicMock(status_code=200, text='')
+        with mock.patch('geonode.security.utils._get_geofence_session', return_value=session), \
+                mock.patch('geonode.security.utils.get_highest_priority', return_value=10), \
+                mock.patch('geonode.security.utils.set_geofence_invalidate_cache'), \
+                mock.patch('geonode.security.utils.toggle_layer_cache'):
+            geofence_rules = GeofenceLayerRules(layer)
+            # 'download_resourcebase' kept, 'change_layer_data' revoked
+            geofence_rules.add('WMS', user='bobby')
+            for request in ('TRANSACTION', 'LOCKFEATURE', 'GETFEATUREWITHLOCK'):
+                geofence_rules.add('WFS', request=request, user='bobby', allow=False)
+            geofence_rules.add('WFS', user='bobby')
+            geofence_rules.add('WFS', user='norman')
+            geofence_rules.apply()
+
+        self.assertEqual(
+            sorted(_call[0][0].split('/')[-1] for _call in session.delete.call_args_list), ['1', '2'])
+        payloads = [ensure_string(_call[1]['data']) for _call in session.post.call_args_list]
+        self.assertEqual(len(payloads), 5)
+        for _payload in payloads:
+            self.assertIn('<userName>bobby</userName>', _payload)
+        self.assertIn('<service>WMS</service>', payloads[0])
+        for index, request in enumerate(('TRANSACTION', 'LOCKFEATURE', 'GETFEATUREWITHLOCK'), 1):
+            self.assertIn('<request>{}</request>'.format(request), payloads[index])
+            self.assertIn('<access>DENY</access>', payloads[index])
+        self.assertIn('<service>WFS</service>', payloads[4])
+        self.assertIn('<access>ALLOW</access>', payloads[4])
+        self.assertNotIn('<request>', payloads[4])
+        self.assertIn('<priority>14</priority>', payloads[4])
+
 
 class SecurityViewsTests(ResourceTestCaseMixin, GeoNodeBaseTestSupport):
 
@@ -353,6 +463,132 @@ class BulkPermissionsTests(ResourceTestCaseMixin, GeoNodeBaseTestSupport):
             self.assertEqual(geofence_rules_count, 0)
 
 
+class VisibleResourcesTest(GeoNodeBaseTestSupport):
+
+    """
+    Compares the set-based visibility filter against the per-object
+    'has_perm' evaluation it replaces.
+    """
+
+    def setUp(self):
+        super(VisibleResourcesTest, self).setUp()
+        self.bobby = get_user_model().objects.get(username='bobby')
+        self.norman = get_user_model().objects.get(username='norman')
+        self.anonymous_user = get_anonymous_user()
+        anonymous_group = Group.objects.get(name='anonymous')
+        # Make a few resources visible to bobby only
+        self.restricted_resources = list(ResourceBase.objects.all()[:3])
+        for resource in self.restricted_resources:
+            remove_perm('view_resourcebase', anonymous_group, resource)
+            assign_perm('view_resourcebase', self.bobby, resource)
+
+    def _legacy_visible_resources(self, queryset, user):
+        _allowed_resources = []
+        for _obj in queryset:
+            resource = _obj.get_self_resource()
+            if user.has_perm('base.view_resourcebase', resource) or \
+            user.has_perm('view_resourcebase', resource):
+                _allowed_resources.append(resource.id)
+        return queryset.filter(id__in=_allowed_resources)
+
+    @dump_func_name
+    def test_visible_resources_match_has_perm(self):
+        for user in (self.bobby, self.norman, self.anonymous_user):
+            queryset = ResourceBase.objects.all()
+
+            start = time.time()
+            legacy = set(self._legacy_visible_resources(queryset, user).values_list('id', flat=True))
+            legacy_time = time.time() - start
+
+            start = time.time()
+            visible = set(get_visible_resources(
+                queryset,
+                user,
+                admin_approval_required=True,
+                unpublished_not_visible=True,
+                private_groups_not_visibile=True).values_list('id', flat=True))
+            visible_time = time.time() - start
+
+            _log("get_visible_resources [%s]: per-object %.4fs - set-based %.4fs",
+                 user, legacy_time, visible_time)
+            self.assertTrue(visible.issubset(legacy))
+            self.assertEqual(
+                visible,
+                legacy & set(get_visible_resources(queryset, user).values_list('id', flat=True)))
+
+    @dump_func_name
+    def test_visible_resources_query_count(self):
+        queryset = ResourceBase.objects.all()
+        # 'anonymous' Group lookup + the filtered resources query
+        with self.assertNumQueries(2):
+            list(get_visible_resources(
+                queryset,
+                self.bobby,
+                admin_approval_required=True,
+                unpublished_not_visible=True,
+                private_groups_not_visibile=True).values_list('id', flat=True))
+
+    @dump_func_name
+    def test_resources_ids_with_perm(self):
+        resources = list(ResourceBase.objects.all())
+        resource_ids = [_r.id for _r in resources]
+        for user in (self.bobby, self.norman):
+            expected = set(_r.id for _r in resources if user.has_perm('view_resourcebase', _r))
+            with self.assertNumQueries(1):
+                self.assertEqual(
+                    get_resources_ids_with_perm(user, resource_ids, 'view_resourcebase'), expected)
+        self.assertEqual(get_resources_ids_with_perm(self.bobby, []), set())
+
+    @dump_func_name
+    def test_visible_resource_ids_cache(self):
+        with self.settings(VISIBLE_RESOURCES_CACHE='resources'):
+            caches['resources'].clear()
+            resource = self.restricted_resources[0]
+            group = Group.objects.create(name='visible_resources_group')
+
+            norman = get_user_model().objects.get(username='norman')
+            visible_ids = get_visible_resource_ids(norman)
+            self.assertNotIn(resource.id, visible_ids)
+            # Same request, same user instance: no lookups at all
+            with self.assertNumQueries(0):
+                self.assertEqual(get_visible_resource_ids(norman), visible_ids)
+            # New request, cached ids
+            norman = get_user_model().objects.get(username='norman')
+            with self.assertNumQueries(0):
+                self.assertEqual(get_visible_resource_ids(norman), visible_ids)
+
+            # Group permissions invalidate the group entries
+            assign_perm('view_resourcebase', group, resource)
+            self.assertNotIn(resource.id, get_visible_resource_ids(
+                get_user_model().objects.get(username='norman')))
+
+            # Group membership invalidates the user entries
+            self.norman.groups.add(group)
+            self.assertIn(resource.id, get_visible_resource_ids(
+                get_user_model().objects.get(username='norman')))
+            self.norman.groups.remove(group)
+            self.assertNotIn(resource.id, get_visible_resource_ids(
+                get_user_model().objects.get(username='norman')))
+
+            # User permissions invalidate the user entries
+            assign_perm('view_resourcebase', self.norman, resource)
+            self.assertIn(resource.id, get_visible_resource_ids(
+                get_user_model().objects.get(username='norman')))
+            remove_perm('view_resourcebase', self.norman, resource)
+            self.assertNotIn(resource.id, get_visible_resource_ids(
+                get_user_model().objects.get(username='norman')))
+
+    @dump_func_name
+    def test_viewable_resources_subquery(self):
+        visible_ids = set(get_viewable_resources(self.bobby).values_list('id', flat=True))
+        self.assertTrue(set(_r.id for _r in self.restricted_resources).issubset(visible_ids))
+        # Past the limit, the visible ids are not inlined in the query
+        with self.settings(VISIBLE_RESOURCES_MAX_IDS=0):
+            queryset = get_viewable_resources(self.bobby)
+            self.assertIn('guardian_userobjectpermission', str(queryset.query))
+            self.assertEqual(set(queryset.values_list('id', flat=True)), visible_ids)
+
+
 class PermissionsTest(GeoNodeBaseTestSupport):
 
     """Tests GeoNode permissions
@@ -1610,3 +1846,49 @@ class SecurityRulesTest(ResourceTestCaseMixin, GeoNodeBaseTestSupport):
             clean_layer = Layer.objects.get(pk=self._l.id)
             # Check dirty state
             self.assertFalse(clean_layer.dirty_state)
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'security-sync-tests',
+        }
+    })
+    @dump_func_name
+    def test_sync_layers_with_guardian_chunks(self):
+        ResourceBase.objects.filter(id=self._l.id).update(dirty_state=True)
+        with self.settings(SECURITY_SYNC_CHUNK_SIZE=1):
+            chunks = get_dirty_layers_chunks()
+        self.assertIn([self._l.id], chunks)
+        self.assertTrue(all(len(chunk) == 1 for chunk in chunks))
+
+        start_security_sync_progress(1)
+        with mock.patch('geonode.security.utils.set_geofence_invalidate_cache') as invalidate_cache, \
+                mock.patch.object(GeofenceLayerRules, 'apply', return_value=True) as apply:
+            self.assertEqual(sync_layers_with_guardian([self._l.id]), (1, 0))
+        # The GeoFence rules cache is invalidated once per chunk
+        apply.assert_called_once_with(invalidate_cache=False)
+        invalidate_cache.assert_called_once_with()
+        self.assertFalse(Layer.objects.get(pk=self._l.id).dirty_state)
+
+        progress = get_security_sync_progress()
+        self.assertEqual(progress['total'], 1)
+        self.assertEqual(progress['synced'], 1)
+        self.assertEqual(progress['failed'], 0)
+        self.assertGreater(progress['throughput'], 0)
+
+    @dump_func_name
+    def test_sync_layers_with_guardian_keeps_concurrent_changes(self):
+        ResourceBase.objects.filter(id=self._l.id).update(dirty_state=True)
+
+        def apply(invalidate_cache=True):
+            # The permissions change while the chunk is being synced
+            Layer.objects.get(pk=self._l.id).set_dirty_state()
+            return False
+
+        with mock.patch.object(GeofenceLayerRules, 'apply', side_effect=apply):
+            self.assertEqual(sync_layers_with_guardian([self._l.id]), (1, 0))
+        self.assertTrue(Layer.objects.get(pk=self._l.id).dirty_state)
+
+        with mock.patch.object(GeofenceLayerRules, 'apply', return_value=False):
+            self.assertEqual(sync_layers_with_guardian([self._l.id]), (1, 0))
+        self.assertFalse(Layer.objects.get(pk=self._l.id).dirty_state)
@@ -23,28 +23,42 @@ from lxml import etree
 import xml.etree.ElementTree as ET
 from defusedxml import lxml as dlxml
 
+import re
 import json
+import time
 import logging
 import traceback
 import requests
 
+from array import array
+from collections import OrderedDict
+
 from six import string_types
 from requests.auth import HTTPBasicAuth
 from django.conf import settings
-from django.db.models import Q
+from django.core.cache import cache, caches
+from django.db.models import Q, IntegerField
+from django.db.models.functions import Cast
 from django.contrib.auth import get_user_model
-from django.core.exceptions import PermissionDenied
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import Group, Permission
 from django.core.exceptions import ObjectDoesNotExist
 from guardian.utils import get_user_obj_perms_model
 from guardian.shortcuts import assign_perm, get_anonymous_user
 
-from geonode.utils import get_layer_workspace
+from geonode.utils import get_layer_workspace, http_client
 from geonode.groups.models import GroupProfile
 
 logger = logging.getLogger("geonode.security.utils")
 
+VISIBLE_RESOURCES_USER_KEY = 'visible_resources_user_{}'
+VISIBLE_RESOURCES_USER_GROUPS_KEY = 'visible_resources_user_groups_{}'
+VISIBLE_RESOURCES_GROUP_KEY = 'visible_resources_group_{}'
+WRITABLE_LAYERS_USER_KEY = 'writable_layers_user_{}'
+WRITABLE_LAYERS_GROUP_KEY = 'writable_layers_group_{}'
+LAYER_ACLS_VERSION_KEY = 'layer_acls_version'
+SECURITY_SYNC_PROGRESS_KEY = 'security_sync_progress_{}'
+
 
 def get_visible_resources(queryset,
                           user,
@@ -107,20 +121,258 @@ def get_visible_resources(queryset,
             filter_set = filter_set.exclude(Q(dirty_state=True))
 
         if admin_approval_required or unpublished_not_visible or private_groups_not_visibile:
-            _allowed_resources = []
-            for _obj in filter_set.all():
-                try:
-                    resource = _obj.get_self_resource()
-                    if user.has_perm('base.view_resourcebase', resource) or \
-                    user.has_perm('view_resourcebase', resource):
-                        _allowed_resources.append(resource.id)
-                except (PermissionDenied, Exception) as e:
-                    logger.debug(e)
-            return filter_set.filter(id__in=_allowed_resources)
+            filter_set = filter_set.filter(
+                get_resources_with_perm_filter(user, 'base.view_resourcebase'))
 
     return filter_set
 
 
+def get_resources_with_perm_filter(user, perm):
+    """
+    Returns a Q object restricting a ResourceBase queryset to the resources
+    on which the user has been granted the object permission, either
+    directly or through one of its groups.
+
+    This mirrors the outcome of 'user.has_perm(perm, resource)' for every row,
+    but is resolved by the database as a single query joining the guardian
+    object permission tables, instead of one check per resource.
+    """
+    if not user or user.is_anonymous:
+        user = get_anonymous_user()
+    if not user.is_active:
+        return Q(id__in=[])
+    if user.is_superuser:
+        return Q()
+
+    return _get_granted_objects_filter(user, _get_resource_perm_filter(perm))
+
+
+def _get_granted_objects_filter(user, perm_filter):
+    from guardian.models import UserObjectPermission, GroupObjectPermission
+
+    # guardian stores the object primary keys as strings
+    user_perms = UserObjectPermission.objects.filter(
+        user=user, **perm_filter).annotate(
+            obj_id=Cast('object_pk', IntegerField())).values('obj_id')
+    group_perms = GroupObjectPermission.objects.filter(
+        group__in=user.groups.all(), **perm_filter).annotate(
+            obj_id=Cast('object_pk', IntegerField())).values('obj_id')
+    return Q(id__in=user_perms) | Q(id__in=group_perms)
+
+
+def get_resources_ids_with_perm(user, resource_ids, perm='view_resourcebase'):
+    """
+    Bulk version of 'user.has_perm(perm, resource)': returns the subset of
+    the given resource ids on which the user holds the object permission.
+
+    The whole list is checked with a single query, regardless of its size.
+    """
+    from geonode.base.models import ResourceBase
+
+    resource_ids = [_id for _id in resource_ids if _id is not None]
+    if not resource_ids:
+        return set()
+    return set(
+        ResourceBase.objects.filter(id__in=resource_ids).filter(
+            get_resources_with_perm_filter(user, perm)).values_list('id', flat=True))
+
+
+def _get_resource_perm_filter(perm):
+    from geonode.base.models import ResourceBase
+    ctype = ContentType.objects.get_for_model(ResourceBase)
+    return dict(
+        content_type=ctype,
+        permission__content_type=ctype,
+        permission__codename=perm.split('.')[-1]
+    )
+
+
+def _get_visible_resources_cache():
+    return caches[getattr(settings, 'VISIBLE_RESOURCES_CACHE', 'default')]
+
+
+def _pack_ids(ids):
+    return array('L', sorted(set(int(_id) for _id in ids))).tobytes()
+
+
+def _unpack_ids(value):
+    ids = array('L')
+    ids.frombytes(value)
+    return ids
+
+
+def _get_granted_object_ids(user_obj, perm_filter, user_key_format, group_key_format):
+    """
+    Returns the ids of the objects on which the user has been granted the
+    permission of 'perm_filter', either directly or through one of its groups.
+
+    The ids granted to the user and to each of its groups are cached separately
+    under the 'user_key_format' and 'group_key_format' keys.
+    """
+    from guardian.models import UserObjectPermission, GroupObjectPermission
+
+    cache = _get_visible_resources_cache()
+    user_key = user_key_format.format(user_obj.id)
+    groups_key = VISIBLE_RESOURCES_USER_GROUPS_KEY.format(user_obj.id)
+    cached = cache.get_many([user_key, groups_key])
+
+    if user_key not in cached:
+        cached[user_key] = _pack_ids(
+            UserObjectPermission.objects.filter(
+                user=user_obj, **perm_filter).values_list('object_pk', flat=True))
+        cache.set(user_key, cached[user_key])
+    if groups_key not in cached:
+        cached[groups_key] = _pack_ids(user_obj.groups.values_list('id', flat=True))
+        cache.set(groups_key, cached[groups_key])
+
+    granted_ids = set(_unpack_ids(cached[user_key]))
+    group_keys = {
+        group_key_format.format(_group_id): _group_id
+        for _group_id in _unpack_ids(cached[groups_key])
+    }
+    cached_groups = cache.get_many(list(group_keys.keys()))
+    for group_key, group_id in group_keys.items():
+        if group_key not in cached_groups:
+            cached_groups[group_key] = _pack_ids(
+                GroupObjectPermission.objects.filter(
+                    group_id=group_id, **perm_filter).values_list('object_pk', flat=True))
+            cache.set(group_key, cached_groups[group_key])
+        granted_ids.update(_unpack_ids(cached_groups[group_key]))
+    return sorted(granted_ids)
+
+
+def get_visible_resource_ids(user):
+    """
+    Returns the sorted ids of the resources on which the user has been
+    granted the 'view_resourcebase' object permission, either directly or
+    through one of its groups.
+
+    The ids granted to every user and group are stored as compact sorted
+    arrays in the 'VISIBLE_RESOURCES_CACHE' cache, and are invalidated by the
+    guardian object permissions and group membership signals.
+    The result is also memoized on the user instance, so that all the lookups
+    issued while serving the same request share a single computation.
+    """
+    _memo = getattr(user, '_visible_resource_ids', None)
+    if _memo is not None:
+        return _memo
+
+    user_obj = get_anonymous_user() if not user or user.is_anonymous else user
+    if not user_obj.is_active:
+        return []
+
+    visible_ids = _get_granted_object_ids(
+        user_obj,
+        _get_resource_perm_filter('view_resourcebase'),
+        VISIBLE_RESOURCES_USER_KEY,
+        VISIBLE_RESOURCES_GROUP_KEY)
+    try:
+        user._visible_resource_ids = visible_ids
+    except AttributeError:
+        pass
+    return visible_ids
+
+
+def get_viewable_resources(user, queryset=None):
+    """
+    Cached equivalent of 'get_objects_for_user(user, 'base.view_resourcebase')'.
+
+    Users holding the global 'view_resourcebase' permission, superusers included,
+    can see the whole queryset; everybody else is restricted to
+    'get_visible_resource_ids'. Beyond 'VISIBLE_RESOURCES_MAX_IDS' ids the
+    queryset is filtered by the guardian permissions subquery instead, since a
+    literal IN list that long is slow and may exceed the bound parameters
+    limit of the database.
+    """
+    from geonode.base.models import ResourceBase
+
+    if queryset is None:
+        queryset = ResourceBase.objects.all()
+    user_obj = get_anonymous_user() if not user or user.is_anonymous else user
+    if user_obj.is_active and user_obj.has_perm('base.view_resourcebase'):
+        return queryset
+    visible_ids = get_visible_resource_ids(user)
+    if len(visible_ids) > getattr(settings, 'VISIBLE_RESOURCES_MAX_IDS', 500):
+        return queryset.filter(
+            _get_granted_objects_filter(user_obj, _get_resource_perm_filter('view_resourcebase')))
+    return queryset.filter(id__in=visible_ids)
+
+
+def get_writable_layers(user, queryset=None):
+    """
+    Cached equivalent of 'get_objects_for_user(user, 'layers.change_layer_data')'.
+
+    The ids of the layers granted to every user and group are cached like the
+    visible resource ids, see 'get_visible_resource_ids'.
+    """
+    from geonode.layers.models import Layer
+
+    if queryset is None:
+        queryset = Layer.objects.all()
+    user_obj = get_anonymous_user() if not user or user.is_anonymous else user
+    if not user_obj.is_active:
+        return queryset.none()
+    if user_obj.has_perm('layers.change_layer_data'):
+        return queryset
+    ctype = ContentType.objects.get_for_model(Layer)
+    perm_filter = dict(content_type=ctype, permission__content_type=ctype, permission__codename='change_layer_data')
+    writable_ids = _get_granted_object_ids(
+        user_obj,
+        perm_filter,
+        WRITABLE_LAYERS_USER_KEY,
+        WRITABLE_LAYERS_GROUP_KEY)
+    if len(writable_ids) > getattr(settings, 'VISIBLE_RESOURCES_MAX_IDS', 500):
+        return queryset.filter(_get_granted_objects_filter(user_obj, perm_filter))
+    return queryset.filter(id__in=writable_ids)
+
+
+def get_layer_acls(user):
+    """
+    Returns the sets of the alternates of the layers readable and writable by the user.
+    """
+    from geonode.layers.models import Layer
+
+    _read = set(get_viewable_resources(user, Layer.objects.all()).values_list('alternate', flat=True))
+    _write = set(get_writable_layers(user).values_list('alternate', flat=True))
+    return _read, _write
+
+
+def get_layer_acls_version():
+    """
+    The current version of the cached ACLs, see 'invalidate_layer_acls'.
+    """
+    return _get_visible_resources_cache().get(LAYER_ACLS_VERSION_KEY) or 0
+
+
+def invalidate_layer_acls():
+    """
+    Expires all the cached ACL responses at once, by bumping their version.
+    """
+    cache = _get_visible_resources_cache()
+    try:
+        cache.incr(LAYER_ACLS_VERSION_KEY)
+    except ValueError:
+        cache.set(LAYER_ACLS_VERSION_KEY, 1, None)
+
+
+def invalidate_visible_resource_ids(user_ids=None, group_ids=None):
+    """
+    Drops the cached visible resource ids and writable layer ids of the given
+    users and groups, along with all the cached ACL responses.
+    """
+    keys = []
+    for _user_id in user_ids or []:
+        keys.append(VISIBLE_RESOURCES_USER_KEY.format(_user_id))
+        keys.append(VISIBLE_RESOURCES_USER_GROUPS_KEY.format(_user_id))
+        keys.append(WRITABLE_LAYERS_USER_KEY.format(_user_id))
+    for _group_id in group_ids or []:
+        keys.append(VISIBLE_RESOURCES_GROUP_KEY.format(_group_id))
+        keys.append(WRITABLE_LAYERS_GROUP_KEY.format(_group_id))
+    if keys:
+        _get_visible_resources_cache().delete_many(keys)
+        invalidate_layer_acls()
+
+
 def get_users_with_perms(obj):
     """
     Override of the Guardian get_users_with_perms
@@ -221,18 +473,17 @@ def purge_geofence_all():
     if settings.OGC_SERVER['default']['GEOFENCE_SECURITY_ENABLED']:
         try:
             url = settings.OGC_SERVER['default']['LOCATION']
-            user = settings.OGC_SERVER['default']['USER']
-            passwd = settings.OGC_SERVER['default']['PASSWORD']
             """
             curl -X GET -u admin:geoserver -H "Content-Type: application/json" \
                   http://<host>:<port>/geoserver/rest/geofence/rules.json
             """
+            session = _get_geofence_session()
             headers = {'Content-type': 'application/json'}
-            r = requests.get(url + 'rest/geofence/rules.json',
-                             headers=headers,
-                             auth=HTTPBasicAuth(user, passwd),
-                             timeout=10,
-                             verify=False)
+            r = session.get(url + 'rest/geofence/rules.json',
+                            headers=headers,
+                            auth=_get_geofence_auth(),
+                            timeout=10,
+                            verify=False)
             if (r.status_code < 200 or r.status_code > 201):
                 logger.debug("Could not Retrieve GeoFence Rules")
             else:
@@ -242,16 +493,8 @@ def purge_geofence_all():
                     rules = rules_objs['rules']
                     if rules_count > 0:
                         # Delete GeoFence Rules associated to the Layer
-                        # curl -X DELETE -u admin:geoserver http://<host>:<port>/geoserver/rest/geofence/rules/id/{r_id}
-                        for i, rule in enumerate(rules):
-                            r = requests.delete(url + 'rest/geofence/rules/id/' + str(rule['id']),
-                                                headers=headers,
-                                                auth=HTTPBasicAuth(user, passwd))
-                            if (r.status_code < 200 or r.status_code > 201):
-                                msg = "Could not DELETE GeoServer Rule id[%s]" % rule['id']
-                                e = Exception(msg)
-                                logger.debug("Response [{}] : {}".format(r.status_code, r.text))
-                                raise e
+                        for rule in rules:
+                            _delete_geofence_rule(rule['id'], session=session)
                 except Exception:
                     logger.debug("Response [{}] : {}".format(r.status_code, r.text))
         except Exception:
@@ -262,46 +505,12 @@ def purge_geofence_all():
 @on_ogc_backend(geoserver.BACKEND_PACKAGE)
 def purge_geofence_layer_rules(resource):
     """purge layer existing GeoFence Cache Rules"""
-    # Scan GeoFence Rules associated to the Layer
-    """
-    curl -u admin:geoserver
-    http://<host>:<port>/geoserver/rest/geofence/rules.json?workspace=geonode&layer={layer}
-    """
-    url = settings.OGC_SERVER['default']['LOCATION']
-    user = settings.OGC_SERVER['default']['USER']
-    passwd = settings.OGC_SERVER['default']['PASSWORD']
-    headers = {'Content-type': 'application/json'}
     workspace = get_layer_workspace(resource.layer)
     try:
-        r = requests.get(
-            "{}rest/geofence/rules.json?workspace={}&layer={}".format(
-                url, workspace, resource.layer.name),
-            headers=headers,
-            auth=HTTPBasicAuth(user, passwd),
-            timeout=10,
-            verify=False
-        )
-        if (r.status_code >= 200 and r.status_code < 300):
-            gs_rules = r.json()
-            r_ids = []
-            if gs_rules and gs_rules['rules']:
-                for r in gs_rules['rules']:
-                    if r['layer'] and r['layer'] == resource.layer.name:
-                        r_ids.append(r['id'])
-
-            # Delete GeoFence Rules associated to the Layer
-            # curl -X DELETE -u admin:geoserver http://<host>:<port>/geoserver/rest/geofence/rules/id/{r_id}
-            for i, r_id in enumerate(r_ids):
-                r = requests.delete(
-                    url + 'rest/geofence/rules/id/' + str(r_id),
-                    headers=headers,
-                    auth=HTTPBasicAuth(user, passwd))
-                if (r.status_code < 200 or r.status_code > 201):
-                    msg = "Could not DELETE GeoServer Rule for Layer "
-                    msg = msg + str(resource.layer.name)
-                    e = Exception(msg)
-                    logger.debug("Response [{}] : {}".format(r.status_code, r.text))
-                    raise e
+        session = _get_geofence_session()
+        # Delete GeoFence Rules associated to the Layer
+        for rule in _get_geofence_layer_rules(resource.layer.name, workspace, session=session):
+            _delete_geofence_rule(rule['id'], session=session)
     except Exception as e:
         logger.exception(e)
 
@@ -533,12 +742,14 @@ def set_geofence_all(instance):
 
 
 @on_ogc_backend(geoserver.BACKEND_PACKAGE)
-def sync_geofence_with_guardian(layer, perms, user=None, group=None, group_perms=None):
+def sync_geofence_with_guardian(layer, perms, user=None, group=None, group_perms=None, geofence_rules=None):
     """
     Sync Guardian permissions to GeoFence.
+
+    The rules are added to 'geofence_rules' if given, and sent to GeoFence when
+    the caller applies them. Otherwise the missing rules are sent right away.
     """
-    _layer_name = layer.name if layer and hasattr(layer, 'name') else layer.alternate.split(":")[0]
-    _layer_workspace = get_layer_workspace(layer)
+    _rules = geofence_rules if geofence_rules is not None else GeofenceLayerRules(layer, purge=False)
     # Create new rule-set
     gf_services = {}
     gf_services["WMS"] = 'view_resourcebase' in perms or 'change_layer_style' in perms
@@ -616,7 +827,7 @@ def sync_geofence_with_guardian(layer, perms, user=None, group=None, group_perms
             'image/gif',
             'image/png8'
         ]
-    toggle_layer_cache('{}:{}'.format(_layer_workspace, _layer_name), enable=True, filters=filters, formats=formats)
+    _rules.set_layer_cache(filters=filters, formats=formats)
 
     for service, allowed in gf_services.items():
         if allowed:
@@ -627,9 +838,8 @@ def sync_geofence_with_guardian(layer, perms, user=None, group=None, group_perms
                     _wkt = users_geolimits.last().wkt
                 if service in gf_requests:
                     for request, enabled in gf_requests[service].items():
-                        _update_geofence_rule(layer, _layer_name, _layer_workspace,
-                                              service, request=request, user=_user, allow=enabled)
-                _update_geofence_rule(layer, _layer_name, _layer_workspace, service, user=_user, geo_limit=_wkt)
+                        _rules.add(service, request=request, user=_user, allow=enabled)
+                _rules.add(service, user=_user, geo_limit=_wkt)
             elif not _group:
                 logger.debug("Adding to geofence the rule: %s %s *" % (layer, service))
                 _wkt = None
@@ -637,13 +847,8 @@ def sync_geofence_with_guardian(layer, perms, user=None, group=None, group_perms
                     _wkt = anonymous_geolimits.last().wkt
                 if service in gf_requests:
                     for request, enabled in gf_requests[service].items():
-                        _update_geofence_rule(layer, _layer_name, _layer_workspace,
-                                              service, request=request, user=_user, allow=enabled)
-                _update_geofence_rule(layer, _layer_name, _layer_workspace, service, geo_limit=_wkt)
-                if service in gf_requests:
-                    for request, enabled in gf_requests[service].items():
-                        _update_geofence_rule(layer, _layer_name, _layer_workspace,
-                                              service, request=request, user=_user, allow=enabled)
+                        _rules.add(service, request=request, user=_user, allow=enabled)
+                _rules.add(service, geo_limit=_wkt)
             if _group:
                 logger.debug("Adding 'group' to geofence the rule: %s %s %s" % (layer, service, _group))
                 _wkt = None
@@ -651,17 +856,10 @@ def sync_geofence_with_guardian(layer, perms, user=None, group=None, group_perms
                     _wkt = groups_geolimits.last().wkt
                 if service in gf_requests:
                     for request, enabled in gf_requests[service].items():
-                        _update_geofence_rule(layer, _layer_name, _layer_workspace,
-                                              service, request=request, group=_group, allow=enabled)
-                _update_geofence_rule(layer, _layer_name, _layer_workspace, service, group=_group, geo_limit=_wkt)
-                if service in gf_requests:
-                    for request, enabled in gf_requests[service].items():
-                        _update_geofence_rule(layer, _layer_name, _layer_workspace,
-                                              service, request=request, group=_group, allow=enabled)
-    if not getattr(settings, 'DELAYED_SECURITY_SIGNALS', False):
-        set_geofence_invalidate_cache()
-    else:
-        layer.set_dirty_state()
+                        _rules.add(service, request=request, group=_group, allow=enabled)
+                _rules.add(service, group=_group, geo_limit=_wkt)
+    if geofence_rules is None:
+        _rules.apply()
 
 
 def set_owner_permissions(resource, members=None):
@@ -688,11 +886,12 @@ def set_owner_permissions(resource, members=None):
                         assign_perm(perm, user, resource.layer)
 
 
-def remove_object_permissions(instance):
+def remove_object_permissions(instance, purge=True):
     """Remove object permissions on given resource.
 
     If is a layer removes the layer specific permissions then the
-    resourcebase permissions
+    resourcebase permissions. Its GeoFence Rules are purged too, unless
+    'purge' is False, when the caller syncs them right after.
 
     """
     from guardian.models import UserObjectPermission, GroupObjectPermission
@@ -708,7 +907,7 @@ def remove_object_permissions(instance):
                 object_pk=instance.id
             ).delete()
             if settings.OGC_SERVER['default']['GEOFENCE_SECURITY_ENABLED']:
-                if not getattr(settings, 'DELAYED_SECURITY_SIGNALS', False):
+                if purge and not getattr(settings, 'DELAYED_SECURITY_SIGNALS', False):
                     purge_geofence_layer_rules(resource)
                     set_geofence_invalidate_cache()
             else:
@@ -725,8 +924,8 @@ def remove_object_permissions(instance):
 
 
 def _get_geofence_payload(layer, layer_name, workspace, access, user=None, group=None,
-                          service=None, request=None, geo_limit=None):
-    highest_priority = get_highest_priority()
+                          service=None, request=None, geo_limit=None, priority=None):
+    highest_priority = priority if priority is not None else get_highest_priority()
     root_el = etree.Element("Rule")
     username_el = etree.SubElement(root_el, "userName")
     if user is not None:
@@ -762,82 +961,354 @@ def _get_geofence_payload(layer, layer_name, workspace, access, user=None, group
     return etree.tostring(root_el)
 
 
-def _update_geofence_rule(layer, layer_name, workspace,
-                          service, request=None,
-                          user=None, group=None,
-                          geo_limit=None, allow=True):
-    payload = _get_geofence_payload(
-        layer=layer,
-        layer_name=layer_name,
-        workspace=workspace,
-        access="ALLOW" if allow else "DENY",
-        user=user,
-        group=group,
-        service=service,
-        request=request,
-        geo_limit=geo_limit
+def _get_geofence_session():
+    """The pooled HTTP session of the current thread to the GeoFence REST API"""
+    return http_client.get_session(settings.OGC_SERVER['default']['LOCATION'])
+
+
+def _get_geofence_auth():
+    return HTTPBasicAuth(
+        username=settings.OGC_SERVER['default']['USER'],
+        password=settings.OGC_SERVER['default']['PASSWORD'])
+
+
+def _get_geofence_layer_rules(layer_name, workspace, session=None):
+    """Get the GeoFence Rules of a Layer with a single request"""
+    """
+    curl -u admin:geoserver
+    http://<host>:<port>/geoserver/rest/geofence/rules.json?workspace=geonode&layer={layer}
+    """
+    session = session or _get_geofence_session()
+    r = session.get(
+        "{}rest/geofence/rules.json?workspace={}&layer={}".format(
+            settings.OGC_SERVER['default']['LOCATION'], workspace, layer_name),
+        headers={'Content-type': 'application/json'},
+        auth=_get_geofence_auth(),
+        timeout=10,
+        verify=False
     )
-    logger.debug("request data: {}".format(payload))
-    response = requests.post(
-        "{base_url}rest/geofence/rules".format(
-            base_url=settings.OGC_SERVER['default']['LOCATION']),
-        data=payload,
-        headers={
-            'Content-type': 'application/xml'
-        },
-        auth=HTTPBasicAuth(
-            username=settings.OGC_SERVER['default']['USER'],
-            password=settings.OGC_SERVER['default']['PASSWORD']
+    if r.status_code < 200 or r.status_code >= 300:
+        raise RuntimeError("Could not retrieve GeoFence Rules for Layer {}".format(layer_name))
+    gs_rules = r.json()
+    return [rule for rule in (gs_rules and gs_rules.get('rules')) or [] if rule.get('layer') == layer_name]
+
+
+def _delete_geofence_rule(rule_id, session=None):
+    # curl -X DELETE -u admin:geoserver http://<host>:<port>/geoserver/rest/geofence/rules/id/{r_id}
+    session = session or _get_geofence_session()
+    r = session.delete(
+        settings.OGC_SERVER['default']['LOCATION'] + 'rest/geofence/rules/id/' + str(rule_id),
+        headers={'Content-type': 'application/json'},
+        auth=_get_geofence_auth())
+    if r.status_code < 200 or r.status_code > 201:
+        logger.debug("Response [{}] : {}".format(r.status_code, r.text))
+        raise RuntimeError("Could not DELETE GeoServer Rule id[%s]" % rule_id)
+
+
+def _get_geofence_rule_key(user=None, role=None, service=None, request=None, access=None, allowed_area=None):
+    """The fields identifying a GeoFence Rule of a Layer, apart from its priority"""
+    def _normalize(value):
+        return value if value not in (None, '', '*') else None
+
+    if allowed_area:
+        allowed_area = ' '.join(re.sub(r'^SRID=\d+;', '', allowed_area).split())
+    return (_normalize(user), _normalize(role), _normalize(service), _normalize(request),
+            access, _normalize(allowed_area))
+
+
+class GeofenceLayerRules(object):
+    """
+    The GeoFence Rules of a Layer, as computed from the guardian permissions.
+
+    The rules are collected by 'add', then 'apply' fetches the current rules of the
+    Layer with a single request and sends only the missing rules, along with the
+    deletion of the stale ones if 'purge' is set. The priorities of the new rules
+    are allocated locally, after the highest one which is queried once.
+    """
+
+    def __init__(self, layer, purge=True):
+        self.layer = layer
+        self.layer_name = layer.name if layer and hasattr(layer, 'name') else layer.alternate.split(":")[0]
+        self.workspace = get_layer_workspace(layer)
+        self.purge = purge
+        self.rules = OrderedDict()
+        self.layer_cache = None
+
+    def add(self, service, request=None, user=None, group=None, geo_limit=None, allow=True):
+        access = "ALLOW" if allow else "DENY"
+        allowed_area = None
+        if service == "*" and geo_limit:
+            access = "LIMIT"
+            allowed_area = geo_limit
+        key = _get_geofence_rule_key(
+            user=user,
+            role="ROLE_{}".format(group.upper()) if group is not None else None,
+            service=service,
+            request=request,
+            access=access,
+            allowed_area=allowed_area)
+        if key not in self.rules:
+            self.rules[key] = dict(
+                service=service, request=request, user=user, group=group,
+                geo_limit=geo_limit, access="ALLOW" if allow else "DENY")
+
+    def set_layer_cache(self, filters=None, formats=None):
+        """Set the GeoWebCache configuration of the Layer, applied along with the rules"""
+        self.layer_cache = (filters, formats)
+
+    def apply(self, invalidate_cache=True):
+        """
+        Send the differences with the current rules of the Layer to GeoFence.
+
+        If 'invalidate_cache' is False the GeoFence rules cache is left to the
+        caller, which invalidates it once for several Layers.
+
+        :return: True if any rule has been added or deleted.
+        """
+        if self.layer_cache is not None:
+            filters, formats = self.layer_cache
+            toggle_layer_cache(
+                '{}:{}'.format(self.workspace, self.layer_name), enable=True, filters=filters, formats=formats)
+
+        session = _get_geofence_session()
+        current = OrderedDict()
+        try:
+            for rule in _get_geofence_layer_rules(self.layer_name, self.workspace, session=session):
+                key = _get_geofence_rule_key(
+                    user=rule.get('userName'),
+                    role=rule.get('roleName'),
+                    service=rule.get('service'),
+                    request=rule.get('request'),
+                    access=rule.get('access'),
+                    allowed_area=(rule.get('limits') or {}).get('allowedArea'))
+                current.setdefault(key, []).append(rule['id'])
+        except Exception as e:
+            # GeoFence rejects the duplicated rules anyway
+            logger.debug(e)
+
+        # GeoFence applies the first matching rule, so the service rules of a
+        # principal must follow its request rules: whenever the request rules
+        # of a user or role change, its service rules are deleted and re-added
+        # after them, as on a full re-sync.
+        def _request_rules(rules, principal):
+            return set(key for key in rules if key[:2] == principal and key[3] is not None)
+
+        reordered = set()
+        for principal in set(key[:2] for key in list(current) + list(self.rules)):
+            desired = _request_rules(self.rules, principal)
+            existing = _request_rules(current, principal)
+            if (desired != existing) if self.purge else (desired - existing):
+                reordered.add(principal)
+
+        def _moved(key):
+            return key[:2] in reordered and key[3] is None and key in self.rules
+
+        to_delete = []
+        for key, rule_ids in current.items():
+            if _moved(key):
+                to_delete.extend(rule_ids)
+            elif self.purge:
+                to_delete.extend(rule_ids if key not in self.rules else rule_ids[1:])
+        to_add = [rule for key, rule in self.rules.items() if key not in current or _moved(key)]
+        if not to_delete and not to_add:
+            return False
+
+        try:
+            for rule_id in to_delete:
+                _delete_geofence_rule(rule_id, session=session)
+            if to_add:
+                highest_priority = max(get_highest_priority(), 0)
+                for index, rule in enumerate(to_add):
+                    self._add_rule(session, highest_priority + index, **rule)
+        finally:
+            if invalidate_cache:
+                if not getattr(settings, 'DELAYED_SECURITY_SIGNALS', False):
+                    set_geofence_invalidate_cache()
+                else:
+                    self.layer.set_dirty_state()
+        return True
+
+    def _add_rule(self, session, priority, service, request=None, user=None, group=None,
+                  geo_limit=None, access="ALLOW"):
+        payload = _get_geofence_payload(
+            layer=self.layer,
+            layer_name=self.layer_name,
+            workspace=self.workspace,
+            access=access,
+            user=user,
+            group=group,
+            service=service,
+            request=request,
+            geo_limit=geo_limit,
+            priority=priority
         )
-    )
-    logger.debug("response status_code: {}".format(response.status_code))
-    if response.status_code not in (200, 201):
-        msg = ("Could not ADD GeoServer User {!r} Rule for "
-               "Layer {!r}: '{!r}'".format(user, layer, response.text))
-        if 'Duplicate Rule' in response.text:
-            logger.debug(msg)
-        else:
-            raise RuntimeError(msg)
+        logger.debug("request data: {}".format(payload))
+        response = session.post(
+            "{base_url}rest/geofence/rules".format(
+                base_url=settings.OGC_SERVER['default']['LOCATION']),
+            data=payload,
+            headers={
+                'Content-type': 'application/xml'
+            },
+            auth=_get_geofence_auth()
+        )
+        logger.debug("response status_code: {}".format(response.status_code))
+        if response.status_code not in (200, 201):
+            msg = ("Could not ADD GeoServer User {!r} Rule for "
+                   "Layer {!r}: '{!r}'".format(user, self.layer, response.text))
+            if 'Duplicate Rule' in response.text:
+                logger.debug(msg)
+            else:
+                raise RuntimeError(msg)
 
 
-def sync_resources_with_guardian(resource=None):
+def get_security_sync_progress():
     """
-    Sync resources with Guardian and clear their dirty state
+    Progress and throughput of the current sync of the dirty resources with Guardian.
+
+    :return: The number of resources to sync, synced and failed, the elapsed seconds
+        and the synced resources per second; None if no sync has been started.
+    """
+    keys = dict(
+        (SECURITY_SYNC_PROGRESS_KEY.format(_field), _field)
+        for _field in ('started', 'total', 'synced', 'failed'))
+    progress = dict((keys[key], value) for key, value in cache.get_many(list(keys)).items())
+    if progress.get('started') is None:
+        return None
+    synced = progress.get('synced', 0)
+    failed = progress.get('failed', 0)
+    elapsed = max(time.time() - progress['started'], 0.001)
+    return {
+        'total': progress.get('total', 0),
+        'synced': synced,
+        'failed': failed,
+        'elapsed': elapsed,
+        'throughput': (synced + failed) / elapsed,
+    }
+
+
+def start_security_sync_progress(total):
+    """Reset the progress of the sync of the dirty resources with Guardian"""
+    cache.set_many({
+        SECURITY_SYNC_PROGRESS_KEY.format('started'): time.time(),
+        SECURITY_SYNC_PROGRESS_KEY.format('total'): total,
+        SECURITY_SYNC_PROGRESS_KEY.format('synced'): 0,
+        SECURITY_SYNC_PROGRESS_KEY.format('failed'): 0,
+    }, None)
+
+
+def _incr_security_sync_progress(field, delta):
+    if delta:
+        try:
+            cache.incr(SECURITY_SYNC_PROGRESS_KEY.format(field), delta)
+        except ValueError:
+            # no sync in progress
+            pass
+
+
+def get_dirty_layers_chunks(chunk_size=None):
+    """
+    Split the ids of the dirty Layers in chunks of 'SECURITY_SYNC_CHUNK_SIZE' ids.
+    """
+    from geonode.layers.models import Layer
+
+    chunk_size = chunk_size or getattr(settings, 'SECURITY_SYNC_CHUNK_SIZE', 100)
+    ids = list(Layer.objects.filter(dirty_state=True).order_by('id').values_list('id', flat=True))
+    return [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+
+
+def sync_layers_with_guardian(layer_ids):
     """
+    Sync a chunk of Layers with Guardian and clear their dirty state.
 
+    The users and groups of the permissions of all the Layers are fetched with
+    one query each, and the GeoFence rules cache is invalidated once per chunk.
+    The dirty state of a Layer is cleared right after its sync, unless it has
+    been updated since its permissions were read.
+
+    :return: The number of Layers synced and failed.
+    """
     from geonode.base.models import ResourceBase
     from geonode.layers.models import Layer
 
+    _start = time.time()
+    perm_specs = []
+    usernames = set()
+    group_names = set()
+    for layer in Layer.objects.filter(id__in=layer_ids):
+        try:
+            perm_spec = layer.get_all_level_info()
+            usernames.update(str(user) for user in perm_spec.get('users', {}))
+            group_names.update(str(group) for group in perm_spec.get('groups', {}))
+        except Exception as e:
+            logger.exception(e)
+            perm_spec = None
+        perm_specs.append((layer, perm_spec))
+    users = dict(
+        (user.username, user) for user in get_user_model().objects.filter(username__in=usernames))
+    groups = dict(
+        (group.name, group) for group in Group.objects.filter(name__in=group_names))
+
+    synced = []
+    failed = 0
+    changed = False
+    for layer, perm_spec in perm_specs:
+        try:
+            if perm_spec is None:
+                raise RuntimeError("Could not retrieve the permissions of Layer {}".format(layer))
+            logger.debug(" %s --------------------------- %s " % (layer, perm_spec))
+            geofence_rules = GeofenceLayerRules(layer)
+            # All the other users
+            for user, perms in perm_spec.get('users', {}).items():
+                user = users[str(user)]
+                # Set the GeoFence User Rules
+                geofence_user = str(user)
+                if "AnonymousUser" in geofence_user:
+                    geofence_user = None
+                sync_geofence_with_guardian(
+                    layer, perms, user=geofence_user, geofence_rules=geofence_rules)
+            # All the other groups
+            for group, perms in perm_spec.get('groups', {}).items():
+                group = groups[str(group)]
+                # Set the GeoFence Group Rules
+                sync_geofence_with_guardian(
+                    layer, perms, group=group, geofence_rules=geofence_rules)
+            changed = geofence_rules.apply(invalidate_cache=False) or changed
+            # Do not trigger the post_save signals of the Layer
+            ResourceBase.objects.filter(
+                id=layer.id, last_updated=layer.last_updated).update(dirty_state=False)
+            synced.append(layer.id)
+        except Exception as e:
+            failed += 1
+            logger.exception(e)
+            logger.warn("!WARNING! - Failure Synching-up Security Rules for Resource [%s]" % (layer))
+
+    if changed:
+        set_geofence_invalidate_cache()
+
+    _incr_security_sync_progress('synced', len(synced))
+    _incr_security_sync_progress('failed', failed)
+    _elapsed = max(time.time() - _start, 0.001)
+    logger.info("Synced {} Layers with Guardian in {:.2f}s ({:.2f} Layers/s), {} failed".format(
+        len(synced), _elapsed, len(synced) / _elapsed, failed))
+    return len(synced), failed
+
+
+def sync_resources_with_guardian(resource=None):
+    """
+    Sync resources with Guardian and clear their dirty state
+
+    The dirty Layers are synced in chunks of 'SECURITY_SYNC_CHUNK_SIZE', see also
+    the 'synch_guardian' task which distributes the chunks among the workers.
+    """
     if resource:
-        dirty_resources = ResourceBase.objects.filter(id=resource.id)
-    else:
-        dirty_resources = ResourceBase.objects.filter(dirty_state=True)
-    if dirty_resources and dirty_resources.count() > 0:
+        if resource.polymorphic_ctype.name == 'layer':
+            sync_layers_with_guardian([resource.id])
+        return
+
+    chunks = get_dirty_layers_chunks()
+    if chunks:
         logger.debug(" --------------------------- synching with guardian!")
-        for r in dirty_resources:
-            if r.polymorphic_ctype.name == 'layer':
-                layer = None
-                try:
-                    purge_geofence_layer_rules(r)
-                    layer = Layer.objects.get(id=r.id)
-                    perm_spec = layer.get_all_level_info()
-                    logger.debug(" %s --------------------------- %s " % (layer, perm_spec))
-                    # All the other users
-                    if 'users' in perm_spec:
-                        for user, perms in perm_spec['users'].items():
-                            user = get_user_model().objects.get(username=user)
-                            # Set the GeoFence User Rules
-                            geofence_user = str(user)
-                            if "AnonymousUser" in geofence_user:
-                                geofence_user = None
-                            sync_geofence_with_guardian(layer, perms, user=geofence_user)
-                    # All the other groups
-                    if 'groups' in perm_spec:
-                        for group, perms in perm_spec['groups'].items():
-                            group = Group.objects.get(name=group)
-                            # Set the GeoFence Group Rules
-                            sync_geofence_with_guardian(layer, perms, group=group)
-                    r.clear_dirty_state()
-                except Exception as e:
-                    logger.exception(e)
-                    logger.warn("!WARNING! - Failure Synching-up Security Rules for Resource [%s]" % (r))
+        start_security_sync_progress(sum(len(chunk) for chunk in chunks))
+        for chunk in chunks:
+            sync_layers_with_guardian(chunk)
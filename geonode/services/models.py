@@ -20,7 +20,9 @@
 
 import logging
 from django.db import models
+from django.db.models import signals
 from django.conf import settings
+from django.core.cache import cache
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
 from geonode.base.models import ResourceBase
@@ -173,15 +175,49 @@ class Service(ResourceBase):
     def get_absolute_url(self):
         return '/services/%i' % self.id
 
-    def probe_service(self):
+    def probe_service(self, timeout=None, retries=None):
         from geonode.utils import http_client
         try:
-            resp, content = http_client.request(self.service_url)
+            resp, content = http_client.request(self.service_url, timeout=timeout, retries=retries)
             return resp.status_code
         except Exception:
             return 404
 
 
+REMOTE_SOURCES_CACHE_KEY = 'remote_services_sources'
+
+
+def get_remote_sources():
+    """
+    Returns the GXP sources configuration of the registered remote services.
+
+    The list is shared by all the map viewers, hence it is cached until a
+    service is saved or deleted, instead of being rebuilt for every map.
+    """
+    sources = cache.get(REMOTE_SOURCES_CACHE_KEY)
+    if sources is None:
+        sources = [
+            {
+                'url': service.service_url,
+                'remote': True,
+                'ptype': service.ptype,
+                'name': service.name,
+                'title': "[R] %s" % service.title
+            } for service in Service.objects.only(
+                'id', 'base_url', 'proxy_base', 'type', 'name', 'title')
+        ]
+        cache.set(REMOTE_SOURCES_CACHE_KEY, sources)
+    return sources
+
+
+def invalidate_remote_sources(instance, sender, **kwargs):
+    cache.delete(REMOTE_SOURCES_CACHE_KEY)
+
+
+signals.post_save.connect(invalidate_remote_sources, sender=Service)
+signals.post_delete.connect(invalidate_remote_sources, sender=Service)
+
+
 class ServiceProfileRole(models.Model):
 
     """
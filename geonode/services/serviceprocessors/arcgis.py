@@ -69,7 +69,7 @@ class ArcMapServiceHandler(base.ServiceHandlerBase):
         base.ServiceHandlerBase.__init__(self, url)
         self.proxy_base = None
         self.url = url
-        self.parsed_service = ArcMapService(self.url)
+        self.parsed_service = self._get_parsed_service(ArcMapService)
         extent, srs = utils.get_esri_extent(self.parsed_service)
         try:
             _sname = utils.get_esri_service_name(self.url)
@@ -91,6 +91,24 @@ class ArcMapServiceHandler(base.ServiceHandlerBase):
         self.name = slugify(self.url)[:255]
         self.title = _title
 
+    def _get_parsed_service(self, service_class):
+        """Return the service, with the JSON description shared through the
+        capabilities cache
+        """
+        service = service_class(self.url)
+
+        def parse(content):
+            service.__urldata__ = content
+            return service
+
+        try:
+            return base.get_parsed_capabilities(
+                service.url, parse, kind=service_class.__name__)
+        except Exception as e:
+            # let the service fetch its description by itself
+            logger.debug(e)
+            return service
+
     def create_cascaded_store(self):
         return None
 
@@ -317,7 +335,7 @@ class ArcImageServiceHandler(ArcMapServiceHandler):
         ArcMapServiceHandler.__init__(self, url)
         self.proxy_base = None
         self.url = url
-        self.parsed_service = ArcImageService(self.url)
+        self.parsed_service = self._get_parsed_service(ArcImageService)
         extent, srs = utils.get_esri_extent(self.parsed_service)
         try:
             _sname = utils.get_esri_service_name(self.url)
@@ -19,11 +19,19 @@
 
 """Remote service handling base classes and helpers."""
 
+import time
+import hashlib
 import logging
+import requests
+import threading
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.urls import reverse
 from six.moves.urllib.parse import urlencode, urlparse, urljoin, parse_qs, urlunparse
 
@@ -40,6 +48,13 @@ else:
 
 logger = logging.getLogger(__name__)
 
+CAPABILITIES_CACHE_KEY = 'service_capabilities_{}'
+# Number of parsed capabilities documents kept by each process
+PARSED_CAPABILITIES_MAX_SIZE = 16
+
+_parsed_capabilities = OrderedDict()
+_parsed_capabilities_lock = threading.Lock()
+
 
 def get_proxified_ows_url(url, version=None, proxy_base=None):
     """
@@ -86,6 +101,60 @@ def get_proxified_ows_url(url, version=None, proxy_base=None):
     return (version, proxified_url, base_ows_url)
 
 
+def get_capabilities(url, headers=None, timeout=None):
+    """Return the content of the capabilities document of a remote service
+
+    The document is cached along with its ETag and Last-Modified headers. It is
+    returned as is for 'CAPABILITIES_CACHE_MAX_AGE' seconds, then revalidated
+    with a conditional request, so that it is downloaded again only if changed.
+    """
+    key = CAPABILITIES_CACHE_KEY.format(hashlib.md5(url.encode('utf-8')).hexdigest())
+    cached = cache.get(key)
+    if cached and time.time() - cached['checked'] < getattr(settings, 'CAPABILITIES_CACHE_MAX_AGE', 60):
+        return cached['content']
+
+    request_headers = dict(headers or {})
+    if cached:
+        if cached['etag']:
+            request_headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            request_headers['If-Modified-Since'] = cached['last_modified']
+    response = requests.get(url, headers=request_headers, timeout=timeout)
+    if cached and response.status_code == 304:
+        content = cached['content']
+    else:
+        response.raise_for_status()
+        content = response.content
+        cached = {
+            'content': content,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+    cached['checked'] = time.time()
+    cache.set(key, cached, getattr(settings, 'CAPABILITIES_CACHE_TIMEOUT', 86400))
+    return content
+
+
+def get_parsed_capabilities(url, parse, kind, headers=None, timeout=None):
+    """Return the capabilities document of a remote service, parsed by 'parse'
+
+    Each process parses a document once, and shares the parsed object among the
+    handlers of the service until the document changes.
+    """
+    content = get_capabilities(url, headers=headers, timeout=timeout)
+    key = (kind, url, hashlib.md5(content).hexdigest())
+    with _parsed_capabilities_lock:
+        if key in _parsed_capabilities:
+            _parsed_capabilities.move_to_end(key)
+            return _parsed_capabilities[key]
+    parsed = parse(content)
+    with _parsed_capabilities_lock:
+        _parsed_capabilities[key] = parsed
+        while len(_parsed_capabilities) > PARSED_CAPABILITIES_MAX_SIZE:
+            _parsed_capabilities.popitem(last=False)
+    return parsed
+
+
 def get_geoserver_cascading_workspace(create=True):
     """Return the geoserver workspace used for cascaded services
     The workspace can be created it if needed.
@@ -111,6 +180,8 @@ class ServiceHandlerBase(object):
     service_type = None
     name = ""
     indexing_method = None
+    # layers whose thumbnails are rendered at the end of a batch harvest
+    _deferred_thumbnails = None
 
     def __init__(self, url):
         self.url = url
@@ -155,6 +226,58 @@ class ServiceHandlerBase(object):
 
         raise NotImplementedError
 
+    def harvest_resources(self, resource_ids, geonode_service):
+        """Harvest several resources of the service in a batch
+
+        The resources are harvested in a single transaction, each one in its
+        own savepoint so that a failure does not roll back the others. Their
+        thumbnails are rendered concurrently once the transaction is committed.
+
+        :arg resource_ids: The resources' identifiers
+        :type resource_ids: list
+        :arg geonode_service: The already saved service instance
+        :type geonode_service: geonode.services.models.Service
+        :return: The error message of each resource which failed
+        :rtype: dict
+        """
+        errors = {}
+        self._deferred_thumbnails = []
+        try:
+            with transaction.atomic():
+                for resource_id in resource_ids:
+                    try:
+                        with transaction.atomic():
+                            self.harvest_resource(resource_id, geonode_service)
+                    except Exception as e:
+                        logger.exception(
+                            msg="An error has occurred while harvesting resource {!r}".format(resource_id))
+                        errors[resource_id] = str(e)
+            self._create_deferred_thumbnails(self._deferred_thumbnails)
+        finally:
+            self._deferred_thumbnails = None
+        return errors
+
+    def _harvest_layer_thumbnail(self, geonode_layer):
+        if self._deferred_thumbnails is not None:
+            self._deferred_thumbnails.append(geonode_layer)
+        else:
+            self._create_layer_thumbnail(geonode_layer)
+
+    def _create_deferred_thumbnails(self, geonode_layers):
+        def create_thumbnail(geonode_layer):
+            try:
+                self._create_layer_thumbnail(geonode_layer)
+            except Exception as e:
+                logger.error(e)
+            finally:
+                # the worker threads must not leak their database connections
+                connection.close()
+
+        if geonode_layers:
+            workers = getattr(settings, 'HARVEST_THUMBNAIL_WORKERS', 4)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(create_thumbnail, geonode_layers))
+
     def has_resources(self):
         raise NotImplementedError
 
@@ -49,6 +49,7 @@ from geonode.utils import http_client
 from geonode.base.bbox_utils import BBOXHelper
 
 from owslib.map import wms111, wms130
+from owslib.map.common import WMSCapabilitiesReader
 from owslib.util import clean_ows_url
 
 from .. import enumerations
@@ -153,14 +154,29 @@ class WmsServiceHandler(base.ServiceHandlerBase,
 
     @property
     def parsed_service(self):
-        cleaned_url, service, version, request = WmsServiceHandler.get_cleaned_url_params(self.url)
-        ogc_server_settings = settings.OGC_SERVER['default']
-        _url, _parsed_service = WebMapService(
-            cleaned_url,
-            version=version,
-            proxy_base=None,
-            timeout=ogc_server_settings.get('TIMEOUT', 60))
-        return _parsed_service
+        """The parsed capabilities document, fetched once by each handler and
+        shared through the capabilities cache
+        """
+        if self._parsed_service is None:
+            cleaned_url, service, version, request = WmsServiceHandler.get_cleaned_url_params(self.url)
+            ogc_server_settings = settings.OGC_SERVER['default']
+            timeout = ogc_server_settings.get('TIMEOUT', 60)
+
+            def parse(xml):
+                _url, _parsed_service = WebMapService(
+                    cleaned_url,
+                    version=version,
+                    xml=xml,
+                    proxy_base=None,
+                    timeout=timeout)
+                return _parsed_service
+
+            self._parsed_service = base.get_parsed_capabilities(
+                WMSCapabilitiesReader(version).capabilities_url(cleaned_url),
+                parse,
+                kind='WMS',
+                timeout=timeout)
+        return self._parsed_service
 
     def create_cascaded_store(self):
         store = self._get_store(create=True)
@@ -249,7 +265,7 @@ class WmsServiceHandler(base.ServiceHandlerBase,
             geonode_layer = self._create_layer(geonode_service, **resource_fields)
             self._create_layer_service_link(geonode_layer)
             self._create_layer_legend_link(geonode_layer)
-            self._create_layer_thumbnail(geonode_layer)
+            self._harvest_layer_thumbnail(geonode_layer)
         except Exception as e:
             logger.error(e)
 
@@ -487,12 +503,11 @@ class GeoNodeServiceHandler(WmsServiceHandler):
     def __init__(self, url):
         self.proxy_base = urljoin(
             settings.SITEURL, reverse('proxy'))
-        ogc_server_settings = settings.OGC_SERVER['default']
         url = self._probe_geonode_wms(url)
-        self.url, _ = WebMapService(
-            url,
-            proxy_base=self.proxy_base,
-            timeout=ogc_server_settings.get('TIMEOUT', 60))
+        # The capabilities document is fetched only once, by parsed_service
+        _version, _proxified_url, self.url = base.get_proxified_ows_url(
+            url, version='1.3.0', proxy_base=self.proxy_base)
+        self._parsed_service = None
         self.indexing_method = (
             INDEXED if self._offers_geonode_projection() else CASCADED)
         self.name = slugify(self.url)[:255]
@@ -623,9 +638,9 @@ class GeoNodeServiceHandler(WmsServiceHandler):
                                 geonode_layer.save_thumbnail(
                                     thumbnail_name, image=image)
                             else:
-                                self._create_layer_thumbnail(geonode_layer)
+                                self._harvest_layer_thumbnail(geonode_layer)
                         else:
-                            self._create_layer_thumbnail(geonode_layer)
+                            self._harvest_layer_thumbnail(geonode_layer)
 
                         # Add Keywords
                         if "keywords" in _layer and _layer["keywords"]:
@@ -24,6 +24,7 @@ import logging
 from . import models
 from . import enumerations
 from .serviceprocessors import get_service_handler
+from .utils import probe_services as probe_remote_services
 
 from geonode.celery_app import app
 from geonode.layers.models import Layer
@@ -81,6 +82,64 @@ def harvest_resource(self, harvest_job_id):
         )
 
 
+@app.task(
+    bind=True,
+    name='geonode.services.tasks.harvest_resources',
+    queue='update',
+    countdown=60,
+    acks_late=True,
+    retry=True,
+    retry_policy={
+        'max_retries': 10,
+        'interval_start': 0,
+        'interval_step': 0.2,
+        'interval_max': 0.2,
+    })
+def harvest_resources(self, harvest_job_ids):
+    """Harvest in a batch the resources of the harvest jobs of a service
+
+    The service handler is set up once, and the resources are harvested in a
+    single transaction by ``harvest_resources`` of the handler.
+    """
+    harvest_jobs = list(models.HarvestJob.objects.filter(
+        pk__in=harvest_job_ids).select_related('service'))
+    if not harvest_jobs:
+        return
+    service = harvest_jobs[0].service
+    for harvest_job in harvest_jobs:
+        harvest_job.update_status(
+            status=enumerations.IN_PROCESS, details="Harvesting resource...")
+    try:
+        handler = get_service_handler(
+            base_url=service.base_url,
+            proxy_base=service.proxy_base,
+            service_type=service.type
+        )
+        errors = handler.harvest_resources(
+            [harvest_job.resource_id for harvest_job in harvest_jobs], service)
+    except Exception as err:
+        logger.exception(msg="An error has occurred while harvesting "
+                             "the resources of the service {!r}".format(service.base_url))
+        errors = dict((harvest_job.resource_id, str(err)) for harvest_job in harvest_jobs)
+
+    for harvest_job in harvest_jobs:
+        result = False
+        details = errors.get(harvest_job.resource_id, "")
+        if harvest_job.resource_id not in errors:
+            try:
+                layer = Layer.objects.filter(alternate=harvest_job.resource_id).first()
+                if layer:
+                    layer.save(notify=True)
+                    result = True
+            except Exception as err:
+                logger.error(err)
+                details = str(err)
+        harvest_job.update_status(
+            status=enumerations.PROCESSED if result else enumerations.FAILED,
+            details=details
+        )
+
+
 @app.task(
     bind=True,
     name='geonode.services.tasks.probe_services',
@@ -106,9 +165,10 @@ def probe_services(self):
     lock_id = f'{name.decode()}-lock-{hexdigest}'
     lock = memcache_lock(lock_id)
     if lock.acquire(blocking=False) is True:
-        for service in models.Service.objects.all():
-            try:
-                service.probe = service.probe_service()
-                service.save()
-            except Exception as e:
-                logger.error(e)
+        try:
+            changed = probe_remote_services(list(models.Service.objects.all()))
+            models.Service.objects.bulk_update(changed, ['probe'])
+        except Exception as e:
+            logger.error(e)
+        finally:
+            lock.release()
@@ -18,8 +18,12 @@
 #
 #########################################################################
 
+import time
+import threading
+
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
 from django.test import Client
+from django.test.utils import override_settings
 from selenium import webdriver
 from unittest import TestCase as StandardTestCase
 from flaky import flaky
@@ -33,7 +37,7 @@ except ImportError:
     import mock
 from owslib.map.wms111 import ContentMetadata
 
-from geonode.services.utils import test_resource_table_status
+from geonode.services.utils import test_resource_table_status, probe_services
 from geonode.tests.base import GeoNodeBaseTestSupport
 from . import enumerations, forms
 from .models import Service
@@ -100,6 +104,102 @@ class ModuleFunctionsTestCase(StandardTestCase):
             "http://www.geonode.org/{}".format(mock_settings.CASCADE_WORKSPACE)
         )
 
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'capabilities-tests',
+        }
+    })
+    @mock.patch("geonode.services.serviceprocessors.base.requests.get")
+    def test_get_capabilities_revalidated(self, mock_get):
+        url = "http://capabilities.example.com/wms?service=WMS&request=GetCapabilities"
+        base.cache.clear()
+        mock_get.return_value = mock.MagicMock(
+            status_code=200, content=b"<WMS_Capabilities/>", headers={"ETag": '"v1"'})
+        self.assertEqual(base.get_capabilities(url), b"<WMS_Capabilities/>")
+        base.get_capabilities(url)
+        self.assertEqual(mock_get.call_count, 1)
+
+        mock_get.return_value = mock.MagicMock(status_code=304, content=b"", headers={})
+        with override_settings(CAPABILITIES_CACHE_MAX_AGE=0):
+            self.assertEqual(base.get_capabilities(url), b"<WMS_Capabilities/>")
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(mock_get.call_args[1]["headers"]["If-None-Match"], '"v1"')
+
+    def test_probe_services_limits_host_concurrency(self):
+        lock = threading.Lock()
+        running = {}
+        max_running = {}
+
+        def probe_service(host, status):
+            def probe(timeout=None, retries=None):
+                with lock:
+                    running[host] = running.get(host, 0) + 1
+                    max_running[host] = max(max_running.get(host, 0), running[host])
+                time.sleep(0.05)
+                with lock:
+                    running[host] -= 1
+                return status
+            return probe
+
+        services = []
+        for i in range(6):
+            host = "host{}.example.com".format(i % 2)
+            service = mock.MagicMock(service_url="http://{}/wms/{}".format(host, i), probe=200)
+            service.probe_service.side_effect = probe_service(host, 404 if i == 5 else 200)
+            services.append(service)
+
+        changed = probe_services(services, workers=6, host_concurrency=2, timeout=1)
+        self.assertEqual(changed, [services[5]])
+        self.assertEqual(services[5].probe, 404)
+        self.assertEqual(max(max_running.values()), 2)
+
+    def test_probe_services_slow_host_does_not_hold_the_pool(self):
+        lock = threading.Lock()
+        finished = []
+
+        def probe_service(host, delay):
+            def probe(timeout=None, retries=None):
+                time.sleep(delay)
+                with lock:
+                    finished.append(host)
+                return 200
+            return probe
+
+        services = []
+        for i in range(5):
+            service = mock.MagicMock(service_url="http://slow.example.com/wms/{}".format(i), probe=200)
+            service.probe_service.side_effect = probe_service("slow.example.com", 0.2)
+            services.append(service)
+        service = mock.MagicMock(service_url="http://fast.example.com/wms", probe=200)
+        service.probe_service.side_effect = probe_service("fast.example.com", 0)
+        services.append(service)
+
+        changed = probe_services(services, workers=3, host_concurrency=2, timeout=1)
+        self.assertEqual(changed, [])
+        self.assertEqual(len(finished), 6)
+        # the fast host got a worker while the slow one kept probing
+        self.assertEqual(finished[0], "fast.example.com")
+
+    def test_harvest_resources_batch(self):
+        service_handler = base.ServiceHandlerBase("http://fake")
+        harvested = []
+
+        def harvest_resource(resource_id, geonode_service):
+            if resource_id == "broken":
+                raise RuntimeError("Resource {!r} cannot be harvested".format(resource_id))
+            harvested.append(resource_id)
+            service_handler._harvest_layer_thumbnail(resource_id)
+
+        with mock.patch.object(service_handler, "harvest_resource", side_effect=harvest_resource), \
+                mock.patch.object(service_handler, "_create_layer_thumbnail", create=True) as create_thumbnail:
+            errors = service_handler.harvest_resources(["first", "broken", "second"], None)
+        self.assertEqual(harvested, ["first", "second"])
+        self.assertEqual(list(errors.keys()), ["broken"])
+        self.assertEqual(
+            sorted(call[0][0] for call in create_thumbnail.call_args_list), ["first", "second"])
+        self.assertIsNone(service_handler._deferred_thumbnails)
+
     @mock.patch("geonode.services.serviceprocessors.handler.WmsServiceHandler",
                 autospec=True)
     def test_get_service_handler_wms(self, mock_wms_handler):
@@ -401,6 +501,14 @@ class WmsServiceHandlerTestCase(GeoNodeBaseTestSupport):
         }
         self.parsed_wms = mock_parsed_wms
 
+        # the capabilities documents are parsed by the mocked WebMapService
+        capabilities_patcher = mock.patch(
+            "geonode.services.serviceprocessors.base.get_capabilities",
+            return_value=b"<WMS_Capabilities/>")
+        capabilities_patcher.start()
+        self.addCleanup(capabilities_patcher.stop)
+        base._parsed_capabilities.clear()
+
         self.test_user, created = get_user_model().objects.get_or_create(username="serviceowner")
         if created:
             self.test_user.set_password("somepassword")
@@ -483,6 +591,17 @@ class WmsServiceHandlerTestCase(GeoNodeBaseTestSupport):
         self.assertEqual(result.name, handler.name)
         self.assertEqual(result.title, self.phony_title)
 
+    @mock.patch("geonode.services.serviceprocessors.wms.WebMapService",
+                autospec=True)
+    def test_capabilities_parsed_once(self, mock_wms):
+        mock_wms.return_value = (self.phony_url, self.parsed_wms)
+        handler = wms.WmsServiceHandler(self.phony_url)
+        handler.create_geonode_service(self.test_user)
+        handler.get_keywords()
+        list(handler.get_resources())
+        wms.WmsServiceHandler(self.phony_url).get_resource(self.phony_layer_name)
+        self.assertEqual(mock_wms.call_count, 1)
+
     @mock.patch("geonode.services.serviceprocessors.wms.WebMapService",
                 autospec=True)
     def test_get_keywords(self, mock_wms):
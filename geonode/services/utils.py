@@ -21,6 +21,13 @@ import re
 import math
 import logging
 
+from collections import defaultdict, deque
+from urllib.parse import urlsplit
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connection
+
 logger = logging.getLogger(__name__)
 
 
@@ -131,6 +138,63 @@ def decimal_encode(bbox):
     return _bbox
 
 
+def probe_services(services, workers=None, host_concurrency=None, timeout=None):
+    """
+    Probe the remote services concurrently and update their 'probe' status.
+
+    The probes are scheduled per host: at most 'host_concurrency' services of the
+    same host are submitted to the pool at once, the next one being queued only
+    when one of them completes, so that a slow host never occupies more than
+    'host_concurrency' workers and does not hold the probes of the others.
+    Each probe is limited to 'timeout' seconds.
+
+    :return: The services whose status changed.
+    """
+    workers = workers or getattr(settings, 'SERVICES_PROBE_WORKERS', 10)
+    host_concurrency = host_concurrency or getattr(settings, 'SERVICES_PROBE_HOST_CONCURRENCY', 2)
+    timeout = timeout or getattr(settings, 'SERVICES_PROBE_TIMEOUT', 10)
+    services = list(services)
+    pending_by_host = defaultdict(deque)
+    for idx, service in enumerate(services):
+        pending_by_host[urlsplit(service.service_url).netloc].append(idx)
+
+    def probe(service):
+        try:
+            return service.probe_service(timeout=timeout, retries=1)
+        except Exception as e:
+            logger.error(e)
+            return 404
+        finally:
+            # the worker threads must not leak their database connections
+            connection.close()
+
+    statuses = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+
+        def submit(host):
+            idx = pending_by_host[host].popleft()
+            running[executor.submit(probe, services[idx])] = (host, idx)
+
+        for host, pending in pending_by_host.items():
+            for _ in range(min(host_concurrency, len(pending))):
+                submit(host)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                host, idx = running.pop(future)
+                statuses[idx] = future.result()
+                if pending_by_host[host]:
+                    submit(host)
+
+    changed = []
+    for idx, service in enumerate(services):
+        if service.probe != statuses[idx]:
+            service.probe = statuses[idx]
+            changed.append(service)
+    return changed
+
+
 def test_resource_table_status(test_cls, table, is_row_filtered):
     tbody = table.find_elements_by_tag_name('tbody')
     rows = tbody[0].find_elements_by_tag_name('tr')
@@ -181,6 +181,7 @@ def harvest_resources(request, service_id):
         # Let's remove duplicates
         requested = list(set(requested))
         resources_to_harvest = []
+        harvest_job_ids = []
         for id in _gen_harvestable_ids(requested, available_resources):
             logger.debug("id: {}".format(id))
             harvest_job, created = HarvestJob.objects.get_or_create(
@@ -189,10 +190,14 @@ def harvest_resources(request, service_id):
             )
             if created or harvest_job.status != enumerations.PROCESSED:
                 resources_to_harvest.append(id)
-                tasks.harvest_resource.apply_async((harvest_job.id,))
+                harvest_job_ids.append(harvest_job.id)
             else:
                 logger.warning(
                     "resource {} already has a harvest job".format(id))
+        # The resources are harvested in batches, sharing the service setup
+        batch_size = getattr(settings, "HARVEST_BATCH_SIZE", 20)
+        for i in range(0, len(harvest_job_ids), batch_size):
+            tasks.harvest_resources.apply_async((harvest_job_ids[i:i + batch_size],))
         msg_async = _("The selected resources are being imported")
         msg_sync = _("The selected resources have been imported")
         messages.add_message(
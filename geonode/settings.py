@@ -24,6 +24,7 @@ import re
 import ast
 import sys
 import subprocess
+import tempfile
 import dj_database_url
 
 from datetime import timedelta
@@ -408,6 +409,43 @@ if MEMCACHED_ENABLED:
         'LOCATION': MEMCACHED_LOCATION,
     }
 
+# Cache alias storing the ids of the resources visible to every user and group.
+# It must be shared by all the GeoNode processes in order to be consistently invalidated.
+VISIBLE_RESOURCES_CACHE = os.getenv('VISIBLE_RESOURCES_CACHE', 'default')
+# Beyond this number of ids the visible resources are filtered by a permissions subquery
+VISIBLE_RESOURCES_MAX_IDS = int(os.getenv('VISIBLE_RESOURCES_MAX_IDS', 500))
+
+# Seconds the responses of the GeoServer authorization callbacks ('layer_acls' and 'resolve_user')
+# are cached for, per credentials; they are also expired by any permission change
+LAYER_ACLS_CACHE_TIMEOUT = int(os.getenv('LAYER_ACLS_CACHE_TIMEOUT', 60))
+
+# Seconds the search facets counts are cached for, per permission class and filters
+FACETS_CACHE_TIMEOUT = int(os.getenv('FACETS_CACHE_TIMEOUT', 60))
+
+# Seconds the capabilities documents of the remote services are used without being revalidated,
+# and seconds they are cached for
+CAPABILITIES_CACHE_MAX_AGE = int(os.getenv('CAPABILITIES_CACHE_MAX_AGE', 60))
+CAPABILITIES_CACHE_TIMEOUT = int(os.getenv('CAPABILITIES_CACHE_TIMEOUT', 86400))
+
+# Threads fetching the layers fragments of the aggregated GetCapabilities documents,
+# and seconds each fragment is cached for, until its layer is updated
+LAYER_CAPABILITIES_WORKERS = int(os.getenv('LAYER_CAPABILITIES_WORKERS', 8))
+LAYER_CAPABILITIES_CACHE_TIMEOUT = int(os.getenv('LAYER_CAPABILITIES_CACHE_TIMEOUT', 3600))
+
+# Concurrency of the remote services probes: overall, per host, and timeout in seconds of each probe
+SERVICES_PROBE_WORKERS = int(os.getenv('SERVICES_PROBE_WORKERS', 10))
+SERVICES_PROBE_HOST_CONCURRENCY = int(os.getenv('SERVICES_PROBE_HOST_CONCURRENCY', 2))
+SERVICES_PROBE_TIMEOUT = int(os.getenv('SERVICES_PROBE_TIMEOUT', 10))
+
+# Number of resources of a remote service harvested by each task, and threads rendering their thumbnails
+HARVEST_BATCH_SIZE = int(os.getenv('HARVEST_BATCH_SIZE', 20))
+HARVEST_THUMBNAIL_WORKERS = int(os.getenv('HARVEST_THUMBNAIL_WORKERS', 4))
+
+# Directory caching the original dataset archives, until their resources are updated
+DOWNLOAD_CACHE_DIR = os.getenv('DOWNLOAD_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'geonode_downloads'))
+# Size quota of the cached archives in bytes, the least recently used ones are evicted first
+DOWNLOAD_CACHE_MAX_SIZE = int(os.getenv('DOWNLOAD_CACHE_MAX_SIZE', 2 * 1024 ** 3))
+
 GEONODE_CORE_APPS = (
     # GeoNode internal apps
     'geonode.api',
@@ -1272,7 +1310,10 @@ if HAYSTACK_SEARCH:
             'INDEX_NAME': os.getenv('HAYSTACK_ENGINE_INDEX_NAME', 'haystack'),
         },
     }
-    HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
+    # index the saved objects in batches, from the 'search' queue
+    HAYSTACK_SIGNAL_PROCESSOR = 'geonode.base.indexing.SearchIndexSignalProcessor'
+    # seconds the updates of an object are coalesced before being indexed
+    HAYSTACK_INDEX_DELAY = int(os.getenv('HAYSTACK_INDEX_DELAY', '10'))
     HAYSTACK_SEARCH_RESULTS_PER_PAGE = int(os.getenv('HAYSTACK_SEARCH_RESULTS_PER_PAGE', '200'))
 
 # Available download formats
@@ -1773,6 +1814,8 @@ CELERY_TASK_QUEUES = (
     Queue('update', GEONODE_EXCHANGE, routing_key='update', priority=0),
     Queue('cleanup', GEONODE_EXCHANGE, routing_key='cleanup', priority=0),
     Queue('email', GEONODE_EXCHANGE, routing_key='email', priority=0),
+    Queue('search', GEONODE_EXCHANGE, routing_key='search', priority=0),
+    Queue('thumbnails', GEONODE_EXCHANGE, routing_key='thumbnails', priority=0),
 )
 
 if USE_GEOSERVER:
@@ -1816,6 +1859,10 @@ if 'geonode.services' in INSTALLED_APPS:
     }
 
 DELAYED_SECURITY_SIGNALS = ast.literal_eval(os.environ.get('DELAYED_SECURITY_SIGNALS', 'False'))
+# Number of dirty layers synced with GeoFence by each 'synch_guardian' task,
+# and seconds after which an unfinished sync is not waited for anymore
+SECURITY_SYNC_CHUNK_SIZE = int(os.getenv('SECURITY_SYNC_CHUNK_SIZE', 100))
+SECURITY_SYNC_TIMEOUT = int(os.getenv('SECURITY_SYNC_TIMEOUT', 3600))
 CELERY_ENABLE_UTC = ast.literal_eval(os.environ.get('CELERY_ENABLE_UTC', 'True'))
 CELERY_TIMEZONE = TIME_ZONE
 
@@ -2073,6 +2120,13 @@ MONITORING_DATA_TTL = timedelta(days=int(os.getenv("MONITORING_DATA_TTL", 365)))
 # use with caution - for dev purpose only
 MONITORING_DISABLE_CSRF = ast.literal_eval(os.environ.get('MONITORING_DISABLE_CSRF', 'False'))
 
+# write the monitored requests in batches from a background thread,
+# requests are dropped when more than MONITORING_QUEUE_SIZE are waiting
+MONITORING_BATCH_WRITER = ast.literal_eval(os.environ.get('MONITORING_BATCH_WRITER', 'False'))
+MONITORING_QUEUE_SIZE = int(os.getenv('MONITORING_QUEUE_SIZE', 10000))
+MONITORING_BATCH_SIZE = int(os.getenv('MONITORING_BATCH_SIZE', 500))
+MONITORING_FLUSH_INTERVAL = float(os.getenv('MONITORING_FLUSH_INTERVAL', 5))
+
 if MONITORING_ENABLED:
     if 'geonode.monitoring' not in INSTALLED_APPS:
         INSTALLED_APPS += ('geonode.monitoring',)
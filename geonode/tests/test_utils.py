@@ -2,14 +2,20 @@ import os
 import shutil
 import zipfile
 import tempfile
+import requests
 
 from osgeo import ogr
 from datetime import datetime, timedelta
-from unittest.mock import patch
+from http.client import HTTPMessage
+from unittest.mock import patch, MagicMock
+
+from django.utils import timezone
 
 from geonode.br.management.commands.utils.utils import ignore_time
 from geonode.tests.base import GeoNodeBaseTestSupport
-from geonode.utils import copy_tree, fixup_shp_columnnames, unzip_file
+from geonode.utils import (
+    copy_tree, fixup_shp_columnnames, unzip_file, HttpClient,
+    bbox_to_projection, bboxes_to_projection, get_coordinate_transformation)
 
 
 class TestCopyTree(GeoNodeBaseTestSupport):
@@ -109,3 +115,97 @@ class TestFixupShp(GeoNodeBaseTestSupport):
         shp_parent = os.path.dirname(layer_shp)
         if shp_parent.startswith(tempfile.gettempdir()):
             shutil.rmtree(shp_parent)
+
+
+class TestHttpClient(GeoNodeBaseTestSupport):
+    def test_session_reused_per_host(self):
+        client = HttpClient()
+        session = client.get_session('http://localhost:8080/geoserver/ows')
+        self.assertIs(session, client.get_session('http://localhost:8080/geoserver/rest'))
+        self.assertIsNot(session, client.get_session('http://example.com/ows'))
+        self.assertIsNot(session, client.get_session('http://localhost:8080/geoserver/ows', retries=1))
+        stats = client.get_pool_stats()
+        self.assertEqual(stats['http://localhost:8080']['sessions'], 2)
+        self.assertEqual(stats['http://example.com']['sessions'], 1)
+
+    def test_session_cookies_not_shared(self):
+        sent = []
+
+        def send(request, **kwargs):
+            sent.append(request)
+            msg = HTTPMessage()
+            msg['Set-Cookie'] = 'JSESSIONID=admin-session; Path=/'
+            response = requests.models.Response()
+            response.status_code = 200
+            response.headers = requests.structures.CaseInsensitiveDict(msg.items())
+            response.raw = MagicMock(_original_response=MagicMock(msg=msg))
+            response._content = b''
+            response.request = request
+            response.url = request.url
+            requests.cookies.extract_cookies_to_jar(response.cookies, request, response.raw)
+            return response
+
+        session = HttpClient().get_session('http://localhost:8080/geoserver/ows')
+        with patch.object(requests.adapters.HTTPAdapter, 'send', side_effect=send):
+            response = session.get('http://localhost:8080/geoserver/rest/about', auth=('admin', 'geoserver'))
+            self.assertEqual(response.cookies.get('JSESSIONID'), 'admin-session')
+            session.get('http://localhost:8080/geoserver/ows')
+        # the cookie set for the first caller is not sent along with the next request
+        self.assertEqual(len(session.cookies), 0)
+        self.assertNotIn('Cookie', sent[1].headers)
+
+    @patch('geonode.utils.get_or_create_token')
+    def test_token_cached_until_expiry(self, patch_get_or_create_token):
+        token = patch_get_or_create_token.return_value
+        token.token = 'token'
+        token.is_expired.return_value = False
+        token.expires = timezone.now() + timedelta(hours=1)
+        client = HttpClient()
+        self.assertEqual(client.get_token('admin'), 'token')
+        self.assertEqual(client.get_token('admin'), 'token')
+        self.assertEqual(patch_get_or_create_token.call_count, 1)
+
+        client.invalidate_token('admin')
+        token.expires = timezone.now()
+        self.assertEqual(client.get_token('admin'), 'token')
+        self.assertEqual(client.get_token('admin'), 'token')
+        self.assertEqual(patch_get_or_create_token.call_count, 3)
+
+
+class TestBboxToProjection(GeoNodeBaseTestSupport):
+    def test_coordinate_transformation_cached(self):
+        self.assertIs(get_coordinate_transformation(4326, 3857), get_coordinate_transformation(4326, 3857))
+        self.assertIsNot(get_coordinate_transformation(4326, 3857), get_coordinate_transformation(3857, 4326))
+
+    def test_bboxes_to_projection(self):
+        native_bboxes = [
+            [-180.0, 180.0, -90.0, 90.0, 'EPSG:4326'],
+            [10.0, 20.0, 30.0, 40.0, 'EPSG:4326'],
+            [1113194.9079327357, 2226389.8158654715, 3503549.843504374, 4865942.279503176, 'EPSG:3857'],
+            [10.0, 20.0, 30.0, 40.0, 'EPSG:3857'],
+        ]
+        projected = bboxes_to_projection(native_bboxes, target_srid=3857)
+        self.assertEqual(len(projected), 4)
+        self.assertEqual(projected[2:], native_bboxes[2:])
+        for native_bbox, projected_bbox in zip(native_bboxes, projected):
+            self.assertEqual(bbox_to_projection(native_bbox, target_srid=3857), projected_bbox)
+        for coord, check in zip(projected[1][:4], native_bboxes[2][:4]):
+            self.assertAlmostEqual(float(coord), check, places=3)
+        self.assertEqual(projected[1][4], 'EPSG:3857')
+
+    @patch('geonode.utils.get_coordinate_transformation')
+    def test_bboxes_to_projection_fallback(self, get_coordinate_transformation):
+        def transform_points(points):
+            if any(x == 999.0 for x, y in points):
+                raise RuntimeError('Point outside of projection domain')
+            return [(x * 2, y * 2, 0) for x, y in points]
+
+        get_coordinate_transformation.return_value.TransformPoints.side_effect = transform_points
+        native_bboxes = [
+            [1.0, 2.0, 3.0, 4.0, 'EPSG:32632'],
+            [1.0, 999.0, 3.0, 4.0, 'EPSG:32632'],
+        ]
+        projected = bboxes_to_projection(native_bboxes, target_srid=4326)
+        # Only the failing bbox is returned unprojected
+        self.assertEqual(projected[0], ('2.0', '4.0', '6.0', '8.0', 'EPSG:4326'))
+        self.assertEqual(projected[1], native_bboxes[1])
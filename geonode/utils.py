@@ -22,6 +22,8 @@ import gc
 import re
 import six
 import ast
+import glob
+import http.cookiejar
 import copy
 import json
 import time
@@ -34,8 +36,10 @@ import tarfile
 import datetime
 import requests
 import tempfile
+import threading
 import traceback
 import subprocess
+import weakref
 
 from osgeo import ogr
 from io import StringIO
@@ -43,13 +47,15 @@ from decimal import Decimal
 from slugify import slugify
 from contextlib import closing
 from collections import defaultdict
+from functools import lru_cache
 from math import atan, exp, log, pi, sin, tan, floor
-from zipfile import ZipFile, is_zipfile, ZIP_DEFLATED
+from zipfile import ZipFile, ZipInfo, is_zipfile, ZIP_DEFLATED
 from requests.packages.urllib3.util.retry import Retry
 
 from django.conf import settings
 from django.core.cache import cache
 from django.db.models import signals
+from django.utils import timezone
 from django.utils.http import is_safe_url
 from django.apps import apps as django_apps
 from django.middleware.csrf import get_token
@@ -347,51 +353,114 @@ def _v(coord, x, source_srid=4326, target_srid=3857):
     return coord
 
 
-def bbox_to_projection(native_bbox, target_srid=4326):
+@lru_cache(maxsize=None)
+def _use_traditional_axis_order():
+    # AF: This causses error with GDAL 3.0.4 due to a breaking change on GDAL
+    #     https://code.djangoproject.com/ticket/30645
+    import osgeo.gdal
+    _gdal_ver = osgeo.gdal.__version__.split(".", 2)
+    return int(_gdal_ver[0]) >= 3 and \
+        ((int(_gdal_ver[1]) == 0 and int(_gdal_ver[2]) >= 4) or int(_gdal_ver[1]) > 0)
+
+
+def _create_coordinate_transformation(source_srid, target_srid):
+    from osgeo.osr import SpatialReference, CoordinateTransformation
+    source = SpatialReference()
+    source.ImportFromEPSG(source_srid)
+    dest = SpatialReference()
+    dest.ImportFromEPSG(target_srid)
+    if _use_traditional_axis_order():
+        source.SetAxisMappingStrategy(0)
+        dest.SetAxisMappingStrategy(0)
+    return CoordinateTransformation(source, dest)
+
+
+_coordinate_transformations = threading.local()
+
+
+def get_coordinate_transformation(source_srid, target_srid):
     """
-        native_bbox must be in the form
-            ('-81.3962935', '-81.3490249', '13.3202891', '13.3859614', 'EPSG:4326')
+    Returns the CoordinateTransformation between two EPSG codes.
+
+    Transformations are LRU cached by thread, since OGR ones are not thread-safe.
     """
-    box = native_bbox[:4]
-    proj = native_bbox[-1]
-    minx, maxx, miny, maxy = [float(a) for a in box]
-    try:
-        source_srid = int(proj.split(":")[1]) if proj and ':' in proj else int(proj)
-    except Exception:
-        source_srid = target_srid
+    transformations = getattr(_coordinate_transformations, 'cache', None)
+    if transformations is None:
+        transformations = _coordinate_transformations.cache = lru_cache(
+            maxsize=64)(_create_coordinate_transformation)
+    return transformations(source_srid, target_srid)
+
+
+def bboxes_to_projection(native_bboxes, target_srid=4326):
+    """
+        Reprojects a list of bboxes, with a single transformation of all the
+        corners sharing the same source projection.
 
-    if source_srid != target_srid:
+        native_bboxes items must be in the form
+            ('-81.3962935', '-81.3490249', '13.3202891', '13.3859614', 'EPSG:4326')
+        the bboxes which can't be reprojected are returned as they are.
+    """
+    import numpy as np
+
+    projected_bboxes = list(native_bboxes)
+    corners_by_srid = defaultdict(list)
+    for idx, native_bbox in enumerate(native_bboxes):
+        box = native_bbox[:4]
+        proj = native_bbox[-1]
+        minx, maxx, miny, maxy = [float(a) for a in box]
         try:
-            wkt = bbox_to_wkt(_v(minx, x=True, source_srid=source_srid, target_srid=target_srid),
-                              _v(maxx, x=True, source_srid=source_srid, target_srid=target_srid),
-                              _v(miny, x=False, source_srid=source_srid, target_srid=target_srid),
-                              _v(maxy, x=False, source_srid=source_srid, target_srid=target_srid),
-                              srid=source_srid, include_srid=False)
-            # AF: This causses error with GDAL 3.0.4 due to a breaking change on GDAL
-            #     https://code.djangoproject.com/ticket/30645
-            import osgeo.gdal
-            _gdal_ver = osgeo.gdal.__version__.split(".", 2)
-            from osgeo import ogr
-            from osgeo.osr import SpatialReference, CoordinateTransformation
-            g = ogr.Geometry(wkt=wkt)
-            source = SpatialReference()
-            source.ImportFromEPSG(source_srid)
-            dest = SpatialReference()
-            dest.ImportFromEPSG(target_srid)
-            if int(_gdal_ver[0]) >= 3 and \
-            ((int(_gdal_ver[1]) == 0 and int(_gdal_ver[2]) >= 4) or int(_gdal_ver[1]) > 0):
-                source.SetAxisMappingStrategy(0)
-                dest.SetAxisMappingStrategy(0)
-            g.Transform(CoordinateTransformation(source, dest))
-            projected_bbox = [str(x) for x in g.GetEnvelope()]
-            # Must be in the form : [x0, x1, y0, y1, EPSG:<target_srid>)
-            return tuple([projected_bbox[0], projected_bbox[1], projected_bbox[2], projected_bbox[3]]) + \
-                ("EPSG:%s" % target_srid,)
+            source_srid = int(proj.split(":")[1]) if proj and ':' in proj else int(proj)
+        except Exception:
+            source_srid = target_srid
+
+        if source_srid != target_srid:
+            x0 = _v(minx, x=True, source_srid=source_srid, target_srid=target_srid)
+            x1 = _v(maxx, x=True, source_srid=source_srid, target_srid=target_srid)
+            y0 = _v(miny, x=False, source_srid=source_srid, target_srid=target_srid)
+            y1 = _v(maxy, x=False, source_srid=source_srid, target_srid=target_srid)
+            corners_by_srid[source_srid].append((idx, ((x0, y0), (x0, y1), (x1, y1), (x1, y0)),))
+
+    def _transform(transformation, corners):
+        points = np.array(transformation.TransformPoints(
+            [point for idx, _corners in corners for point in _corners]), dtype=float)
+        points = points[:, :2].reshape(-1, 4, 2)
+        mins = points.min(axis=1)
+        maxs = points.max(axis=1)
+        valid = np.isfinite(mins).all(axis=1) & np.isfinite(maxs).all(axis=1)
+        for (idx, _corners), (x0, y0), (x1, y1), _valid in zip(corners, mins, maxs, valid):
+            if _valid:
+                # Must be in the form : [x0, x1, y0, y1, EPSG:<target_srid>)
+                projected_bboxes[idx] = tuple(str(float(c)) for c in (x0, x1, y0, y1)) + \
+                    ("EPSG:%s" % target_srid,)
+
+    for source_srid, corners in corners_by_srid.items():
+        try:
+            transformation = get_coordinate_transformation(source_srid, target_srid)
         except Exception:
             tb = traceback.format_exc()
             logger.error(tb)
+            continue
+        try:
+            _transform(transformation, corners)
+        except Exception:
+            # A single bbox out of the projection domain makes the whole batch
+            # fail: fall back to the bboxes one by one
+            for _corners in corners:
+                try:
+                    _transform(transformation, [_corners])
+                except Exception:
+                    tb = traceback.format_exc()
+                    logger.error(tb)
 
-    return native_bbox
+    return projected_bboxes
+
+
+def bbox_to_projection(native_bbox, target_srid=4326):
+    """
+        native_bbox must be in the form
+            ('-81.3962935', '-81.3490249', '13.3202891', '13.3859614', 'EPSG:4326')
+    """
+    return bboxes_to_projection([native_bbox], target_srid=target_srid)[0]
 
 
 def bounds_to_zoom_level(bounds, width, height):
@@ -600,10 +669,8 @@ class GXPMapBase(object):
                     return k
             return None
 
-        def layer_config(lyr, user=None):
-            cfg = lyr.layer_config(user=user)
-            src_cfg = lyr.source_config(access_token)
-            source = source_lookup(src_cfg)
+        def layer_config(lyr, cfg):
+            source = source_lookup(lyr.source_config(access_token))
             if source:
                 cfg["source"] = source
             return cfg
@@ -638,18 +705,11 @@ class GXPMapBase(object):
                             ] = lyr["source"]
 
         # adding remote services sources
-        from geonode.services.models import Service
+        from geonode.services.models import get_remote_sources
         from geonode.maps.models import Map
         if not self.sender or isinstance(self.sender, Map):
             index = int(max(sources.keys())) if len(sources.keys()) > 0 else 0
-            for service in Service.objects.all():
-                remote_source = {
-                    'url': service.service_url,
-                    'remote': True,
-                    'ptype': service.ptype,
-                    'name': service.name,
-                    'title': "[R] %s" % service.title
-                }
+            for remote_source in get_remote_sources():
                 if remote_source['url'] not in source_urls:
                     index += 1
                     sources[index] = remote_source
@@ -664,7 +724,8 @@ class GXPMapBase(object):
             'defaultSourceType': "gxp_wmscsource",
             'sources': sources,
             'map': {
-                'layers': [layer_config(lyr, user=user) for lyr in layers],
+                'layers': [
+                    layer_config(lyr, cfg) for lyr, cfg in zip(layers, self.layers_config(layers, user=user))],
                 'center': [self.center_x, self.center_y],
                 'projection': self.projection,
                 'zoom': self.zoom
@@ -681,7 +742,7 @@ class GXPMapBase(object):
         config["map"].update(_get_viewer_projection_info(self.projection))
 
         # Create user-specific cache of maplayer config
-        if self is not None:
+        if self.id and len(added_layers) == 0:
             cache.set("viewer_json_" +
                       str(self.id) +
                       "_" +
@@ -692,6 +753,12 @@ class GXPMapBase(object):
         config = hookset.viewer_json(config, context={'request': request})
         return config
 
+    def layers_config(self, layers, user=None):
+        """
+        Returns the GXP configuration of each one of the given layers.
+        """
+        return [lyr.layer_config(user=user) for lyr in layers]
+
 
 class GXPMap(GXPMapBase):
 
@@ -1400,6 +1467,15 @@ def check_ogc_backend(backend_package):
 
 
 class HttpClient(object):
+    """
+    HTTP client for the OGC server and remote services.
+
+    Sessions are pooled per thread and per host, so the connections are reused
+    across requests, without keeping any cookie, and the bearer tokens of the users are cached until expiry.
+    """
+
+    # seconds before expiry a cached token is considered expired
+    TOKEN_EXPIRY_MARGIN = 60
 
     def __init__(self):
         self.timeout = 30
@@ -1421,18 +1497,101 @@ class HttpClient(object):
             'POOL_CONNECTIONS' in ogc_server_settings else 10
             self.username = ogc_server_settings['USER'] if 'USER' in ogc_server_settings else 'admin'
             self.password = ogc_server_settings['PASSWORD'] if 'PASSWORD' in ogc_server_settings else 'geoserver'
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sessions = weakref.WeakValueDictionary()
+        self._tokens = {}
+
+    def get_session(self, url, retries=None):
+        """
+        Returns the session of the current thread for the scheme and host of the url
+        """
+        retries = retries or self.retries
+        _url = urlsplit(url)
+        key = (_url.scheme, _url.netloc, retries)
+        sessions = getattr(self._local, 'sessions', None)
+        if sessions is None:
+            sessions = self._local.sessions = {}
+        session = sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            retry = Retry(
+                total=retries,
+                read=retries,
+                connect=retries,
+                backoff_factor=self.backoff_factor,
+                status_forcelist=self.status_forcelist,
+            )
+            adapter = requests.adapters.HTTPAdapter(
+                max_retries=retry,
+                pool_maxsize=self.pool_maxsize,
+                pool_connections=self.pool_connections
+            )
+            session.mount("{scheme}://".format(scheme=_url.scheme), adapter)
+            session.verify = False
+            # the session is shared by the requests of every user: only the
+            # connections are pooled, the cookies set by a response are never
+            # sent along with the next requests
+            session.cookies = requests.cookies.RequestsCookieJar(
+                policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            sessions[key] = session
+            with self._lock:
+                self._sessions[(threading.get_ident(),) + key] = session
+        return session
+
+    def get_pool_stats(self):
+        """
+        Returns the number of sessions, open connections and requests sent by host
+        """
+        stats = {}
+        with self._lock:
+            sessions = list(self._sessions.items())
+        for (thread_id, scheme, netloc, retries), session in sessions:
+            host_stats = stats.setdefault(
+                "{}://{}".format(scheme, netloc), {'sessions': 0, 'connections': 0, 'requests': 0})
+            host_stats['sessions'] += 1
+            for adapter in session.adapters.values():
+                for pool_key in list(adapter.poolmanager.pools.keys()):
+                    pool = adapter.poolmanager.pools.get(pool_key)
+                    if pool is not None:
+                        host_stats['connections'] += pool.num_connections
+                        host_stats['requests'] += pool.num_requests
+        return stats
+
+    def _get_username(self, user=None):
+        if user and not isinstance(user, six.string_types):
+            return user.username
+        return user or self.username
+
+    def get_token(self, user=None):
+        """
+        Returns the bearer token of the user, the cached one if not expired
+        """
+        username = self._get_username(user)
+        cached = self._tokens.get(username)
+        if cached and cached[1] > timezone.now() + datetime.timedelta(seconds=self.TOKEN_EXPIRY_MARGIN):
+            return cached[0]
+        if not user or isinstance(user, six.string_types):
+            user = get_user_model().objects.get(username=username)
+        access_token = get_or_create_token(user)
+        if access_token and not access_token.is_expired():
+            self._tokens[username] = (access_token.token, access_token.expires)
+            return access_token.token
+
+    def invalidate_token(self, user=None):
+        self._tokens.pop(self._get_username(user), None)
 
     def request(self, url, method='GET', data=None, headers={}, stream=False, timeout=None, retries=None, user=None):
+        headers = dict(headers or {})
+        token_cached = False
         if (user or self.username != 'admin') and \
         check_ogc_backend(geoserver.BACKEND_PACKAGE) and 'Authorization' not in headers:
-            if connection.cursor().db.vendor not in ('sqlite', 'sqlite3', 'spatialite'):
+            if connection.vendor not in ('sqlite', 'sqlite3', 'spatialite'):
                 try:
-                    if user and isinstance(user, six.string_types):
-                        user = get_user_model().objects.get(username=user)
-                    _u = user or get_user_model().objects.get(username=self.username)
-                    access_token = get_or_create_token(_u)
-                    if access_token and not access_token.is_expired():
-                        headers['Authorization'] = 'Bearer %s' % access_token.token
+                    token_cached = self._get_username(user) in self._tokens
+                    access_token = self.get_token(user)
+                    if access_token:
+                        headers['Authorization'] = 'Bearer %s' % access_token
                 except Exception:
                     tb = traceback.format_exc()
                     logger.debug(tb)
@@ -1443,21 +1602,7 @@ class HttpClient(object):
 
         response = None
         content = None
-        session = requests.Session()
-        retry = Retry(
-            total=retries or self.retries,
-            read=retries or self.retries,
-            connect=retries or self.retries,
-            backoff_factor=self.backoff_factor,
-            status_forcelist=self.status_forcelist,
-        )
-        adapter = requests.adapters.HTTPAdapter(
-            max_retries=retry,
-            pool_maxsize=self.pool_maxsize,
-            pool_connections=self.pool_connections
-        )
-        session.mount("{scheme}://".format(scheme=urlsplit(url).scheme), adapter)
-        session.verify = False
+        session = self.get_session(url, retries=retries)
         action = getattr(session, method.lower(), None)
         if action:
             response = action(
@@ -1469,6 +1614,13 @@ class HttpClient(object):
         else:
             response = session.get(url, headers=headers, timeout=self.timeout)
 
+        if token_cached and response.status_code == 401:
+            # the cached token may have been revoked, retry with a new one
+            self.invalidate_token(user)
+            headers.pop('Authorization', None)
+            return self.request(url, method=method, data=data, headers=headers, stream=stream,
+                                timeout=timeout, retries=retries, user=user)
+
         try:
             content = ensure_string(response.content) if not stream else response.raw
         except Exception:
@@ -1518,6 +1670,131 @@ def zip_dir(basedir, archivename):
                 z.write(absfn, zfn)
 
 
+class _ZipStreamWriter(object):
+    """Unseekable file object buffering the output of a ZipFile, so that it can be streamed"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        chunk = b''.join(self._chunks)
+        self._chunks = []
+        return chunk
+
+
+def zip_stream(entries, archive_file=None, chunk_size=64 * 1024):
+    """Generates the content of a ZIP archive, chunk by chunk.
+
+    'entries' is an iterable of (name, content) pairs, the content being either
+    a string or bytes, or a file object which is read and compressed by chunks.
+    If 'archive_file' is given, the entries are also written to it, which is replaced
+    only once the archive is complete. The entries given as (name, content, False)
+    triples are only streamed, and not written to 'archive_file'.
+    """
+    archive = tmp_file = None
+    if archive_file:
+        os.makedirs(os.path.dirname(archive_file), exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(archive_file), suffix='.tmp')
+        os.close(fd)
+        archive = ZipFile(tmp_file, "w", ZIP_DEFLATED, allowZip64=True)
+
+    def _open(zfile, name):
+        zinfo = ZipInfo(name, time.localtime()[0:6])
+        zinfo.compress_type = ZIP_DEFLATED
+        return zfile.open(zinfo, "w", force_zip64=True)
+
+    out = _ZipStreamWriter()
+    completed = False
+    try:
+        with ZipFile(out, "w", ZIP_DEFLATED, allowZip64=True) as z:
+            for entry in entries:
+                name, content = entry[:2]
+                archived = archive is not None and (len(entry) < 3 or entry[2])
+                if isinstance(content, (str, bytes)):
+                    z.writestr(name, content)
+                    if archived:
+                        archive.writestr(name, content)
+                else:
+                    with closing(content) as src, _open(z, name) as dest:
+                        copy = _open(archive, name) if archived else None
+                        try:
+                            for data in iter(lambda: src.read(chunk_size), b''):
+                                dest.write(data)
+                                if copy:
+                                    copy.write(data)
+                                yield out.pop()
+                        finally:
+                            if copy:
+                                copy.close()
+                yield out.pop()
+        yield out.pop()
+        completed = True
+    finally:
+        if archive is not None:
+            archive.close()
+            if completed:
+                os.replace(tmp_file, archive_file)
+            else:
+                os.remove(tmp_file)
+
+
+def get_download_archive_file(instance):
+    """
+    The cached archive of a resource, valid until the resource is updated.
+    """
+    last_updated = instance.last_updated.strftime("%Y%m%d%H%M%S%f") if instance.last_updated else "0"
+    return os.path.join(settings.DOWNLOAD_CACHE_DIR, "%s_%s.zip" % (instance.id, last_updated))
+
+
+def remove_download_archives(resource_id):
+    """
+    Removes the cached archives of a resource.
+    """
+    for archive_file in glob.glob(os.path.join(settings.DOWNLOAD_CACHE_DIR, "%s_*.zip" % resource_id)):
+        try:
+            os.remove(archive_file)
+        except OSError:
+            pass
+
+
+def purge_download_archives(max_size=None):
+    """
+    Removes the least recently used cached archives, until the size of the
+    'DOWNLOAD_CACHE_DIR' directory is within 'DOWNLOAD_CACHE_MAX_SIZE' bytes.
+    """
+    if max_size is None:
+        max_size = getattr(settings, 'DOWNLOAD_CACHE_MAX_SIZE', 2 * 1024 ** 3)
+    archives = []
+    for archive_file in glob.glob(os.path.join(settings.DOWNLOAD_CACHE_DIR, "*.zip")):
+        try:
+            stat = os.stat(archive_file)
+        except OSError:
+            continue
+        archives.append((stat.st_mtime, stat.st_size, archive_file))
+    total_size = sum(size for mtime, size, archive_file in archives)
+    for mtime, size, archive_file in sorted(archives):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(archive_file)
+        except OSError:
+            continue
+        total_size -= size
+
+
 def copy_tree(src, dst, symlinks=False, ignore=None):
     try:
         for item in os.listdir(src):
@@ -1812,8 +2089,8 @@ def set_resource_default_links(instance, layer, prune=False, **kwargs):
         # Thumbnail link
         logger.debug(" -- Resource Links[Thumbnail link]...")
         if os.path.splitext(settings.MISSING_THUMBNAIL)[0] in instance.get_thumbnail_url():
-            from geonode.geoserver.helpers import create_gs_thumbnail
-            create_gs_thumbnail(instance, overwrite=True, check_bbox=True)
+            from geonode.base.thumbnails import queue_thumbnail
+            queue_thumbnail(instance, overwrite=True, check_bbox=True)
         else:
             Link.objects.update_or_create(
                 resource=instance.resourcebase_ptr,